@@ -1,25 +1,33 @@
 import six.moves.builtins
 import logging
+import threading
 
 from blazeutils.datastructures import BlankObject
 from blazeutils.strings import randchars, randhash
 from blinker import Namespace
 import six
 from werkzeug.exceptions import HTTPException, InternalServerError
-from werkzeug.routing import Map
+from werkzeug.routing import Map, Rule
 
 from blazeweb.globals import ag, rg, settings, user
 from blazeweb.events import signal, SettingsConnectHelper, clear_old_beaker_sessions
 from blazeweb.exceptions import ProgrammingError
+from blazeweb.fragments import create_fragment_store
 from blazeweb.hierarchy import findobj, HierarchyImportError, \
-    listcomponents, visitmods, findview
+    listcomponents, visitmods, findview, ComponentTopology, \
+    FileIndex, HierarchyStats, get_topology, split_endpoint
 from blazeweb.logs import create_handlers_from_settings
 from blazeweb.mail import mail_programmers
-from blazeweb.templating import default_engine
+from blazeweb.manifest import load_manifest
+from blazeweb.markup import MarkupCache
+from blazeweb.routing import IndexedMapAdapter, StaticRouteIndex
+from blazeweb.static import StaticManifest
+from blazeweb.templating import default_engine, ReloadFileWatcher, RenderProfiler
 from blazeweb.users import UserProxy
 from blazeweb.utils import exception_with_context, abort, _Redirect, registry_has_object
+from blazeweb.utils.datastructures import LRUCache
 from blazeweb.utils.filesystem import mkdirs, copy_static_files
-from blazeweb.views import _RouteToTemplate, _Forward
+from blazeweb.views import _RouteToTemplate, _Forward, add_asview_routes
 from blazeweb.wrappers import Request
 
 log = logging.getLogger(__name__)
@@ -54,6 +62,8 @@ class RequestManager(object):
 
     def init_routing(self):
         rg.urladapter = ag.route_map.bind_to_environ(self.environ)
+        if ag.route_index is not None:
+            rg.urladapter = IndexedMapAdapter(rg.urladapter, ag.route_index)
 
     def init_user(self):
         return self.user_proxy_class()
@@ -132,12 +142,16 @@ class WSGIApp(object):
 
     def __init__(self, module_or_settings, profile=None):
         self._id = randhash()
+        self._component_lock = threading.Lock()
 
         self.init_ag()
         self.init_settings(module_or_settings, profile)
+        self.init_hierarchy_stats()
         self.init_signals()
+        self.init_manifest()
         self.init_events()
         self.init_component_settings()
+        self.init_hierarchy()
         self.init_auto_actions()
         self.init_logging()
         self.init_routing()
@@ -168,6 +182,22 @@ class WSGIApp(object):
         self.ag.view_functions = {}
         self.ag.hierarchy_import_cache = {}
         self.ag.hierarchy_file_cache = {}
+        self.ag.hierarchy_endpoint_index = {}
+        # negative caches aren't used until the component map is final, see
+        # init_hierarchy()
+        self.ag.hierarchy_import_misses = None
+        self.ag.hierarchy_file_misses = None
+        self.ag.hierarchy_topology = None
+        self.ag.hierarchy_manifest = None
+        self.ag.hierarchy_file_index = None
+        self.ag.hierarchy_stats = None
+        self.ag.loaded_components = None
+        self.ag.url_cache = None
+        self.ag.static_manifest = None
+        self.ag.written_bundles = set()
+        self.ag.fragment_store = None
+        self.ag.markup_cache = None
+        self.ag.template_profiler = None
         self.ag.events_namespace = Namespace()
         ag._push_object(self.ag)
 
@@ -182,14 +212,42 @@ class WSGIApp(object):
             signal('blazeweb.logging.initialized'),
             signal('blazeweb.routing.initialized'),
             signal('blazeweb.templating.initialized'),
+            signal('blazeweb.templating.reload'),
             signal('blazeweb.request.started'),
             signal('blazeweb.response_cycle.started'),
             signal('blazeweb.response_cycle.ended'),
             signal('blazeweb.request.ended'),
         )
 
+    def init_hierarchy_stats(self):
+        # set up before anything is looked up in the hierarchy so that the
+        # lookups done while starting up are counted too
+        if self.settings.hierarchy.stats.enabled:
+            self.ag.hierarchy_stats = HierarchyStats()
+
+    def init_manifest(self):
+        # a startup manifest lets the hierarchy skip probing for modules and
+        # files that it already knows the answer for
+        if self.settings.hierarchy.manifest.enabled:
+            manifest = load_manifest(self.settings)
+            if manifest is not None:
+                manifest.apply(self.ag)
+        if self.settings.hierarchy.lazy_components:
+            # the routes of the components' views come from the manifest, so
+            # without one the components have to be loaded now
+            if self.ag.hierarchy_manifest is None:
+                log.warning('hierarchy.lazy_components is enabled, but there is no valid'
+                            ' startup manifest; loading the components at startup')
+            else:
+                self.ag.loaded_components = set()
+
     def init_events(self):
-        visitmods('events')
+        if self.ag.loaded_components is not None:
+            # component events are visited when the component is first used,
+            # see load_component()
+            visitmods('events', layers=get_topology().app_mappings)
+        else:
+            visitmods('events')
         signal('blazeweb.events.initialized').send(self.init_events)
 
     def init_component_settings(self):
@@ -224,6 +282,21 @@ class WSGIApp(object):
         # point would probably be an accident
         self.settings.lock()
 
+    def init_hierarchy(self):
+        # the settings are locked, so the component map can't change anymore.
+        # Now the hierarchy can be compiled once and it's safe to remember
+        # what was not found in it.
+        self.ag.hierarchy_topology = ComponentTopology(self.settings)
+        size = self.settings.hierarchy.negative_cache_size
+        if size:
+            self.ag.hierarchy_import_misses = LRUCache(size)
+            self.ag.hierarchy_file_misses = LRUCache(size)
+        if self.settings.hierarchy.file_index.enabled:
+            self.ag.hierarchy_file_index = FileIndex(
+                self.ag.hierarchy_topology,
+                poll_interval=self.settings.hierarchy.file_index.poll_interval,
+            )
+
     def init_auto_actions(self):
         # create the writeable directories if they don't exist already
         if self.settings.auto_create_writeable_dirs:
@@ -233,6 +306,11 @@ class WSGIApp(object):
         # copy static files if requested
         if self.settings.auto_copy_static.enabled:
             copy_static_files(self.settings.auto_copy_static.delete_existing)
+        # fingerprinted static file URLs
+        if self.settings.static_files.fingerprint.enabled:
+            self.ag.static_manifest = StaticManifest.load_or_build(
+                self.settings.static_files.fingerprint.fpath
+            )
         if self.settings.auto_abort_as_builtin is True:
             six.moves.builtins.dabort = abort
 
@@ -248,8 +326,27 @@ class WSGIApp(object):
         self.ag.route_map = Map(**self.settings.routing.map.todict())
 
         # load view modules so routes from @asview() get setup correctly
+        hsettings = self.settings.hierarchy
         if self.settings.auto_load_views:
-            visitmods('views')
+            if self.ag.loaded_components is not None:
+                # only the apps' views are loaded now.  The routes of the
+                # components' views come from the startup manifest.
+                visitmods(
+                    'views',
+                    reloadmod=not hsettings.shared_modules,
+                    call_with_mod=add_asview_routes,
+                    layers=self.ag.hierarchy_topology.app_mappings,
+                )
+                for lrule, endpoint, options in self.ag.hierarchy_manifest.routes:
+                    self.ag.route_map.add(Rule(lrule, endpoint=endpoint), **options)
+            elif hsettings.shared_modules or hsettings.lazy_components:
+                # the modules are imported once per process (or lazy loading
+                # fell back to loading everything), so the routes are added
+                # from what @asview recorded when they were loaded
+                visitmods('views', reloadmod=not hsettings.shared_modules,
+                          call_with_mod=add_asview_routes)
+            else:
+                visitmods('views')
 
         # application routes first since they should take precedence
         self.add_routing_rules(self.settings.routing.routes)
@@ -263,9 +360,42 @@ class WSGIApp(object):
                 if "no attribute 'routes'" not in str(e):
                     raise  # pragma: no cover
 
+        self.ag.route_index = None
+        if self.settings.routing.static_index:
+            self.ag.route_index = StaticRouteIndex(self.ag.route_map)
+        if self.settings.routing.url_cache_size:
+            self.ag.url_cache = LRUCache(self.settings.routing.url_cache_size)
+
     def init_templating(self):
         engine = default_engine()
         self.ag.tplengine = engine()
+        if self.settings.templating.profiler.enabled:
+            self.ag.template_profiler = RenderProfiler()
+        if self.settings.fragment_cache.enabled:
+            self.ag.fragment_store = create_fragment_store(self.settings.fragment_cache)
+        if self.settings.templating.markup_cache.size:
+            self.ag.markup_cache = MarkupCache(
+                self.settings.templating.markup_cache.size,
+                self.settings.templating.markup_cache.dir,
+            )
+        signal('blazeweb.templating.reload').connect(self.reload_templates)
+        self.ag.template_reload_watcher = None
+        if self.settings.templating.reload_file:
+            self.ag.template_reload_watcher = ReloadFileWatcher(
+                self.settings.templating.reload_file,
+                self.reload_templates,
+            )
+
+    def reload_templates(self, sender=None):
+        # the signal is process wide, so it can be handled while another
+        # application's globals are on the proxies
+        ag._push_object(self.ag)
+        settings._push_object(self.settings)
+        try:
+            self.ag.tplengine.reload()
+        finally:
+            settings._pop_object(self.settings)
+            ag._pop_object(self.ag)
 
     def add_routing_rules(self, rules):
         for rule in rules or ():
@@ -283,12 +413,41 @@ class WSGIApp(object):
             with self.response_context(error_doc_code):
                 endpoint, args = rg.forward_queue[-1]
                 signal('blazeweb.response_cycle.started').send(endpoint=endpoint, urlargs=args)
+                profiler = self.ag.template_profiler
+                if profiler is not None:
+                    profiler.start(endpoint)
                 response = self.dispatch_to_endpoint(endpoint, args)
+                if profiler is not None and self.settings.templating.profiler.header \
+                        and hasattr(response, 'headers'):
+                    response.headers['X-Template-Profile'] = profiler.header()
                 signal('blazeweb.response_cycle.ended').send(response=response)
                 return response
 
+    def load_component(self, pname):
+        """
+            With settings.hierarchy.lazy_components, imports the events and
+            views modules of the component the first time one of its endpoints
+            is dispatched to.
+        """
+        loaded = self.ag.loaded_components
+        if loaded is None or pname in loaded:
+            return
+        with self._component_lock:
+            if pname in loaded:
+                return
+            log.debug('lazy loading component %s', pname)
+            layers = self.ag.hierarchy_topology.component_mappings.get(pname, ())
+            visitmods('events', layers=layers)
+            if self.settings.auto_load_views:
+                visitmods('views', reloadmod=not self.settings.hierarchy.shared_modules,
+                          layers=layers)
+            loaded.add(pname)
+
     def dispatch_to_endpoint(self, endpoint, args):
         log.debug('dispatch to %s (%s)', endpoint, args)
+        component = split_endpoint(endpoint)[0]
+        if component is not None:
+            self.load_component(component)
         if '.' not in endpoint:
             vklass = findview(endpoint)
         else:
@@ -300,6 +459,8 @@ class WSGIApp(object):
     def wsgi_app(self, environ, start_response):
         log.debug('request received for URL: %s', environ['PATH_INFO'])
         with self.request_manager(environ):
+            if self.ag.template_reload_watcher is not None:
+                self.ag.template_reload_watcher.check()
             signal('blazeweb.request.started').send()
             try:
                 try:
@@ -0,0 +1,47 @@
+"""
+    Bundles of the CSS & JavaScript a page collects with include_css() and
+    include_js().
+
+    When bundling is enabled, the collected CSS/JS isn't put into the page
+    through the page_css()/page_js() placeholders.  It is written to a file
+    named after a hash of its contents in the "bundles" directory of the
+    static directory, and the page links to that file with a single tag
+    through head_link_tags()/head_script_tags().  Pages that collect the
+    same CSS/JS share the bundle, so browsers only download it once.
+"""
+import hashlib
+import os
+from os import path
+
+from blazeweb.globals import ag, settings
+from blazeweb.static import HASH_LENGTH
+from blazeweb.utils.filesystem import mkdirs
+
+# the directory, in the static directory, bundles are written to
+BUNDLE_DIR = 'bundles'
+
+
+def bundle_path(text, ext):
+    """ the path of a bundle, relative to the static directory """
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:HASH_LENGTH]
+    return '%s/%s.%s' % (BUNDLE_DIR, digest, ext)
+
+
+def write_bundle(text, ext):
+    """
+        Writes the bundle for `text` to the static directory, if it isn't
+        there already, and returns its path relative to the static directory.
+    """
+    relpath = bundle_path(text, ext)
+    if relpath in ag.written_bundles:
+        return relpath
+    fpath = path.join(settings.dirs.static, *relpath.split('/'))
+    if not path.exists(fpath):
+        mkdirs(path.dirname(fpath))
+        # the rename keeps other processes from serving a partial bundle
+        tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+        with open(tmppath, 'wb') as fh:
+            fh.write(text.encode('utf-8'))
+        os.rename(tmppath, fpath)
+    ag.written_bundles.add(relpath)
+    return relpath
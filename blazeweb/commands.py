@@ -11,9 +11,14 @@ from werkzeug import Client
 from werkzeug.wrappers.base_response import BaseResponse
 
 from blazeweb.globals import ag, settings
-from blazeweb.hierarchy import list_component_mappings
+from blazeweb.hierarchy import clear_caches, findview, HierarchyImportError, \
+    HierarchyStats, list_component_mappings
+from blazeweb.manifest import StartupManifest
+from blazeweb.static import StaticManifest
 from blazeweb.paster_tpl import run_template
 from blazeweb.tasks import run_tasks
+from blazeweb.templating import RenderProfiler
+from blazeweb.templating.jinja import compile_templates
 from blazeweb.utils.filesystem import copy_static_files
 
 import paste.script.command as pscmd
@@ -310,8 +315,33 @@ class StaticCopyCommand(pscmd.Command):
         )
 
         def command(self):
-            copy_static_files(delete_existing=self.options.delete_existing)
-            print('\n - files/dirs copied succesfully\n')
+            result = copy_static_files(delete_existing=self.options.delete_existing)
+            print('\n - files/dirs copied succesfully (%d copied, %d unchanged, %d deleted)\n'
+                  % (len(result['copied']), len(result['unchanged']), len(result['deleted'])))
+
+
+class StaticFingerprintCommand(pscmd.Command):
+    # Parser configuration
+    summary = "write the manifest of content hashed static file URLs"
+    usage = ""
+
+    min_args = 0
+    max_args = 0
+
+    parser = pscmd.Command.standard_parser(verbose=False)
+    parser.add_option(
+        '-o', '--output',
+        dest='output',
+        default=None,
+        help='Where to write the manifest (default: settings.static_files.fingerprint.fpath)'
+    )
+
+    def command(self):
+        fpath = self.options.output or settings.static_files.fingerprint.fpath
+        manifest = StaticManifest.build()
+        manifest.save(fpath)
+        print('\n - %d static files fingerprinted, manifest written to %s\n'
+              % (len(manifest.paths), fpath))
 
 
 class JinjaConvertCommand(pscmd.Command):
@@ -347,6 +377,22 @@ class JinjaConvertCommand(pscmd.Command):
                 print('    %s' % fname)
 
 
+def measure_route_resolution():
+    """
+        Resolves the view of every route, starting with empty hierarchy
+        caches, and returns the hierarchy stats that were gathered.
+    """
+    if ag.hierarchy_stats is None:
+        ag.hierarchy_stats = HierarchyStats()
+    clear_caches()
+    for rule in ag.route_map.iter_rules():
+        try:
+            findview(rule.endpoint)
+        except HierarchyImportError:
+            pass
+    return ag.hierarchy_stats
+
+
 class ComponentMapCommand(pscmd.Command):
     # Parser configuration
     summary = "List the component map"
@@ -356,9 +402,137 @@ class ComponentMapCommand(pscmd.Command):
     max_args = 0
 
     parser = pscmd.Command.standard_parser(verbose=False)
+    parser.add_option(
+        '-c', '--cost',
+        dest='cost',
+        action='store_true',
+        default=False,
+        help='Also show what it costs to resolve the view of each route (in ms)'
+    )
 
     def command(self):
         pprint(list_component_mappings(inc_apps=True))
+        if self.options.cost:
+            stats = measure_route_resolution()
+            print('\n(endpoint, total ms, import ms):')
+            pprint(stats.costs('findview'))
+
+
+class HierarchyStatsCommand(pscmd.Command):
+    # Parser configuration
+    summary = "show the counters & timers of the hierarchy lookups"
+    usage = ""
+
+    min_args = 0
+    max_args = 0
+
+    parser = pscmd.Command.standard_parser(verbose=False)
+    parser.add_option(
+        '-r', '--routes',
+        dest='routes',
+        action='store_true',
+        default=False,
+        help='Resolve the view of every route before showing the stats'
+    )
+    parser.add_option(
+        '-e', '--show-endpoints',
+        dest='show_endpoints',
+        action='store_true',
+        default=False,
+        help='Show the stats for each endpoint too'
+    )
+
+    def command(self):
+        if self.options.routes:
+            measure_route_resolution()
+        stats = ag.hierarchy_stats
+        if stats is None:
+            print('hierarchy stats are not enabled; set settings.hierarchy.stats.enabled'
+                  ' or use --routes')
+            return
+        statsdict = stats.todict()
+        pprint(statsdict['functions'])
+        if self.options.show_endpoints:
+            pprint(statsdict['endpoints'])
+
+
+class HierarchyManifestCommand(pscmd.Command):
+    # Parser configuration
+    summary = "write the startup manifest for the application's hierarchy"
+    usage = ""
+
+    min_args = 0
+    max_args = 0
+
+    parser = pscmd.Command.standard_parser(verbose=False)
+    parser.add_option(
+        '-o', '--output',
+        dest='output',
+        default=None,
+        help='Where to write the manifest (default: settings.hierarchy.manifest.fpath)'
+    )
+
+    def command(self):
+        fpath = self.options.output or settings.hierarchy.manifest.fpath
+        manifest = StartupManifest.build(ag.app)
+        manifest.save(fpath)
+        print('\n - manifest written to %s\n' % fpath)
+
+
+class TemplatesCompileCommand(pscmd.Command):
+    # Parser configuration
+    summary = "compile the application's templates ahead of time"
+    usage = ""
+
+    min_args = 0
+    max_args = 0
+
+    parser = pscmd.Command.standard_parser(verbose=True)
+    parser.add_option(
+        '-o', '--output',
+        dest='output',
+        default=None,
+        help='Where to write the compiled templates '
+             '(default: settings.templating.compiled.dir)'
+    )
+
+    def command(self):
+        target = self.options.output or settings.templating.compiled.dir
+        log_function = print if self.verbose else None
+        count = compile_templates(target, log_function)
+        print('\n - %d templates compiled to %s\n' % (count, target))
+
+
+class TemplatesProfileCommand(pscmd.Command):
+    # Parser configuration
+    summary = "show where the time rendering the templates of pages is spent"
+    usage = "URL [URL ...]"
+
+    min_args = 1
+    max_args = None
+
+    parser = pscmd.Command.standard_parser(verbose=False)
+    parser.add_option(
+        '-n', '--requests',
+        dest='requests',
+        type='int',
+        default=5,
+        help='How many times to request each URL (default: 5)'
+    )
+
+    def command(self):
+        if ag.template_profiler is None:
+            ag.template_profiler = RenderProfiler()
+        profiler = ag.template_profiler
+        c = Client(self.wsgiapp, BaseResponse)
+        for url in self.args:
+            for i in range(self.options.requests):
+                c.get(url)
+        if not profiler.pages:
+            print('no templates were rendered')
+        for page in sorted(profiler.pages, key=str):
+            print('\n%s (key, calls, total ms, max ms):' % page)
+            pprint(profiler.costs(page))
 
 
 def make_shell(init_func=None, banner=None, use_ipython=True):
@@ -88,6 +88,16 @@ class DefaultSettings(QuickSettings):
         self.routing.map.redirect_defaults = True
         self.routing.map.converters = None
 
+        # match requests for routes without converters with a dict lookup
+        # instead of Werkzeug's regex matching, see routing.StaticRouteIndex
+        self.routing.static_index = True
+
+        # the number of URLs built by url_for() and static_url() that are
+        # remembered so they don't have to be built again.  The cache's
+        # hit/miss counts are available from ag.url_cache.stats().  Set to 0 to
+        # disable.
+        self.routing.url_cache_size = 1000
+
         #######################################################################
         # DIRECTORIES required by PYSVMT
         #######################################################################
@@ -98,6 +108,50 @@ class DefaultSettings(QuickSettings):
         self.dirs.logs = path.join(self.dirs.writeable, 'logs')
         self.dirs.tmp = path.join(self.dirs.writeable, 'tmp')
 
+        #######################################################################
+        # HIERARCHY
+        #######################################################################
+        # the maximum number of "not found" results that will be remembered
+        # for module, attribute, and file lookups in the hierarchy.  Keeps
+        # repeated requests for things that don't exist (e.g. missing
+        # templates) from searching every app and component each time.  Set
+        # to 0 to disable.
+        self.hierarchy.negative_cache_size = 1000
+
+        # when more than one application runs in the same process, views
+        # modules are reloaded for each application so that @asview can add
+        # their routes to it.  Set this to import views modules only once and
+        # add the routes @asview recorded to each application instead.
+        self.hierarchy.shared_modules = False
+
+        # import the events & views modules of a component the first time one
+        # of its endpoints is dispatched to instead of when the application is
+        # instantiated.  Routes have to be known up front: they come from the
+        # settings and, for @asview routes in components, the startup
+        # manifest.  Without a valid manifest, components are loaded at
+        # startup (with a warning).
+        self.hierarchy.lazy_components = False
+
+        # keep counters & timers for the hierarchy lookups in ag.hierarchy_stats
+        # (see the "hierarchy-stats" command)
+        self.hierarchy.stats.enabled = False
+
+        # findfile() answers lookups in the templates & static directories
+        # from an index of the hierarchy's files that is built at startup.  If
+        # poll_interval is set (in seconds), the index is checked for changes
+        # at most that often.  Otherwise, the index never changes, so files
+        # added after startup aren't found.
+        self.hierarchy.file_index.enabled = False
+        self.hierarchy.file_index.poll_interval = None
+
+        # load the startup manifest written by the "hierarchy-manifest" command
+        # so that module & file discovery can be skipped when the application
+        # is instantiated.  A manifest that doesn't match the Python code of
+        # the packages is ignored.  Templates & static files aren't checked,
+        # so rebuild the manifest when those are added or removed.
+        self.hierarchy.manifest.enabled = False
+        self.hierarchy.manifest.fpath = path.join(self.dirs.data, 'hierarchy_manifest.json')
+
         #######################################################################
         # SESSIONS
         #######################################################################
@@ -117,7 +171,72 @@ class DefaultSettings(QuickSettings):
         # a list of template extensions to escape; set to False to disable
         # autoescape
         self.jinja.autoescape = ('html', 'htm', 'xml')
-        self.jinja.extensions = ['jinja2.ext.autoescape', 'jinja2.ext.with_']
+        self.jinja.extensions = ['jinja2.ext.autoescape', 'jinja2.ext.with_',
+                                 'blazeweb.templating.jinja.FragmentCacheExtension']
+        # keep compiled templates on disk so that they don't have to be
+        # compiled again by other processes or after a restart, see
+        # templating.jinja.HierarchyBytecodeCache.  The directory is created
+        # when the application starts.
+        self.jinja.bytecode_cache.enabled = False
+        self.jinja.bytecode_cache.dir = path.join(self.dirs.tmp, 'jinja_bytecode')
+        # for production: templates are never checked for changes once they
+        # are loaded, saving a stat() of each template file every time it is
+        # rendered.  frozen_cache_size is the number of templates Jinja keeps
+        # (-1 keeps all of them).  Changed templates are picked up after a
+        # restart, when the "blazeweb.templating.reload" signal is sent, or
+        # when the mtime of reload_file changes (checked at most once a
+        # second, e.g. touch the file on deploy).
+        self.templating.frozen = False
+        self.templating.frozen_cache_size = -1
+        self.templating.reload_file = None
+        # share compiled templates with the other applications in the process
+        # (e.g. several apps rendering the same component templates).  The
+        # store is created with max_entries by the first application.
+        self.templating.shared_code.enabled = False
+        self.templating.shared_code.max_entries = 2000
+        # load the templates compiled by the "templates-compile" command
+        # instead of parsing and compiling them.  Compiled templates that
+        # don't match the hierarchy's template files are not used.
+        self.templating.compiled.enabled = False
+        self.templating.compiled.dir = path.join(self.dirs.data, 'compiled_templates')
+        # write the CSS & JS collected by include_css() and include_js() to
+        # files in dirs.static/bundles and link to them instead of putting
+        # them in the page, see blazeweb.bundles
+        self.templating.bundles.enabled = False
+        # send pages rendered by View.render_template() as the template is
+        # rendered (a view can also pass stream=True/False), for a faster
+        # first byte & less memory on large pages.  Output is held back until
+        # flush_after, so that the CSS/JS placeholders in the <head> can be
+        # filled in, and then sent in chunks of about buffer_size pieces of
+        # template output.  See TemplateContent.process_streamed().
+        self.templating.streaming.enabled = False
+        self.templating.streaming.flush_after = '</head>'
+        self.templating.streaming.buffer_size = 40
+        # time the rendering of each template, block, include_content() and
+        # the filling in of placeholders, for each page.  See
+        # templating.RenderProfiler & the "templates-profile" command.  With
+        # header, the times of a request are sent in an X-Template-Profile
+        # response header (don't enable on public sites).
+        self.templating.profiler.enabled = False
+        self.templating.profiler.header = False
+
+        # the number of rst/markdown to HTML conversions (include_rst(),
+        # include_mkdn() and the markdown filter) that are remembered, keyed
+        # on a hash of the text.  If dir is set, conversions are also saved
+        # to files in it.  Set size to 0 to disable.
+        self.templating.markup_cache.size = 500
+        self.templating.markup_cache.dir = None
+
+        # caching of rendered template fragments with the "cache" template
+        # tag and getcontent_cached(), see blazeweb.fragments.  The backend
+        # is "memory" (max_entries fragments per process), "file" (in dir)
+        # or a callable that takes these settings and returns a store.  TTLs
+        # are in seconds, 0 or None for fragments that don't expire.
+        self.fragment_cache.enabled = True
+        self.fragment_cache.backend = 'memory'
+        self.fragment_cache.max_entries = 1000
+        self.fragment_cache.dir = path.join(self.dirs.tmp, 'fragment_cache')
+        self.fragment_cache.default_ttl = 300
 
         #######################################################################
         # SYSTEM VIEW ENDPOINTS
@@ -296,6 +415,34 @@ class DefaultSettings(QuickSettings):
         # when static files are changing often and copying to the static
         # directory after each change is a hassle.
         self.static_files.location = 'static'
+        # put a hash of each static file's contents in its URL so that the
+        # file can be cached by browsers "forever".  The manifest is built by
+        # the "static-fingerprint" command, or when the application starts if
+        # it doesn't exist.  Rebuild it whenever static files change.
+        self.static_files.fingerprint.enabled = False
+        self.static_files.fingerprint.fpath = path.join(self.dirs.data, 'static_manifest.json')
+        # the max-age, in seconds, of fingerprinted files
+        self.static_files.fingerprint.max_age = 31536000
+        # write a gzip compressed ".gz" copy next to each compressible file
+        # when static files are copied to the static directory.  The
+        # production server sends them to clients that accept gzip.
+        self.static_files.gzip.enabled = False
+        self.static_files.gzip.extensions = ('.css', '.js', '.json', '.map', '.svg', '.txt',
+                                             '.html', '.xml')
+        # files smaller than this (in bytes) aren't worth compressing
+        self.static_files.gzip.min_size = 256
+        # serve static files with middleware.ProductionStaticServer instead of
+        # Werkzeug's SharedDataMiddleware.  Resolved paths and small files are
+        # kept in memory, so files that change are only picked up after a
+        # restart.
+        self.static_files.production.enabled = False
+        # the number of paths whose resolved file (or 404) is remembered
+        self.static_files.production.cache_size = 1000
+        # files up to this size (in bytes) are kept in memory, bigger files
+        # are sent with the server's wsgi.file_wrapper
+        self.static_files.production.memory_max_size = 64 * 1024
+        # the Cache-Control max-age, in seconds
+        self.static_files.production.max_age = 43200
 
         #######################################################################
         # Automatic Actions
@@ -363,6 +510,9 @@ class DefaultSettings(QuickSettings):
         self.debugger.enabled = True
         self.static_files.location = 'source'
         self.auto_abort_as_builtin = True
+        # files get added while developing, don't remember that they were missing
+        self.hierarchy.negative_cache_size = 0
+        self.hierarchy.file_index.poll_interval = 1
 
         if override_email:
             self.emails.override = override_email
@@ -1,13 +1,17 @@
 from os import path
 
 from blazeutils.strings import reindent as bureindent
-from blazeutils.rst import rst2html
 import six
 from webhelpers2.html import HTML
 
-from blazeweb.globals import ag, settings
+from blazeweb.bundles import write_bundle
+from blazeweb.fragments import cached_fragment, CachedFragment
+from blazeweb.globals import ag, rg, settings, user
 from blazeweb.hierarchy import findcontent, split_endpoint
+from blazeweb.markup import cached_rst2html
 from blazeweb.routing import abs_static_url, static_url
+from blazeweb.utils import registry_has_object
+from blazeweb.utils.datastructures import ContentBuffer
 
 
 def getcontent(__endpoint, *args, **kwargs):
@@ -20,6 +24,33 @@ def getcontent(__endpoint, *args, **kwargs):
     return c
 
 
+def getcontent_streamed(__endpoint, **kwargs):
+    """
+        Like getcontent() for a template endpoint, but the template is
+        rendered as the content's stream is iterated.  See
+        TemplateContent.process_streamed().
+    """
+    c = TemplateContent(__endpoint)
+    c.process_streamed(**kwargs)
+    return c
+
+
+def getcontent_cached(__key, __ttl, __endpoint, *args, **kwargs):
+    """
+        Like getcontent(), but the content is cached under `__key` for
+        `__ttl` seconds (None for settings.fragment_cache.default_ttl, 0 to
+        never expire).  See blazeweb.fragments.
+    """
+    def render():
+        c = getcontent(__endpoint, *args, **kwargs)
+        return CachedFragment(c.primary, c.data, c.primary_type)
+    fragment = cached_fragment(__key, __ttl, render)
+    c = Content()
+    c.primary_type = fragment.primary_type
+    c.data = fragment.data_copy()
+    return c
+
+
 class Content(object):
 
     def __init__(self):
@@ -30,6 +61,9 @@ class Content(object):
         # as utf-8.
         self.charset = settings.default.charset
         self.data = {}
+        # an iterable of the primary content's text when the content is
+        # streamed instead of created all at once
+        self.stream = None
 
     def settype(self):
         self.primary_type = 'text/plain'
@@ -48,14 +82,27 @@ class Content(object):
         return c
 
     def update_nonprimary_from_content(self, c):
+        # c's buffers are referred to, not copied; see ContentBuffer
         for type, clist in six.iteritems(c.data):
             if type != self.primary_type:
-                self.data.setdefault(type, [])
-                self.data[type].extend(clist)
+                self.extend_content(type, clist)
+
+    def buffer(self, type):
+        """ the ContentBuffer for `type`, created if needed """
+        try:
+            buffer = self.data[type]
+        except KeyError:
+            buffer = self.data[type] = ContentBuffer()
+        else:
+            if not isinstance(buffer, ContentBuffer):
+                buffer = self.data[type] = ContentBuffer(buffer)
+        return buffer
 
     def add_content(self, type, content):
-        self.data.setdefault(type, [])
-        self.data[type].append(content)
+        self.buffer(type).append(content)
+
+    def extend_content(self, type, clist):
+        self.buffer(type).extend(clist)
 
     @property
     def primary(self):
@@ -63,9 +110,12 @@ class Content(object):
 
     def get(self, type, join_with=u''):
         try:
-            return join_with.join(self.data[type])
+            buffer = self.data[type]
         except KeyError:
             return u''
+        if isinstance(buffer, ContentBuffer):
+            return buffer.join(join_with)
+        return join_with.join(buffer)
 
     def __unicode__(self):
         return self.primary
@@ -80,17 +130,39 @@ class Content(object):
             return self.__unicode__()
 
 
+PLACEHOLDER_PREFIX = u'<<<blazeweb.content.placeholder.'
+PLACEHOLDER_SUFFIX = u'>>>'
+
+
 class _PlaceHolder(object):
-    def __init__(self, cobj, ident, type, join_on=u'\n\n'):
+    def __init__(self, cobj, ident, type, join_on=u'\n\n', stream_wrapper=u'%s'):
         self.cobj = cobj
-        self.placeholder = u'<<<blazeweb.content.placeholder.{0}>>>'.format(ident)
+        self.ident = ident
+        self.placeholder = PLACEHOLDER_PREFIX + ident + PLACEHOLDER_SUFFIX
         self.type = type
         self.reindent_level = None
         self.count = 0
         self.join_on = join_on
+        # set when the content was written to a bundle instead
+        self.bundled = False
+        # for streamed content: the number of items of the content that have
+        # been sent and how to wrap items added after the placeholder was sent
+        self.streamed = 0
+        self.stream_wrapper = stream_wrapper
 
     def content(self):
-        text = self.cobj.get(self.type, self.join_on)
+        if self.bundled:
+            return u''
+        return self.format(self.cobj.get(self.type, self.join_on))
+
+    def content_since_streamed(self):
+        """ the content that hasn't been sent yet, for streamed content """
+        items = self.cobj.data.get(self.type, [])
+        text = self.join_on.join(items[self.streamed:])
+        self.streamed = len(items)
+        return self.format(text)
+
+    def format(self, text):
         if self.reindent_level:
             text = bureindent(text, self.reindent_level)
             # trim off the first level of indentation so that its in the place
@@ -99,11 +171,78 @@ class _PlaceHolder(object):
             text = text.lstrip()
         return text
 
-    def substitute(self, text):
-        if not self.count:
-            return text
-        ph_content = self.content()
-        return text.replace(self.placeholder, ph_content, self.count)
+
+def substitute_placeholders(text, placeholders):
+    """
+        Replaces the placeholders in `text` with their content in a single
+        scan of the text and a single join, instead of a str.replace() over
+        the whole text for each placeholder.  Only the first `count`
+        occurrences of a placeholder are replaced and a placeholder's content
+        is only created if it is used.  The scan stops once every placeholder
+        has been replaced, which, since placeholders are usually in the
+        <head>, is long before the end of a large page.
+    """
+    remaining = dict((ph.ident, ph.count) for ph in placeholders if ph.count)
+    if not remaining:
+        return text
+    placeholders = dict((ph.ident, ph) for ph in placeholders)
+    contents = {}
+    parts = []
+    pos = 0
+    find = text.find
+    start = find(PLACEHOLDER_PREFIX)
+    while start != -1 and remaining:
+        end = find(PLACEHOLDER_SUFFIX, start)
+        if end == -1:
+            break
+        ident = text[start + len(PLACEHOLDER_PREFIX):end]
+        if ident in remaining:
+            remaining[ident] -= 1
+            if not remaining[ident]:
+                del remaining[ident]
+            if ident not in contents:
+                contents[ident] = placeholders[ident].content()
+            parts.append(text[pos:start])
+            parts.append(contents[ident])
+            pos = end + len(PLACEHOLDER_SUFFIX)
+        start = find(PLACEHOLDER_PREFIX, end)
+    if not parts:
+        return text
+    # text[pos:] would be a copy of most of the page on its own.  Replacing
+    # the (usually short) head with its substituted version copies the page
+    # only once.
+    return text.replace(text[:pos], u''.join(parts), 1)
+
+
+def _substitute_streamed(text, placeholders):
+    if PLACEHOLDER_PREFIX not in text:
+        return text
+    for ph in placeholders:
+        if ph.placeholder in text:
+            text = text.replace(ph.placeholder, ph.content_since_streamed())
+    return text
+
+
+def iterate_with_globals(iterable):
+    """
+        Iterates `iterable` with the current ag, settings, rg & user pushed on
+        their proxies for each step.  A streamed response body is iterated by
+        the WSGI server after the request's globals have been torn down.
+    """
+    objects = [(proxy, proxy._current_obj()) for proxy in (ag, settings, rg, user)
+               if registry_has_object(proxy)]
+    iterator = iter(iterable)
+    while True:
+        for proxy, obj in objects:
+            proxy._push_object(obj)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            for proxy, obj in reversed(objects):
+                proxy._pop_object(obj)
+        yield chunk
 
 
 class TemplateContent(Content):
@@ -119,8 +258,10 @@ class TemplateContent(Content):
         component, template = split_endpoint(endpoint)
         self.template = template
         self.endpoint = endpoint
-        self.css_ph = _PlaceHolder(self, 'css', 'text/css')
-        self.js_ph = _PlaceHolder(self, 'js', 'text/javascript')
+        self.css_ph = _PlaceHolder(self, 'css', 'text/css',
+                                   stream_wrapper=u'<style type="text/css">\n%s\n</style>')
+        self.js_ph = _PlaceHolder(self, 'js', 'text/javascript',
+                                  stream_wrapper=u'<script type="text/javascript">\n%s\n</script>')
         self.link_tags_ph = _PlaceHolder(self, 'link_tags', 'x-link-tags', u'\n')
         self.script_tags_ph = _PlaceHolder(self, 'script_tags', 'x-script-tags', u'\n')
 
@@ -133,8 +274,8 @@ class TemplateContent(Content):
 
         Content.__init__(self)
         self.data = {
-            'x-link-tags': [],
-            'x-script-tags': [],
+            'x-link-tags': ContentBuffer(),
+            'x-script-tags': ContentBuffer(),
         }
 
     def settype(self):
@@ -159,11 +300,89 @@ class TemplateContent(Content):
         #    js_tags_content = self.page_js()
         #    template_content = template_content.replace(
         #            self.js_placeholder, js_content, self.js_placeholder_count)
-        content = self.css_ph.substitute(content)
-        content = self.js_ph.substitute(content)
-        content = self.link_tags_ph.substitute(content)
-        content = self.script_tags_ph.substitute(content)
-        return content
+        profiler = ag.template_profiler
+        if profiler is None:
+            return self.fill_placeholders(content)
+        with profiler.measure('placeholders:%s' % self.endpoint):
+            return self.fill_placeholders(content)
+
+    def fill_placeholders(self, content):
+        if settings.templating.bundles.enabled:
+            self.bundle(self.css_ph, self.link_tags_ph, 'css', self.link_css_url)
+            self.bundle(self.js_ph, self.script_tags_ph, 'js', self.source_js_url)
+        return substitute_placeholders(content, self.placeholders())
+
+    def placeholders(self):
+        return (self.css_ph, self.js_ph, self.link_tags_ph, self.script_tags_ph)
+
+    def process_streamed(self, **kwargs):
+        """
+            Sets up self.stream to render the template as it is iterated,
+            instead of rendering the whole page in memory.  The output is
+            buffered until settings.templating.streaming.flush_after (the end
+            of the <head> by default) so that the placeholders in it get the
+            CSS/JS included up to that point.  Placeholders later in the page
+            get what was included since, and CSS/JS included after the last
+            of its placeholders is added to the end of the page, before
+            </body>.  Since the response has been started by the time the
+            template is rendered, template errors can't result in an error
+            page.
+        """
+        self.settype()
+        self.update_context(kwargs)
+        chunks = ag.tplengine.stream_template(self.endpoint, kwargs,
+                                              settings.templating.streaming.buffer_size)
+        self.stream = iterate_with_globals(self.generate_stream(chunks))
+
+    def generate_stream(self, chunks):
+        chunks = iter(chunks)
+        marker = settings.templating.streaming.flush_after
+        head = u''
+        for chunk in chunks:
+            head += chunk
+            if head.find(marker, max(0, len(head) - len(chunk) - len(marker))) != -1:
+                break
+        if settings.templating.bundles.enabled:
+            for ph, tags_ph, ext, add_tag in (
+                (self.css_ph, self.link_tags_ph, 'css', self.link_css_url),
+                (self.js_ph, self.script_tags_ph, 'js', self.source_js_url),
+            ):
+                self.bundle(ph, tags_ph, ext, add_tag)
+                if ph.bundled:
+                    ph.streamed = len(self.data.get(ph.type, []))
+        # a chunk is held back so that the late content can go in the last one
+        previous = _substitute_streamed(head, self.placeholders())
+        for chunk in chunks:
+            yield previous
+            previous = _substitute_streamed(chunk, self.placeholders())
+        late = []
+        for ph in self.placeholders():
+            if ph.count:
+                text = ph.content_since_streamed()
+                if text.strip():
+                    late.append(ph.stream_wrapper % text)
+        if late:
+            late = u'\n'.join(late) + u'\n'
+            pos = previous.rfind(u'</body>')
+            if pos == -1:
+                previous += late
+            else:
+                previous = previous[:pos] + late + previous[pos:]
+        yield previous
+
+    def bundle(self, ph, tags_ph, ext, add_tag):
+        """
+            Write the content of a placeholder to a bundle and reference it
+            with a tag in the tags placeholder.  Nothing is bundled if the
+            template doesn't have both placeholders.
+        """
+        if not ph.count or not tags_ph.count:
+            return
+        text = self.get(ph.type, ph.join_on)
+        if not text.strip():
+            return
+        add_tag(write_bundle(text, ext))
+        ph.bundled = True
 
     def update_context(self, context):
         context.update({
@@ -174,6 +393,7 @@ class TemplateContent(Content):
             'getcontent': self.include_content,
             'include_content': self.include_content,
             'include_html': self.include_html,
+            'include_cached': self.include_cached,
             'page_css': self.page_css_ph,
             'page_js': self.page_js_ph,
             'link_css_url': self.link_css_url,
@@ -194,9 +414,19 @@ class TemplateContent(Content):
         return endpoint
 
     def include_content(self, __endpoint, *args, **kwargs):
-        c = self.update_nonprimary_from_endpoint(__endpoint, *args, **kwargs)
+        profiler = ag.template_profiler
+        if profiler is None:
+            c = self.update_nonprimary_from_endpoint(__endpoint, *args, **kwargs)
+        else:
+            with profiler.measure('content:%s' % __endpoint):
+                c = self.update_nonprimary_from_endpoint(__endpoint, *args, **kwargs)
         return c.primary
 
+    def include_cached(self, __key, __ttl, __endpoint, *args, **kwargs):
+        c = getcontent_cached(__key, __ttl, __endpoint, *args, **kwargs)
+        self.update_nonprimary_from_content(c)
+        return ag.tplengine.mark_safe(c.primary)
+
     def include_html(self, __endpoint, *args, **kwargs):
         html = self.include_content(__endpoint, *args, **kwargs)
         return ag.tplengine.mark_safe(html)
@@ -217,7 +447,7 @@ class TemplateContent(Content):
         if __endpoint is None:
             __endpoint = self._supporting_endpoint_from_ext('rst')
         rst = TemplateContent(__endpoint).create(**kwargs)
-        html = rst2html(rst)
+        html = cached_rst2html(rst)
         return ag.tplengine.mark_safe(html)
 
     def include_mkdn(self, __endpoint=None, *args, **kwargs):
@@ -225,7 +455,7 @@ class TemplateContent(Content):
             __endpoint = self._supporting_endpoint_from_ext('mkdn')
         c = TemplateContent(__endpoint)
         rst = c.create(**kwargs)
-        html = rst2html(rst)
+        html = cached_rst2html(rst)
         return ag.tplengine.mark_safe(html)
 
     def head_link_tags_ph(self, reindent=4):
@@ -258,7 +488,7 @@ class TemplateContent(Content):
         else:
             url = static_url(url)
         link_tag = HTML.link(rel='stylesheet', type='text/css', href=url, **kwargs)
-        self.data['x-link-tags'].append(link_tag)
+        self.add_content('x-link-tags', link_tag)
         return u''
 
     def source_js_url(self, url, **kwargs):
@@ -267,5 +497,5 @@ class TemplateContent(Content):
         else:
             url = static_url(url)
         script_tag = HTML.script(type='text/javascript', src=url, **kwargs)
-        self.data['x-script-tags'].append(script_tag)
+        self.add_content('x-script-tags', script_tag)
         return u''
@@ -0,0 +1,139 @@
+"""
+    Caching of rendered template fragments, e.g. navigation, sidebars and
+    footers that are the same for most requests.
+
+    Fragments are cached with the "cache" template tag:
+
+        {% cache 'sidebar', 300 %}...{% endcache %}
+
+    or with content.getcontent_cached() & the include_cached() template
+    function.  Along with the fragment's text, the CSS/JS and link/script
+    tags it added to the page are cached so that they are added to the page
+    when the cached fragment is used.
+
+    Each application has its own store, ag.fragment_store, made from
+    settings.fragment_cache.  The backend can be "memory", "file" or a
+    callable that takes the settings and returns an object with the same
+    get(), set() & clear() methods as the stores below.
+"""
+import hashlib
+import os
+from os import path
+import time
+
+import six
+from six.moves import cPickle as pickle
+
+from blazeweb.globals import ag, settings
+from blazeweb.utils.datastructures import LRUCache
+from blazeweb.utils.filesystem import mkdirs
+
+
+class CachedFragment(object):
+
+    def __init__(self, primary, data, primary_type=None):
+        self.primary = primary
+        self.primary_type = primary_type
+        # content type -> list of content, like Content.data
+        self.data = data
+
+    def data_copy(self):
+        # so that whoever uses the fragment can't change the cached lists
+        return dict((type, list(clist)) for type, clist in six.iteritems(self.data))
+
+
+class MemoryFragmentStore(object):
+    """ keeps up to `maxsize` fragments in memory, discarding the least recently used """
+
+    def __init__(self, maxsize):
+        self.cache = LRUCache(maxsize)
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        expires, fragment = entry
+        if expires is not None and expires < time.time():
+            self.cache.discard(key)
+            return None
+        return fragment
+
+    def set(self, key, fragment, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        self.cache.set(key, (expires, fragment))
+
+    def clear(self):
+        self.cache.clear()
+
+
+class FileFragmentStore(object):
+    """
+        keeps fragments in files in `directory`, which processes on the same
+        host can share
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        mkdirs(directory)
+
+    def fpath(self, key):
+        digest = hashlib.sha1(six.text_type(key).encode('utf-8')).hexdigest()
+        return path.join(self.directory, digest + '.fragment')
+
+    def get(self, key):
+        fpath = self.fpath(key)
+        try:
+            with open(fpath, 'rb') as fh:
+                expires, fragment = pickle.load(fh)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            return None
+        return fragment
+
+    def set(self, key, fragment, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        fpath = self.fpath(key)
+        tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+        with open(tmppath, 'wb') as fh:
+            pickle.dump((expires, fragment), fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, fpath)
+
+    def clear(self):
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.fragment'):
+                os.remove(path.join(self.directory, fname))
+
+
+def create_fragment_store(fcsettings):
+    backend = fcsettings.backend
+    if backend == 'memory':
+        return MemoryFragmentStore(fcsettings.max_entries)
+    if backend == 'file':
+        return FileFragmentStore(fcsettings.dir)
+    if callable(backend):
+        return backend(fcsettings)
+    raise ValueError('fragment cache backend "%s" not recognized' % backend)
+
+
+def get_ttl(ttl):
+    if ttl is None:
+        return settings.fragment_cache.default_ttl
+    return ttl
+
+
+def cached_fragment(key, ttl, render):
+    """
+        Returns the fragment for `key` from the application's store, or
+        calls `render`, which returns a CachedFragment, and stores what it
+        returns for `ttl` seconds (None for the default TTL, 0 to never
+        expire).
+    """
+    store = ag.fragment_store
+    if store is None:
+        return render()
+    fragment = store.get(key)
+    if fragment is None:
+        fragment = render()
+        store.set(key, fragment, get_ttl(ttl))
+    return fragment
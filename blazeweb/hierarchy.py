@@ -1,6 +1,12 @@
+from contextlib import contextmanager
+import functools
 import logging
+import os
 from os import path as ospath
 import sys
+import threading
+import time
+import types
 
 from blazeutils.datastructures import BlankObject, OrderedDict, UniqueList
 from blazeutils.error_handling import raise_unexpected_import_error
@@ -22,6 +28,15 @@ class HierarchyImportError(ImportError):
     """
 
 
+class HierarchyAttributeError(AttributeError):
+    """
+        raised when an attribute of an "appstack" or "compstack" module can
+        not be found in the hierarchy.  It's an AttributeError, so hasattr()
+        and getattr() with a default work on those modules.  A module that
+        can't be found still raises HierarchyImportError.
+    """
+
+
 class FileNotFound(Exception):
     """
         raised when a file is not found in findfile()
@@ -37,19 +52,129 @@ def _is_expected_import_error(error_msg, import_string):
     return import_string.startswith(no_module_found)
 
 
+def is_missing_module_error(exc, import_string):
+    """
+        True if the ImportError `exc` was raised because the module given by
+        `import_string` doesn't exist (as opposed to the module existing but
+        having a bad import in it).
+    """
+    if not six.PY2:
+        return _is_expected_import_error(str(exc), import_string)
+    try:
+        raise_unexpected_import_error(import_string, exc)
+    except ImportError:
+        return False
+    return True
+
+
+class HierarchyModule(types.ModuleType):
+    """
+        The virtual module created for "appstack" and "compstack" imports.
+        These modules are shared by every application in the process, so
+        attribute access is resolved in the hierarchy of the current
+        application.  The only attributes stored on them are the virtual
+        sub-modules the import system sets on their parent modules.
+    """
+
+    def __getattr__(self, attr):
+        # the import system and other tools probe modules for special
+        # attributes and those shouldn't be looked for in the hierarchy.
+        # Attributes of the top level modules are always sub-modules.
+        if attr.startswith('__') or '.' not in self.__name__:
+            raise AttributeError(attr)
+        index = ag.hierarchy_endpoint_index
+        indexkey = (self.__name__, attr)
+        if indexkey not in index:
+            try:
+                index[indexkey] = ImportOverrideHelper.findattr(self.__name__, attr)
+            except HierarchyImportError as e:
+                # a module that doesn't exist in the hierarchy is still an
+                # import error, not a missing attribute
+                if ImportOverrideHelper.findmodule(self.__name__) is None:
+                    raise
+                raise HierarchyAttributeError(str(e))
+        return index[indexkey]
+
+
+class HierarchyImporter(object):
+    """
+        A sys.meta_path finder & loader for the "appstack" and "compstack"
+        virtual packages.  Since only those names are handled, every other
+        import in the process goes through Python's import system untouched.
+    """
+    toplevel_names = ('appstack', 'compstack')
+
+    def handles(self, fullname):
+        return fullname.split('.', 1)[0] in self.toplevel_names
+
+    def check_submodule(self, fullname):
+        """
+            "from appstack.views import foo" tries to import appstack.views.foo
+            when the views module has no "foo" attribute.  Raise the hierarchy's
+            error then, instead of creating a module for a name that is neither
+            an attribute nor a module in the current application.
+        """
+        parent, _, attr = fullname.rpartition('.')
+        if '.' not in parent or not registry_has_object(ag):
+            return
+        if ImportOverrideHelper.findmodule(fullname) is not None:
+            return
+        # when the parent is missing too, accessing the new module's
+        # attributes will say so
+        if ImportOverrideHelper.findmodule(parent) is not None:
+            ImportOverrideHelper.findattr(parent, attr)
+
+    def new_module(self, fullname):
+        module = HierarchyModule(fullname)
+        # every virtual module is a package so that importing "deeper" in the
+        # hierarchy, e.g. compstack.news.views, works
+        module.__path__ = []
+        module.__loader__ = self
+        module.__package__ = fullname
+        return module
+
+    # PEP 451 (Python 3)
+    def find_spec(self, fullname, path=None, target=None):
+        if not self.handles(fullname):
+            return None
+        self.check_submodule(fullname)
+        from importlib.machinery import ModuleSpec
+        return ModuleSpec(fullname, self, is_package=True)
+
+    def create_module(self, spec):
+        return self.new_module(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+    # PEP 302 (Python 2)
+    def find_module(self, fullname, path=None):
+        if self.handles(fullname):
+            self.check_submodule(fullname)
+            return self
+
+    def load_module(self, fullname):
+        if fullname not in sys.modules:
+            sys.modules[fullname] = self.new_module(fullname)
+        return sys.modules[fullname]
+
+
 class HierarchyManager(object):
 
     def __init__(self):
         self._builtin_import = six.moves.builtins.__import__
-        self.replace_builtin()
+        self.importer = HierarchyImporter()
+        self.install_importer()
 
-    def replace_builtin(self):
-        six.moves.builtins.__import__ = self.blazeweb_import
-        log.debug('HierarchyManager replaced __builtin__.__import__')
+    def install_importer(self):
+        if self.importer not in sys.meta_path:
+            sys.meta_path.insert(0, self.importer)
+            log.debug('HierarchyManager installed the appstack/compstack importer')
 
-    def restore_builtin(self):
-        six.moves.builtins.__import__ = self._builtin_import
-        log.debug('HierarchyManager restored __builtin__.__import__')
+    def remove_importer(self):
+        if self.importer in sys.meta_path:
+            sys.meta_path.remove(self.importer)
+            log.debug('HierarchyManager removed the appstack/compstack importer')
 
     def builtin_import(self, name, globals={}, locals={}, fromlist=[], level=default_import_level):
         mod = self._builtin_import(name, globals, locals, fromlist, level)
@@ -59,51 +184,259 @@ class HierarchyManager(object):
         if registry_has_object(ag) and registry_has_object(settings):
             # is this module part of the main or supporting app?
             toplevel = name.split('.')[0]
-            if toplevel in listapps() or toplevel in list_component_packages():
+            if toplevel in get_topology().package_names:
                 mod._blazeweb_hierarchy_last_imported_by = id(ag.app)
         return mod
 
-    def blazeweb_import(self, name, globals={}, locals={}, fromlist=[], level=default_import_level):
-        instack_collection = ImportOverrideHelper.doimport(name, fromlist)
-        if instack_collection:
-            return instack_collection
-        return self.builtin_import(name, globals, locals, fromlist, level)
+
 hm = HierarchyManager()
 
 
+class ComponentTopology(object):
+    """
+        A compiled, read-only description of the application & component
+        hierarchy: the apps, the enabled components, and the packages that
+        make up each component, all in priority order.
+
+        WSGIApp builds one after the settings are locked (the component map
+        can't change after that) and the hierarchy helpers read from it
+        instead of walking the settings on every call.
+    """
+
+    def __init__(self, settings):
+        apps = [settings.app_package] + list(settings.supporting_apps)
+        mappings_with_apps = []
+        for app in apps:
+            mappings_with_apps.append((app, None, None))
+            acomponents = getattr(settings.componentmap, app)
+            for pname in acomponents.keys():
+                for package in acomponents.get_dotted('%s.packages' % pname):
+                    mappings_with_apps.append((app, pname, package))
+        mappings = [m for m in mappings_with_apps if m[1] is not None]
+
+        self.apps = tuple(apps)
+        self.apps_reversed = tuple(reversed(apps))
+        self.mappings = tuple(mappings)
+        self.mappings_reversed = tuple(reversed(mappings))
+        self.mappings_with_apps = tuple(mappings_with_apps)
+        self.mappings_with_apps_reversed = tuple(reversed(mappings_with_apps))
+        # the layers of the apps themselves, without their components
+        self.app_mappings = tuple(m for m in mappings_with_apps if m[1] is None)
+
+        components = UniqueList()
+        component_mappings = {}
+        for mapping in mappings:
+            components.append(mapping[1])
+            component_mappings.setdefault(mapping[1], []).append(mapping)
+        self.components = tuple(components)
+        self.components_reversed = tuple(reversed(components))
+        self.component_mappings = dict(
+            (pname, tuple(cmappings)) for pname, cmappings in six.iteritems(component_mappings)
+        )
+        self.component_packages = tuple(m[2] for m in mappings if m[2])
+        # the top level package names of everything in the hierarchy
+        self.package_names = frozenset(self.apps + self.component_packages)
+        self._package_dirs = {}
+
+    def package_dir(self, package):
+        """
+            the directory of an app or component package; the package is only
+            imported the first time its directory is needed
+        """
+        try:
+            return self._package_dirs[package]
+        except KeyError:
+            package_mod = hm.builtin_import(package, fromlist=[''])
+            pkgdir = ospath.dirname(package_mod.__file__)
+            self._package_dirs[package] = pkgdir
+            return pkgdir
+
+    def layer_dir(self, app, pname, package):
+        """
+            the root directory of a layer in the hierarchy given its mapping
+        """
+        if package:
+            return self.package_dir(package)
+        if pname:
+            return ospath.join(self.package_dir(app), 'components', pname)
+        return self.package_dir(app)
+
+    def list_mappings(self, target_component=None, reverse=False, inc_apps=False):
+        if target_component is None:
+            if inc_apps:
+                return self.mappings_with_apps_reversed if reverse else self.mappings_with_apps
+            return self.mappings_reversed if reverse else self.mappings
+        if inc_apps:
+            mappings = tuple(
+                m for m in self.mappings_with_apps if m[1] in (None, target_component)
+            )
+        else:
+            mappings = self.component_mappings.get(target_component, ())
+        if reverse:
+            mappings = tuple(reversed(mappings))
+        return mappings
+
+
+def get_topology():
+    """
+        The ComponentTopology for the current application.  Until the settings
+        are locked, the component map could still change, so a temporary
+        topology is built from the current settings.
+    """
+    topology = ag.hierarchy_topology
+    if topology is None:
+        return ComponentTopology(settings._current_obj())
+    return topology
+
+
+def layer_import_name(app, pname, package, dotpath):
+    """
+        the absolute import name of `dotpath` in a layer of the hierarchy
+        given the layer's mapping
+    """
+    if package:
+        return '%s.%s' % (package, dotpath)
+    if pname:
+        return '%s.components.%s.%s' % (app, pname, dotpath)
+    return '%s.%s' % (app, dotpath)
+
+
+def _mtime(dirpath):
+    try:
+        return os.stat(dirpath).st_mtime
+    except OSError:
+        return None
+
+
+def _scan_tree(root):
+    """
+        yields (dirpath, dirnames, filenames) for `root` and every directory
+        below it, following symlinks.  Uses os.scandir() when available so that
+        the walk doesn't need a stat() call for every file.
+    """
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:  # pragma: no cover
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            yield dirpath, dirnames, filenames
+        return
+    try:
+        entries = list(scandir(root))
+    except OSError:
+        return
+    dirnames = []
+    filenames = []
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+        except OSError:
+            # a broken symlink
+            continue
+    yield root, dirnames, filenames
+    for dirname in dirnames:
+        for walked in _scan_tree(ospath.join(root, dirname)):
+            yield walked
+
+
+class FileIndex(object):
+    """
+        An in-memory index of the files and directories in the given
+        sub-directories of every app and component in the hierarchy.  It maps
+        each findfile() endpoint to the path findfile() would return for it,
+        so lookups under an indexed directory don't need to touch the file
+        system.
+
+        The index is built once.  If `poll_interval` is given, refresh() will
+        rebuild it, at most once every `poll_interval` seconds, when a
+        directory in the hierarchy has changed.
+    """
+
+    def __init__(self, topology, subdirs=('templates', 'static'), poll_interval=None):
+        self.topology = topology
+        self.subdirs = tuple(subdirs)
+        self.poll_interval = poll_interval
+        self.paths = {}
+        self._dir_mtimes = {}
+        self._checked_at = 0
+        self.build()
+
+    def build(self):
+        paths = {}
+        dir_mtimes = {}
+        for app, pname, package in self.topology.mappings_with_apps:
+            layerdir = self.topology.layer_dir(app, pname, package)
+            # creating a sub-directory that doesn't exist yet changes the
+            # mtime of the layer's directory
+            dir_mtimes[layerdir] = _mtime(layerdir)
+            for subdir in self.subdirs:
+                for dirpath, dirnames, filenames in _scan_tree(ospath.join(layerdir, subdir)):
+                    dir_mtimes[dirpath] = _mtime(dirpath)
+                    for name in [''] + dirnames + filenames:
+                        fullpath = ospath.join(dirpath, name) if name else dirpath
+                        pathpart = ospath.relpath(fullpath, layerdir)
+                        key = pathpart if pname is None else '%s:%s' % (pname, pathpart)
+                        # layers are walked in priority order, the first one wins
+                        paths.setdefault(key, fullpath)
+        self.paths = paths
+        self._dir_mtimes = dir_mtimes
+        self._checked_at = time.time()
+        log.debug('file index built: %d entries', len(paths))
+
+    def covers(self, pathpart):
+        """ True if `pathpart` is in one of the indexed sub-directories """
+        return pathpart.split(os.sep, 1)[0] in self.subdirs
+
+    def lookup(self, key):
+        return self.paths.get(key)
+
+    def refresh(self):
+        """
+            Rebuild the index if polling is enabled, it's time to check, and a
+            directory has changed.  Returns True if the index was rebuilt.
+        """
+        if not self.poll_interval:
+            return False
+        now = time.time()
+        if now - self._checked_at < self.poll_interval:
+            return False
+        self._checked_at = now
+        for dirpath, mtime in six.iteritems(self._dir_mtimes):
+            if _mtime(dirpath) != mtime:
+                log.debug('file index: %s changed, rebuilding', dirpath)
+                self.build()
+                return True
+        return False
+
+
+def hierarchy_file_map(subdirs=('templates', 'static')):
+    """
+        Walks the given directories of every app & component in the hierarchy
+        and returns a dict that maps each findfile() endpoint found to the full
+        path that findfile() would return for it.
+    """
+    return FileIndex(get_topology(), subdirs).paths
+
+
 def listapps(reverse=False):
-    if reverse:
-        apps = list(settings.supporting_apps)
-        apps.reverse()
-        apps.append(settings.app_package)
-        return apps
-    return [settings.app_package] + settings.supporting_apps
+    topology = get_topology()
+    return list(topology.apps_reversed if reverse else topology.apps)
 
 
 def listcomponents(reverse=False):
     """
         a flat list of the namespace of each enabled component
     """
-    ul = UniqueList()
-    for _, pname, _ in list_component_mappings():
-        ul.append(pname)
-    retval = list(ul)
-    if reverse:
-        retval.reverse()
-    return retval
+    topology = get_topology()
+    return list(topology.components_reversed if reverse else topology.components)
 
 
 def list_component_packages():
     """
         a flat list of enabled component packages
     """
-    if not hasattr(ag, 'hierarchy_component_packages'):
-        packages = []
-        for _, _, packagename in list_component_mappings():
-            if packagename:
-                packages.append(packagename)
-        ag.hierarchy_component_packages = packages
-    return ag.hierarchy_component_packages
+    return list(get_topology().component_packages)
 
 
 def list_component_mappings(target_component=None, reverse=False, inc_apps=False):
@@ -113,20 +446,117 @@ def list_component_mappings(target_component=None, reverse=False, inc_apps=False
         The package name will be None if the location of the component is internal
         to the app.
     """
-    retval = []
-    for app in listapps():
-        if inc_apps:
-            retval.append((app, None, None))
-        acomponents = getattr(settings.componentmap, app)
-        for pname in acomponents.keys():
-            if target_component is None or pname == target_component:
-                for package in acomponents.get_dotted('%s.packages' % pname):
-                    retval.append((app, pname, package))
-    if reverse:
-        retval.reverse()
-    return retval
+    return list(get_topology().list_mappings(target_component, reverse, inc_apps))
 
 
+class HierarchyStats(object):
+    """
+        Counters & timers for the hierarchy lookup functions.  When
+        settings.hierarchy.stats.enabled is set, the application keeps one of
+        these in ag.hierarchy_stats.
+
+        For each function, and each endpoint a function was called with, it
+        records the number of calls, the time spent, and how the lookups
+        were answered:
+
+            hits: from a cache of things that were found
+            misses: by searching the apps & components
+            negative_hits: from the cache of things that were not found
+            import_seconds: the part of the time spent importing modules
+    """
+    fields = ('calls', 'seconds', 'hits', 'misses', 'negative_hits', 'import_seconds')
+
+    def __init__(self):
+        self.functions = {}
+        self.endpoints = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _entries(self, name, endpoint):
+        with self._lock:
+            if name not in self.functions:
+                self.functions[name] = dict.fromkeys(self.fields, 0)
+            key = (name, endpoint)
+            if key not in self.endpoints:
+                self.endpoints[key] = dict.fromkeys(self.fields, 0)
+            return self.functions[name], self.endpoints[key]
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def measure(self, name, endpoint):
+        entries = self._entries(name, endpoint)
+        self._stack.append(entries)
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            self._stack.pop()
+            for entry in entries:
+                entry['calls'] += 1
+                entry['seconds'] += elapsed
+
+    def add(self, field, amount=1):
+        """ add to a field of the function currently being measured """
+        if self._stack:
+            for entry in self._stack[-1]:
+                entry[field] += amount
+
+    def clear(self):
+        with self._lock:
+            self.functions.clear()
+            self.endpoints.clear()
+
+    def costs(self, name):
+        """
+            [(endpoint, milliseconds, import milliseconds), ...] for the calls
+            to the function `name`, most expensive first
+        """
+        rows = [
+            (endpoint, round(v['seconds'] * 1000, 3), round(v['import_seconds'] * 1000, 3))
+            for (fname, endpoint), v in six.iteritems(self.endpoints) if fname == name
+        ]
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def todict(self):
+        return {
+            'functions': dict((k, dict(v)) for k, v in six.iteritems(self.functions)),
+            'endpoints': dict(
+                ('%s(%s)' % key, dict(v)) for key, v in six.iteritems(self.endpoints)
+            ),
+        }
+
+
+def _stats_add(field, amount=1):
+    stats = ag.hierarchy_stats
+    if stats is not None:
+        stats.add(field, amount)
+
+
+def measured(func):
+    """
+        decorator for hierarchy functions that take an endpoint (or dotpath)
+        as their first argument so that calls to them are recorded in
+        ag.hierarchy_stats
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(endpoint, *args, **kwargs):
+        stats = ag.hierarchy_stats
+        if stats is None:
+            return func(endpoint, *args, **kwargs)
+        with stats.measure(name, endpoint):
+            return func(endpoint, *args, **kwargs)
+    return wrapper
+
+
+@measured
 def findcontent(endpoint):
     try:
         return findendpoint(endpoint, 'content')
@@ -136,6 +566,7 @@ def findcontent(endpoint):
         raise HierarchyImportError('An object for Content endpoint "%s" was not found' % endpoint)
 
 
+@measured
 def findview(endpoint):
     try:
         return findendpoint(endpoint, 'views')
@@ -171,12 +602,25 @@ def findendpoint(endpoint, where):
         Raises: ImportError if view is not found.  But can also raise an
             ImportError if other
     """
+    # the endpoint index maps endpoints directly to the resolved object so
+    # that repeat lookups (i.e. every request dispatched to a view) don't have
+    # to go through the finders
+    index = ag.hierarchy_endpoint_index
+    indexkey = (where, endpoint)
+    if indexkey in index:
+        log.debug('found %s:%s in cache: endpoint index', where, endpoint)
+        _stats_add('hits')
+        return index[indexkey]
     if ':' not in endpoint:
-        return AppFinder(where, endpoint).search()
-    component, attr = endpoint.split(':')
-    return ComponentFinder(component, where, attr).search()
+        found = AppFinder(where, endpoint).search()
+    else:
+        component, attr = endpoint.split(':')
+        found = ComponentFinder(component, where, attr).search()
+    index[indexkey] = found
+    return found
 
 
+@measured
 def findfile(endpoint_path):
     """
         locate a file in the hierarchy based on an endpoint and path.  Usage:
@@ -201,6 +645,7 @@ def findfile(endpoint_path):
     return fpath
 
 
+@measured
 def findobj(endpoint):
     """
         Allows hieararchy importing based on strings:
@@ -224,7 +669,8 @@ def findobj(endpoint):
     return getattr(collector, attr)
 
 
-def visitmods(dotpath, reverse=False, call_with_mod=None, reloadmod=True):
+@measured
+def visitmods(dotpath, reverse=False, call_with_mod=None, reloadmod=True, layers=None):
     """
         Import python modules installed in the appstack or compstack.  Modules
         are visited from the top down.
@@ -240,17 +686,21 @@ def visitmods(dotpath, reverse=False, call_with_mod=None, reloadmod=True):
             app to the view. If the views module is shared among more than one
             application running in the same process, an external component for
             example, then that side-affect needs to be repeated for each
-            application.
+            application.  See settings.hierarchy.shared_modules for how views
+            modules avoid this.
+        layers: the (app, component, package) mappings to visit instead of the
+            whole hierarchy, e.g. ComponentTopology.component_mappings['news']
     """
-    visitlist = list_component_mappings(inc_apps=True, reverse=reverse)
+    if layers is None:
+        visitlist = get_topology().list_mappings(inc_apps=True, reverse=reverse)
+    else:
+        visitlist = tuple(reversed(layers)) if reverse else layers
+    manifest = ag.hierarchy_manifest
     for app, pname, package in visitlist:
         try:
-            if not pname and not package:
-                impstr = '%s.%s' % (app, dotpath)
-            elif package:
-                impstr = '%s.%s' % (package, dotpath)
-            else:
-                impstr = '%s.components.%s.%s' % (app, pname, dotpath)
+            impstr = layer_import_name(app, pname, package, dotpath)
+            if manifest is not None and impstr in manifest.missing_modules:
+                continue
             if impstr in sys.modules:
                 mod_loaded_by = getattr(
                     sys.modules[impstr], '_blazeweb_hierarchy_last_imported_by', None
@@ -259,6 +709,11 @@ def visitmods(dotpath, reverse=False, call_with_mod=None, reloadmod=True):
                 if reloadmod and mod_loaded_by != current_app_id:
                     module = six.moves.reload_module(sys.modules[impstr])
                     module._blazeweb_hierarchy_last_imported_by = current_app_id
+                    # the reload created new objects, so anything resolved
+                    # from the old module is now stale
+                    ag.hierarchy_endpoint_index.clear()
+                    if ag.hierarchy_import_misses is not None:
+                        ag.hierarchy_import_misses.clear()
                 else:
                     module = sys.modules[impstr]
             else:
@@ -296,6 +751,41 @@ def gatherobjs(dotpath, filter, reloadmod=False):
     return collected
 
 
+def clear_caches():
+    """
+        Empties all of the current application's hierarchy caches.  The
+        caches assume the component map doesn't change once the application
+        is initialized, so this needs to be called if it does.
+    """
+    if ag.hierarchy_topology is not None:
+        ag.hierarchy_topology = ComponentTopology(settings._current_obj())
+    ag.hierarchy_endpoint_index.clear()
+    ag.hierarchy_import_cache.clear()
+    ag.hierarchy_file_cache.clear()
+    if ag.hierarchy_file_index is not None:
+        ag.hierarchy_file_index = FileIndex(
+            ag.hierarchy_topology or get_topology(),
+            ag.hierarchy_file_index.subdirs,
+            ag.hierarchy_file_index.poll_interval,
+        )
+    for misses in (ag.hierarchy_import_misses, ag.hierarchy_file_misses):
+        if misses is not None:
+            misses.clear()
+
+
+def _cached_miss(misses, cachekey):
+    if misses is not None and misses.get(cachekey) is not None:
+        log.debug('found %s in cache: not in hierarchy', cachekey)
+        _stats_add('negative_hits')
+        return True
+    return False
+
+
+def _record_miss(misses, cachekey):
+    if misses is not None:
+        misses.set(cachekey, True)
+
+
 class FileFinderBase(object):
 
     def __init__(self, pathpart):
@@ -306,6 +796,7 @@ class FileFinderBase(object):
         fullpath = ag.hierarchy_file_cache.get(self.cachekey)
         if fullpath:
             log.debug('found %s in cache: %s', self.cachekey, fullpath)
+            _stats_add('hits')
             return fullpath
 
     @classmethod
@@ -316,18 +807,34 @@ class FileFinderBase(object):
         return ComponentFileFinder(component, pathpart).search()
 
     def package_dir(self, package):
-        package_mod = hm.builtin_import(package, fromlist=[''])
-        return ospath.dirname(package_mod.__file__)
+        return get_topology().package_dir(package)
 
     def search(self):
+        index = ag.hierarchy_file_index
+        if index is not None and index.refresh():
+            # what was found before might not be right anymore
+            ag.hierarchy_file_cache.clear()
+            if ag.hierarchy_file_misses is not None:
+                ag.hierarchy_file_misses.clear()
+
         fullpath = self.cached_path()
         if fullpath:
             return fullpath
 
-        fullpath = self.search_apps()
+        misses = ag.hierarchy_file_misses
+        if _cached_miss(misses, self.cachekey):
+            return
+
+        _stats_add('misses')
+        if index is not None and index.covers(self.pathpart):
+            fullpath = index.lookup(self.cachekey)
+            log.debug('file index lookup for %s: %s', self.cachekey, fullpath)
+        else:
+            fullpath = self.search_apps()
         if fullpath:
             ag.hierarchy_file_cache[self.cachekey] = fullpath
             return fullpath
+        _record_miss(misses, self.cachekey)
 
 
 class AppFileFinder(FileFinderBase):
@@ -336,7 +843,7 @@ class AppFileFinder(FileFinderBase):
         self.cachekey = self.pathpart
 
     def search_apps(self):
-        for app in listapps():
+        for app in get_topology().apps:
             testpath = ospath.join(self.package_dir(app), self.pathpart)
             if ospath.exists(testpath):
                 return testpath
@@ -352,7 +859,7 @@ class ComponentFileFinder(FileFinderBase):
         FileFinderBase.__init__(self, pathpart)
 
     def search_apps(self):
-        for app, pname, package in list_component_mappings(self.component):
+        for app, pname, package in get_topology().list_mappings(self.component):
             if not package:
                 testpath = ospath.join(
                     self.package_dir(app), 'components', self.component, self.pathpart
@@ -380,6 +887,7 @@ class FinderBase(object):
         if module_location:
             module = hm.builtin_import(module_location, globals(), locals(), [''])
             log.debug('found %s in cache: %s', self.cachekey, module)
+            _stats_add('hits')
             return module
 
     def search(self):
@@ -401,6 +909,7 @@ class FinderBase(object):
         # finding the module or finding the attribute
         orig_attr = self.attr
         self.attr = None
+        self.assign_cachekey()
         module = self._search()
         if not module:
             raise HierarchyImportError(
@@ -412,11 +921,23 @@ class FinderBase(object):
 
     def _search(self):
         module = self.cached_module()
+        if module:
+            return module
+        misses = ag.hierarchy_import_misses
+        if _cached_miss(misses, self.cachekey):
+            return
+        _stats_add('misses')
+        module = self.search_apps()
         if not module:
-            module = self.search_apps()
+            _record_miss(misses, self.cachekey)
         return module
 
     def try_import(self, dlocation):
+        manifest = ag.hierarchy_manifest
+        if manifest is not None and dlocation in manifest.missing_modules:
+            log.debug('could not import: %s (startup manifest)', dlocation)
+            return
+        started = time.time()
         try:
             foundmod = hm.builtin_import(dlocation, globals(), locals(), [''])
             if self.attr is None or hasattr(foundmod, self.attr):
@@ -437,6 +958,8 @@ class FinderBase(object):
             if dlocation in str(e):
                 return
             raise
+        finally:
+            _stats_add('import_seconds', time.time() - started)
 
         log.debug('could not import: %s', self.cachekey)
 
@@ -448,7 +971,7 @@ class AppFinder(FinderBase):
         self.cachekey = 'appstack.%s:%s' % (self.location, self.attr)
 
     def search_apps(self):
-        for app in listapps():
+        for app in get_topology().apps:
             dlocation = '%s.%s' % (app, self.location)
             module = self.try_import(dlocation)
             if module:
@@ -470,7 +993,7 @@ class ComponentFinder(FinderBase):
         self.cachekey = 'compstack.%s:%s' % (self.exclocation, self.attr)
 
     def search_apps(self):
-        for app, pname, package in list_component_mappings(self.component):
+        for app, pname, package in get_topology().list_mappings(self.component):
             if not package:
                 dlocation = '%s.components.%s' % (app, self.exclocation)
             else:
@@ -493,6 +1016,22 @@ class ImportOverrideHelper(object):
         if name.startswith('appstack.'):
             return AppstackImport(name, fromlist).search()
 
+    @classmethod
+    def findattr(cls, name, attr):
+        if name.startswith('compstack.'):
+            return CompstackImport(name, [attr]).find_attrobj(attr)
+        return AppstackImport(name, [attr]).find_attrobj(attr)
+
+    @classmethod
+    def findmodule(cls, name):
+        """ the module `name` resolves to in the current hierarchy or None """
+        if name.startswith('compstack.'):
+            return CompstackImport(name, []).finder(None)._search()
+        return AppstackImport(name, []).finder(None)._search()
+
+    def find_attrobj(self, attr):
+        return self.finder(attr).search()
+
     def search(self):
         if not self.fromlist:
             raise HierarchyImportError(
@@ -508,22 +1047,22 @@ class ImportOverrideHelper(object):
 class CompstackImport(ImportOverrideHelper):
     type = 'compstack'
 
-    def find_attrobj(self, attr):
+    def finder(self, attr):
         parts = self.name.split('.', 2)
         component = parts[1]
         try:
             name = parts[2]
         except IndexError:
             name = ''
-        return ComponentFinder(component, name, attr).search()
+        return ComponentFinder(component, name, attr)
 
 
 class AppstackImport(ImportOverrideHelper):
     type = 'appstack'
 
-    def find_attrobj(self, attr):
+    def finder(self, attr):
         _, name = self.name.split('.', 1)
-        return AppFinder(name, attr).search()
+        return AppFinder(name, attr)
 
 
 def split_endpoint(endpoint):
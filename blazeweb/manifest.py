@@ -0,0 +1,196 @@
+"""
+    A startup manifest records the results of the hierarchy discovery that
+    WSGIApp does when it is instantiated: which component modules exist,
+    where endpoints resolve to, and the template & static file paths.
+
+    When the manifest is enabled in the settings and still matches the
+    packages on disk, WSGIApp loads it at startup and skips the import
+    probing.  Build one with the "hierarchy-manifest" command.
+
+    Only the Python code of the packages is checked for changes, not the
+    templates & static files, so rebuild the manifest when those are added
+    or removed (e.g. as a deploy step).
+"""
+import hashlib
+import json
+import logging
+import os
+from os import path
+
+import six
+
+from blazeweb import VERSION
+from blazeweb.globals import ag
+from blazeweb.hierarchy import ComponentTopology, findview, hierarchy_file_map, hm, \
+    HierarchyImportError, is_missing_module_error, layer_import_name
+from blazeweb.utils.filesystem import mkdirs
+from blazeweb.views import ASVIEW_ROUTES
+
+log = logging.getLogger(__name__)
+
+# bump when the format of the manifest file changes
+MANIFEST_VERSION = 2
+
+# the modules that WSGIApp looks for in every app and component on startup
+PROBED_DOTPATHS = ('events', 'config.settings', 'views')
+
+# directories of a package that fingerprint() doesn't look in
+SKIPPED_DIRS = ('static', 'templates', '__pycache__')
+
+
+def fingerprint(settings, topology=None):
+    """
+        A hash of what the manifest's contents depend on: the BlazeWeb
+        version, the settings profile, the component map and, for the
+        packages of the hierarchy, the mtimes of their Python package
+        directories (which change when modules are added or removed) and
+        .py files.  Directories that aren't Python packages, like static/
+        and templates/, aren't walked.
+    """
+    if topology is None:
+        topology = ComponentTopology(settings)
+    sha = hashlib.sha1()
+
+    def update(value):
+        sha.update(six.text_type(value).encode('utf-8'))
+
+    update(VERSION)
+    update('%s.%s' % (settings.__class__.__module__, settings.__class__.__name__))
+    update(topology.mappings_with_apps)
+    for package in sorted(topology.package_names):
+        pkgdir = topology.package_dir(package)
+        update(package)
+        for dirpath, dirnames, filenames in os.walk(pkgdir, followlinks=True):
+            if dirpath != pkgdir and '__init__.py' not in filenames:
+                dirnames[:] = []
+                continue
+            dirnames[:] = sorted(d for d in dirnames if d not in SKIPPED_DIRS)
+            update(path.relpath(dirpath, pkgdir))
+            update(repr(os.stat(dirpath).st_mtime))
+            for fname in sorted(filenames):
+                if not fname.endswith('.py'):
+                    continue
+                fpath = path.join(dirpath, fname)
+                update(fname)
+                update(repr(os.stat(fpath).st_mtime))
+    return sha.hexdigest()
+
+
+class StartupManifest(object):
+
+    def __init__(self, fingerprint, missing_modules=(), import_cache=None, files=None,
+                 routes=()):
+        self.fingerprint = fingerprint
+        self.missing_modules = frozenset(missing_modules)
+        self.import_cache = dict(import_cache or {})
+        self.files = dict(files or {})
+        # the @asview routes of the components' views modules as
+        # (rule, endpoint, options), used when components are loaded lazily
+        self.routes = [tuple(route) for route in routes]
+
+    @classmethod
+    def build(cls, app):
+        """
+            Build the manifest for an instantiated WSGIApp.  The app's ag
+            object has to be the current one.
+        """
+        topology = ag.hierarchy_topology
+        missing = []
+        routes = []
+        for app_name, pname, package in topology.mappings_with_apps:
+            for dotpath in PROBED_DOTPATHS:
+                impstr = layer_import_name(app_name, pname, package, dotpath)
+                try:
+                    hm.builtin_import(impstr, fromlist=[''])
+                    if dotpath == 'views' and pname is not None:
+                        routes.extend(ASVIEW_ROUTES.get(impstr, {}).values())
+                except ImportError as e:
+                    if is_missing_module_error(e, impstr):
+                        missing.append(impstr)
+                    else:
+                        # the module exists but is broken; leave it out of the
+                        # manifest so the error shows up when it's used
+                        log.warning('startup manifest: error importing %s: %s', impstr, e)
+
+        # resolve every routed endpoint so that the import cache knows where
+        # the views are
+        for rule in ag.route_map.iter_rules():
+            try:
+                findview(rule.endpoint)
+            except HierarchyImportError:
+                log.warning('startup manifest: endpoint %s could not be resolved', rule.endpoint)
+
+        return cls(
+            fingerprint(app.settings, topology),
+            sorted(missing),
+            ag.hierarchy_import_cache,
+            hierarchy_file_map(),
+            routes,
+        )
+
+    @classmethod
+    def load(cls, fpath):
+        """
+            Returns None if the file doesn't exist or isn't a manifest this
+            version of BlazeWeb understands.
+        """
+        if not path.exists(fpath):
+            return None
+        try:
+            with open(fpath) as fh:
+                data = json.load(fh)
+        except ValueError:
+            log.warning('startup manifest at %s could not be parsed', fpath)
+            return None
+        if data.get('version') != MANIFEST_VERSION:
+            log.warning('startup manifest at %s has an unsupported version', fpath)
+            return None
+        return cls(
+            data['fingerprint'],
+            data['missing_modules'],
+            data['import_cache'],
+            data['files'],
+            data['routes'],
+        )
+
+    def todict(self):
+        return {
+            'version': MANIFEST_VERSION,
+            'fingerprint': self.fingerprint,
+            'missing_modules': sorted(self.missing_modules),
+            'import_cache': self.import_cache,
+            'files': self.files,
+            'routes': self.routes,
+        }
+
+    def save(self, fpath):
+        fpath = path.abspath(fpath)
+        mkdirs(path.dirname(fpath))
+        # write to a temporary file and rename it so that an application
+        # starting up never sees a partially written manifest
+        tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+        with open(tmppath, 'w') as fh:
+            json.dump(self.todict(), fh, indent=1, sort_keys=True)
+        os.rename(tmppath, fpath)
+
+    def apply(self, ag):
+        """ prime the hierarchy caches of an application with the manifest """
+        ag.hierarchy_manifest = self
+        ag.hierarchy_import_cache.update(self.import_cache)
+        ag.hierarchy_file_cache.update(self.files)
+
+
+def load_manifest(settings):
+    """
+        Load the manifest given in the settings.  Returns None if the manifest
+        doesn't exist or is stale.
+    """
+    fpath = settings.hierarchy.manifest.fpath
+    manifest = StartupManifest.load(fpath)
+    if manifest is None:
+        return None
+    if manifest.fingerprint != fingerprint(settings):
+        log.warning('startup manifest at %s is stale and will not be used', fpath)
+        return None
+    log.debug('using startup manifest at %s', fpath)
+    return manifest
@@ -0,0 +1,87 @@
+"""
+    Cached conversion of reStructuredText & Markdown to HTML.
+
+    Converting with docutils is slow, and the text of documentation-like
+    pages rarely changes.  The HTML is cached under a hash of the text
+    (and the converter's options) in a bounded in-memory LRU and, if
+    settings.templating.markup_cache.dir is set, in files in that
+    directory, which processes can share.
+"""
+import hashlib
+import os
+from os import path
+
+from blazeutils.rst import rst2html
+from markdown2 import markdown
+import six
+
+from blazeweb.globals import ag
+from blazeweb.utils import registry_has_object
+from blazeweb.utils.datastructures import LRUCache
+from blazeweb.utils.filesystem import mkdirs
+
+
+class MarkupCache(object):
+
+    def __init__(self, maxsize, directory=None):
+        self.memory = LRUCache(maxsize)
+        self.directory = directory
+        if directory:
+            mkdirs(directory)
+
+    def key(self, name, text, options):
+        sha = hashlib.sha1()
+        sha.update(six.text_type(name).encode('utf-8'))
+        sha.update(six.text_type(repr(options)).encode('utf-8'))
+        sha.update(six.text_type(text).encode('utf-8'))
+        return sha.hexdigest()
+
+    def fpath(self, key):
+        return path.join(self.directory, key + '.html')
+
+    def get(self, key):
+        html = self.memory.get(key)
+        if html is not None or not self.directory:
+            return html
+        try:
+            with open(self.fpath(key), 'rb') as fh:
+                html = fh.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+        self.memory.set(key, html)
+        return html
+
+    def set(self, key, html):
+        self.memory.set(key, html)
+        if not self.directory:
+            return
+        fpath = self.fpath(key)
+        tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+        with open(tmppath, 'wb') as fh:
+            fh.write(six.text_type(html).encode('utf-8'))
+        os.rename(tmppath, fpath)
+
+    def convert(self, name, func, text, *args, **kwargs):
+        key = self.key(name, text, (args, sorted(kwargs.items())))
+        html = self.get(key)
+        if html is None:
+            html = func(text, *args, **kwargs)
+            self.set(key, html)
+        return html
+
+
+def _convert(name, func, text, *args, **kwargs):
+    cache = ag.markup_cache if registry_has_object(ag) else None
+    if cache is None:
+        return func(text, *args, **kwargs)
+    return cache.convert(name, func, text, *args, **kwargs)
+
+
+def cached_rst2html(text, *args, **kwargs):
+    """ rst2html() using the application's markup cache """
+    return _convert('rst2html', rst2html, text, *args, **kwargs)
+
+
+def cached_markdown(text, *args, **kwargs):
+    """ markdown2.markdown() using the application's markup cache """
+    return _convert('markdown', markdown, text, *args, **kwargs)
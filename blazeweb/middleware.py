@@ -1,4 +1,7 @@
+from datetime import datetime
 import logging
+import mimetypes
+import os
 from os import path
 from io import StringIO
 from tempfile import TemporaryFile
@@ -9,12 +12,16 @@ from blazeutils import randchars, pformat, tolist
 from paste.registry import RegistryManager
 from werkzeug.datastructures import EnvironHeaders
 from werkzeug.debug import DebuggedApplication
+from werkzeug.http import http_date, is_resource_modified, parse_accept_header
 from werkzeug.middleware.shared_data import SharedDataMiddleware
-from werkzeug.wsgi import LimitedStream
+from werkzeug.wsgi import FileWrapper, LimitedStream
 
 from blazeweb import routing
+from blazeweb.bundles import BUNDLE_DIR
 from blazeweb.hierarchy import findfile, FileNotFound
 from blazeweb.globals import settings, ag
+from blazeweb.static import FingerprintedStatic
+from blazeweb.utils.datastructures import LRUCache
 from blazeweb.utils.filesystem import mkdirs
 
 log = logging.getLogger(__name__)
@@ -87,6 +94,36 @@ class HttpRequestLogger(object):
         return environ['wsgi.input']
 
 
+def static_endpoint(pathpart):
+    """
+        The hierarchy endpoint of a static file's URL path, relative to the
+        static prefix:
+
+            app/css/site.css -> static/css/site.css
+            component/news/css/news.css -> news:static/css/news.css
+
+        Raises ValueError when the path can't be for a static file.
+    """
+    if pathpart is None:
+        raise ValueError('pathpart is None')
+    if not pathpart.count('/'):
+        raise ValueError('pathpart had no slashes')
+    type, locpath = pathpart.split('/', 1)
+    if not locpath:
+        raise ValueError('pathpart had type, but not locpath')
+    if type not in ('app', 'component'):
+        raise ValueError('type was not "app" or "component"')
+    if type == 'component':
+        if not locpath.count('/'):
+            raise ValueError('component type, but locpath had no slashes')
+        component, locpath = locpath.split('/', 1)
+    # look in the static directory
+    locpath = 'static/' + locpath
+    if type == 'app':
+        return locpath
+    return '%s:%s' % (component, locpath)
+
+
 class StaticFileServer(SharedDataMiddleware):
     """
         Serves static files based on hierarchy structure
@@ -100,30 +137,11 @@ class StaticFileServer(SharedDataMiddleware):
 
     def get_directory_loader(self, directory):
         def loader(pathpart):
-            if pathpart is None:
-                self.debug(pathpart, 'pathpart is None')
-                return None, None
-            if not pathpart.count('/'):
-                self.debug(pathpart, 'pathpart had no slashes')
-                return None, None
-            type, locpath = pathpart.split('/', 1)
-            if not locpath:
-                self.debug(pathpart, 'pathpart had type, but not locpath')
-                return None, None
-            if type not in ('app', 'component'):
-                self.debug(pathpart, 'type was not "app" or "component"')
+            try:
+                endpoint = static_endpoint(pathpart)
+            except ValueError as e:
+                self.debug(pathpart, str(e))
                 return None, None
-            if type == 'component':
-                if not locpath.count('/'):
-                    self.debug(pathpart, 'component type, but locpath had no slashes')
-                    return None, None
-                component, locpath = locpath.split('/', 1)
-            # look in the static directory
-            locpath = 'static/' + locpath
-            if type == 'app':
-                endpoint = locpath
-            else:
-                endpoint = '%s:%s' % (component, locpath)
             try:
                 fpath = findfile(endpoint)
                 return path.basename(fpath), self._opener(fpath)
@@ -133,17 +151,209 @@ class StaticFileServer(SharedDataMiddleware):
         return loader
 
 
+def safe_static_path(pathpart):
+    """
+        False for static URL paths that could resolve outside of a static
+        directory: absolute paths and paths with empty, "." or ".." segments
+        or with path separators of the OS in a segment
+    """
+    if not pathpart or pathpart.startswith('/'):
+        return False
+    for part in pathpart.split('/'):
+        if part in ('', '.', '..') or os.sep in part or (os.altsep and os.altsep in part):
+            return False
+    return True
+
+
+def find_static_file(pathpart):
+    """ resolves a static URL path with the hierarchy, None if not found """
+    if not safe_static_path(pathpart):
+        return None
+    try:
+        return findfile(static_endpoint(pathpart))
+    except (ValueError, FileNotFound):
+        return None
+
+
+class StaticDirectory(object):
+    """ resolves static URL paths to files in a directory, None if not found """
+
+    def __init__(self, directory):
+        self.directory = path.abspath(directory)
+
+    def __call__(self, pathpart):
+        if not safe_static_path(pathpart):
+            return None
+        fpath = path.join(self.directory, *pathpart.split('/'))
+        if not path.isfile(fpath):
+            return None
+        return fpath
+
+
+class StaticFile(object):
+    """
+        What ProductionStaticServer knows about a file: its headers and, for
+        small files, its contents.
+    """
+
+    def __init__(self, fpath, memory_max_size, content_type=None, encoding=None):
+        stat = os.stat(fpath)
+        self.fpath = fpath
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.last_modified = datetime.utcfromtimestamp(self.mtime)
+        self.encoding = encoding
+        # a strong ETag; the compressed version of a file is a different
+        # representation and needs its own
+        self.etag = '%x-%x%s' % (self.mtime, self.size, '-gz' if encoding else '')
+        self.content_type = content_type or self.guess_type(fpath)
+        self.body = None
+        if self.size <= memory_max_size:
+            with open(fpath, 'rb') as fh:
+                self.body = fh.read()
+
+    @staticmethod
+    def guess_type(fpath):
+        mimetype = mimetypes.guess_type(fpath)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=utf-8'
+        return mimetype
+
+    def headers(self, max_age):
+        headers = [
+            ('Content-Type', self.content_type),
+            ('ETag', '"%s"' % self.etag),
+            ('Last-Modified', http_date(self.last_modified)),
+            ('Cache-Control', 'public, max-age=%d' % max_age),
+        ]
+        if self.encoding:
+            headers.append(('Content-Encoding', self.encoding))
+        return headers
+
+
+class ProductionStaticServer(object):
+    """
+        Serves static files for production, where the files don't change while
+        the application is running:
+
+        - resolved files (and paths that weren't found) are kept in a bounded
+          LRU cache, along with the contents of files up to `memory_max_size`
+          bytes
+        - a ".gz" sidecar of a file, see utils.filesystem.gzip_sidecar(), is
+          sent to clients that accept gzip
+        - bigger files are sent with the server's wsgi.file_wrapper, which
+          can use sendfile()
+        - responses have strong ETags and a Last-Modified header, and
+          If-None-Match/If-Modified-Since requests get a 304
+
+        `resolve` is a callable that takes the URL path of a file relative to
+        the static prefix and returns the file's path or None.
+    """
+
+    def __init__(self, app, resolve, prefix, cache_size=1000, memory_max_size=64 * 1024,
+                 max_age=43200):
+        self.app = app
+        self.resolve = resolve
+        self.prefix = '/' + prefix.strip('/') + '/'
+        self.cache = LRUCache(cache_size)
+        self.memory_max_size = memory_max_size
+        self.max_age = max_age
+
+    def find(self, pathpart):
+        """
+            Returns (file, gzipped file) for the path, the latter being None
+            if there isn't a sidecar, or None if the file doesn't exist.
+        """
+        found = self.cache.get(pathpart)
+        if found is not None:
+            return found or None
+        fpath = self.resolve(pathpart)
+        if fpath is None:
+            found = False
+        else:
+            sfile = StaticFile(fpath, self.memory_max_size)
+            gzfile = None
+            gzpath = fpath + '.gz'
+            # a sidecar older than the file is out of date
+            if path.isfile(gzpath) and os.stat(gzpath).st_mtime >= os.stat(fpath).st_mtime:
+                gzfile = StaticFile(gzpath, self.memory_max_size, sfile.content_type, 'gzip')
+            found = (sfile, gzfile)
+        self.cache.set(pathpart, found)
+        return found or None
+
+    def accepts_gzip(self, environ):
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        return accept['gzip'] > 0 or (accept['*'] > 0 and 'gzip' not in accept)
+
+    def __call__(self, environ, start_response):
+        path_info = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method not in ('GET', 'HEAD') or not path_info.startswith(self.prefix):
+            return self.app(environ, start_response)
+        found = self.find(path_info[len(self.prefix):])
+        if found is None:
+            return self.app(environ, start_response)
+
+        sfile, gzfile = found
+        if gzfile is not None and self.accepts_gzip(environ):
+            sfile = gzfile
+        headers = sfile.headers(self.max_age)
+        if gzfile is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if not is_resource_modified(environ, sfile.etag, last_modified=sfile.last_modified):
+            headers = [(k, v) for k, v in headers if k != 'Content-Type']
+            start_response('304 Not Modified', headers)
+            return []
+
+        headers.append(('Content-Length', str(sfile.size)))
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            return []
+        if sfile.body is not None:
+            return [sfile.body]
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(sfile.fpath, 'rb'), 8192)
+
+
 def static_files(app):
     settings = ag.app.settings
 
     if settings.static_files.enabled:
         # serve static files from static directory (e.g. after copying
         # from the source packages; use static-copy command for that)
-        if settings.static_files.location == 'static':
+        if settings.static_files.production.enabled:
+            if settings.static_files.location == 'static':
+                resolve = StaticDirectory(settings.dirs.static)
+            else:
+                resolve = find_static_file
+            server = ProductionStaticServer(
+                app,
+                resolve,
+                settings.routing.static_prefix,
+                settings.static_files.production.cache_size,
+                settings.static_files.production.memory_max_size,
+                settings.static_files.production.max_age,
+            )
+        elif settings.static_files.location == 'static':
             exported_dirs = {'/' + routing.static_url('/'): settings.dirs.static}
-            return SharedDataMiddleware(app, exported_dirs)
+            server = SharedDataMiddleware(app, exported_dirs)
         # serve static files from source packages based on hierarchy rules
-        return StaticFileServer(app)
+        else:
+            server = StaticFileServer(app)
+        # bundles are only ever in the static directory
+        if settings.templating.bundles.enabled and settings.static_files.location != 'static':
+            bundle_dirs = {'/' + routing.static_url(BUNDLE_DIR): path.join(settings.dirs.static,
+                                                                           BUNDLE_DIR)}
+            server = SharedDataMiddleware(server, bundle_dirs)
+        if ag.static_manifest is not None:
+            server = FingerprintedStatic(
+                server,
+                ag.static_manifest,
+                settings.routing.static_prefix,
+                settings.static_files.fingerprint.max_age,
+            )
+        return server
     return app
 
 
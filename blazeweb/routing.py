@@ -1,5 +1,6 @@
-from blazeweb.globals import settings, rg
+from blazeweb.globals import ag, settings, rg
 from blazeweb.utils import registry_has_object
+import six
 from werkzeug.datastructures import MultiDict
 from werkzeug.routing import Rule
 from werkzeug.urls import Href
@@ -15,6 +16,132 @@ __all__ = [
 ]
 
 
+class StaticRouteIndex(object):
+    """
+        Matches requests for rules without any converters (i.e. static paths)
+        with a dict lookup, keyed on (subdomain, method, path), instead of
+        going through every rule's regex.  Anything the index can't answer
+        exactly the way Werkzeug would is left to the Werkzeug adapter: URLs
+        that need a redirect (strict_slashes, redirect_defaults, aliases,
+        redirect_to), method mismatches, and rules with converters.  Without
+        strict slashes, a rule is also indexed under the path with or without
+        the trailing slash, since Werkzeug matches both.
+
+        The index is rebuilt when rules are added to the map.
+    """
+
+    def __init__(self, route_map):
+        self.route_map = route_map
+        self.rule_count = None
+        self.rules = {}
+        self.build()
+
+    def indexable(self, rule, redirecting_endpoints):
+        if rule.redirect_to is not None or getattr(rule, 'websocket', False):
+            return False
+        if rule.alias and self.route_map.redirect_defaults:
+            return False
+        return rule.endpoint not in redirecting_endpoints
+
+    def rule_keys(self, rule, indexable):
+        """
+            Yields (key, served) for each request `rule` matches.  A request
+            that isn't served has to be left to Werkzeug, e.g. because it would
+            be redirected.
+        """
+        methods = rule.methods or (None, )
+        if rule.alias and self.route_map.redirect_defaults:
+            # the alias redirect happens before the method is checked
+            methods = (None, )
+        if rule.is_leaf:
+            paths = [(rule.rule, True)]
+            # without strict slashes "/foo" matches "/foo/" too
+            if not rule.strict_slashes:
+                paths.append((rule.rule + '/', True))
+        else:
+            # "/foo/" matches "/foo" too, but redirects it with strict slashes
+            paths = [(rule.rule, True), (rule.rule.rstrip('/'), not rule.strict_slashes)]
+        for path, served in paths:
+            for method in methods:
+                yield (rule.subdomain, method, path), served and indexable
+
+    def build(self):
+        route_map = self.route_map
+        # sorts the rules the way they will be matched
+        route_map.update()
+        rules = {}
+        if not route_map.host_matching:
+            # a static rule with defaults for the same endpoint may redirect
+            # to another URL, see MapAdapter.get_default_redirect()
+            redirecting_endpoints = set()
+            if route_map.redirect_defaults:
+                redirecting_endpoints = set(
+                    r.endpoint for r in route_map.iter_rules() if r.defaults and not r.arguments
+                )
+            for position, rule in enumerate(route_map._rules):
+                # rules with converters are sorted after all of the static ones
+                if rule.arguments or rule.build_only:
+                    continue
+                indexable = self.indexable(rule, redirecting_endpoints)
+                for key, served in self.rule_keys(rule, indexable):
+                    # the first rule to match a request decides it, even if that
+                    # means leaving it to werkzeug
+                    if key not in rules:
+                        rules[key] = (position, rule if served else None)
+        self.rules = rules
+        self.rule_count = len(route_map._rules)
+
+    def match(self, adapter, path_info=None, method=None, websocket=None):
+        """
+            Returns (rule, values) or None if the request has to be matched
+            by the Werkzeug adapter.
+        """
+        if len(self.route_map._rules) != self.rule_count:
+            self.build()
+        if websocket is None:
+            websocket = getattr(adapter, 'websocket', False)
+        if websocket:
+            return None
+        if path_info is None:
+            path_info = adapter.path_info
+        method = (method or adapter.default_method).upper()
+        path = path_info and '/%s' % path_info.lstrip('/')
+        found = self.rules.get((adapter.subdomain, method, path))
+        anymethod = self.rules.get((adapter.subdomain, None, path))
+        if anymethod is not None and (found is None or anymethod[0] < found[0]):
+            found = anymethod
+        if found is None or found[1] is None:
+            return None
+        rule = found[1]
+        return rule, dict(rule.defaults or {})
+
+
+class IndexedMapAdapter(object):
+    """
+        Wraps a Werkzeug MapAdapter so that match() tries the StaticRouteIndex
+        first.  Everything else is passed through to the adapter.
+    """
+
+    def __init__(self, adapter, index):
+        self.adapter = adapter
+        self.index = index
+
+    def match(self, path_info=None, method=None, return_rule=False, query_args=None,
+              websocket=None):
+        if isinstance(path_info, six.binary_type):
+            path_info = path_info.decode(self.adapter.map.charset)
+        found = self.index.match(self.adapter, path_info, method, websocket)
+        if found is None:
+            # Werkzeug < 1.0 has no websocket argument
+            kwargs = {} if websocket is None else {'websocket': websocket}
+            return self.adapter.match(path_info, method, return_rule, query_args, **kwargs)
+        rule, values = found
+        return (rule if return_rule else rule.endpoint), values
+
+    def __getattr__(self, name):
+        return getattr(self.adapter, name)
+
+
 def prefix_relative_url(url):
     """
         If the url given is an absolute url of any of the following forms:
@@ -47,22 +174,61 @@ def prefix_relative_url(url):
 def url_for(endpoint, _external=False, _https=None, **values):
     if _https is not None:
         _external = True
-    url = rg.urladapter.build(endpoint, values, force_external=_external)
+    adapter = rg.urladapter
+    cache = ag.url_cache
+    cachekey = None
+    if cache is not None:
+        # everything the built URL depends on, including the number of rules
+        # so that URLs are rebuilt if routes get added.  The types of the
+        # values are part of it because 1, 1.0 & True are equal keys but
+        # build differently.
+        cachekey = (endpoint, tuple(sorted((k, type(v), v) for k, v in values.items())),
+                    _external, _https,
+                    adapter.script_name, adapter.server_name, adapter.subdomain,
+                    adapter.url_scheme, len(adapter.map._rules))
+        try:
+            url = cache.get(cachekey)
+        except TypeError:
+            # unhashable values, e.g. a list for a multi-value query argument
+            cachekey = None
+        else:
+            if url is not None:
+                return url
+    url = adapter.build(endpoint, values, force_external=_external)
     if _https and url.startswith('http:'):
         url = url.replace('http:', 'https:', 1)
     elif _https is False and url.startswith('https:'):
         # need to specify _external=True for this to fire
         url = url.replace('https:', 'http:', 1)
+    if cachekey is not None:
+        cache.set(cachekey, url)
     return url
 
 
 def static_url(path):
     """
         Adds the conifgured "static" files prefix to the relative URL passed in.
+        If static file fingerprinting is enabled, the path of the file is
+        replaced by its fingerprinted version.
 
         NOTE: abs_static_url() will probably be more useful
     """
-    return '%s/%s' % (settings.routing.static_prefix.rstrip('/'), path.lstrip('/'))
+    prefix = settings.routing.static_prefix
+    cache = manifest = None
+    if registry_has_object(ag):
+        cache = ag.url_cache
+        manifest = ag.static_manifest
+    cachekey = ('static_url', path, prefix)
+    if cache is not None:
+        url = cache.get(cachekey)
+        if url is not None:
+            return url
+    if manifest is not None:
+        path = manifest.url_path(path)
+    url = '%s/%s' % (prefix.rstrip('/'), path.lstrip('/'))
+    if cache is not None:
+        cache.set(cachekey, url)
+    return url
 
 
 def abs_static_url(path):
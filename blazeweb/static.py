@@ -0,0 +1,113 @@
+"""
+    Content hashed ("fingerprinted") URLs for static files.
+
+    A static manifest maps the URL path of each static file in the hierarchy,
+    relative to the static prefix (e.g. "app/css/site.css"), to a path that
+    has a hash of the file's contents in it (e.g. "app/css/site.1a2b3c4d5e6f.css").
+    When it's enabled, static_url() emits the fingerprinted paths and the
+    static file servers map them back to the real files and send far-future,
+    immutable Cache-Control headers.  The URL changes when the file does, so
+    browsers never use an outdated copy.
+"""
+import json
+import logging
+import os
+from os import path
+
+import six
+
+from blazeweb.utils.filesystem import file_hash, mkdirs, static_sources
+
+log = logging.getLogger(__name__)
+
+# the number of hex characters of the hash put into the file names
+HASH_LENGTH = 12
+
+
+def fingerprinted_path(urlpath, digest):
+    """
+        app/css/site.css -> app/css/site.<digest>.css
+    """
+    dirname, fname = urlpath.rsplit('/', 1) if '/' in urlpath else ('', urlpath)
+    root, ext = path.splitext(fname)
+    fname = '%s.%s%s' % (root, digest, ext)
+    return '%s/%s' % (dirname, fname) if dirname else fname
+
+
+class StaticManifest(object):
+
+    def __init__(self, paths=None):
+        # original URL path -> fingerprinted URL path
+        self.paths = dict(paths or {})
+        self.originals = dict((v, k) for k, v in six.iteritems(self.paths))
+
+    @classmethod
+    def build(cls):
+        paths = {}
+        for urlpath, fpath in six.iteritems(static_sources()):
+            paths[urlpath] = fingerprinted_path(urlpath, file_hash(fpath)[:HASH_LENGTH])
+        return cls(paths)
+
+    @classmethod
+    def load(cls, fpath):
+        """ returns None if the manifest doesn't exist """
+        if not path.exists(fpath):
+            return None
+        with open(fpath) as fh:
+            return cls(json.load(fh))
+
+    @classmethod
+    def load_or_build(cls, fpath):
+        manifest = cls.load(fpath)
+        if manifest is None:
+            log.debug('static manifest not found at %s, building it', fpath)
+            manifest = cls.build()
+            manifest.save(fpath)
+        return manifest
+
+    def save(self, fpath):
+        fpath = path.abspath(fpath)
+        mkdirs(path.dirname(fpath))
+        tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+        with open(tmppath, 'w') as fh:
+            json.dump(self.paths, fh, indent=1, sort_keys=True)
+        os.rename(tmppath, fpath)
+
+    def url_path(self, urlpath):
+        """ the fingerprinted version of the URL path, if there is one """
+        return self.paths.get(urlpath.lstrip('/'), urlpath)
+
+    def original(self, urlpath):
+        """ the original URL path of a fingerprinted one or None """
+        return self.originals.get(urlpath.lstrip('/'))
+
+
+class FingerprintedStatic(object):
+    """
+        Middleware placed in front of a static file server.  Requests for
+        fingerprinted paths are handed to the server with the original path and
+        the response gets a far-future, immutable Cache-Control header.
+    """
+
+    def __init__(self, app, manifest, prefix, max_age):
+        self.app = app
+        self.manifest = manifest
+        self.prefix = '/' + prefix.strip('/') + '/'
+        self.cache_control = 'public, max-age=%d, immutable' % max_age
+
+    def __call__(self, environ, start_response):
+        path_info = environ.get('PATH_INFO', '')
+        if not path_info.startswith(self.prefix):
+            return self.app(environ, start_response)
+        original = self.manifest.original(path_info[len(self.prefix):])
+        if original is None:
+            return self.app(environ, start_response)
+
+        environ = dict(environ, PATH_INFO=self.prefix + original)
+
+        def immutable_start_response(status, headers, exc_info=None):
+            if status.startswith(('200', '304')):
+                headers = [(k, v) for k, v in headers if k.lower() != 'cache-control']
+                headers.append(('Cache-Control', self.cache_control))
+            return start_response(status, headers, exc_info)
+        return self.app(environ, immutable_start_response)
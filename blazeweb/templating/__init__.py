@@ -1,10 +1,16 @@
-from markdown2 import markdown
+from contextlib import contextmanager
+from os import path
+import threading
+import time
+
 from blazeutils.dates import safe_strftime
 from blazeutils.jsonh import jsonmod as json
 from blazeutils.numbers import moneyfmt
 from blazeutils.strings import simplify_string
+import six
 
 from blazeweb.globals import settings, user, rg
+from blazeweb.markup import cached_markdown
 from blazeweb.routing import url_for, current_url, static_url, abs_static_url
 from blazeweb.utils import registry_has_object
 from blazeweb.utils.html import strip_tags
@@ -29,6 +35,14 @@ class EngineBase(object):
     def render_template(self, endpoint, context):
         raise NotImplementedError('EngineBase must be subclassed')
 
+    def stream_template(self, endpoint, context, buffer_size=None):
+        """
+            returns an iterable of the template's output that renders the
+            template as it is iterated, in chunks of about `buffer_size`
+            pieces of output
+        """
+        raise NotImplementedError('EngineBase must be subclassed')
+
     def get_globals(self):
         globals = {}
         globals['url_for'] = url_for
@@ -41,12 +55,19 @@ class EngineBase(object):
         """ when a template has auto-escaping enabled, mark a value as safe """
         raise NotImplementedError('Translor must be subclassed')
 
+    def reload(self):
+        """
+            forget the templates that have been loaded so that they are
+            loaded again, from wherever the hierarchy finds them now
+        """
+        raise NotImplementedError('EngineBase must be subclassed')
+
     def get_filters(self):
         filters = {}
         filters['simplify'] = lambda x, *args, **kwargs: \
             self.mark_safe(simplify_string(x, *args, **kwargs))
         filters['markdown'] = lambda x, *args, **kwargs: \
-            self.mark_safe(markdown(x, *args, **kwargs))
+            self.mark_safe(cached_markdown(x, *args, **kwargs))
         filters['strip_tags'] = lambda x: self.mark_safe(strip_tags(x))
         filters['moneyfmt'] = lambda x, *args, **kwargs: \
             self.mark_safe(moneyfmt(x, *args, **kwargs))
@@ -68,6 +89,139 @@ class EngineBase(object):
             context.setdefault('rg', None)
 
 
+class ReloadFileWatcher(object):
+    """
+        Calls `callback` when the mtime of `fpath` changes (e.g. when a deploy
+        touches the file), checking at most once every `interval` seconds.
+    """
+
+    def __init__(self, fpath, callback, interval=1):
+        self.fpath = fpath
+        self.callback = callback
+        self.interval = interval
+        self.mtime = self.get_mtime()
+        self.next_check = time.time() + interval
+
+    def get_mtime(self):
+        try:
+            return path.getmtime(self.fpath)
+        except OSError:
+            return None
+
+    def check(self):
+        now = time.time()
+        if now < self.next_check:
+            return False
+        self.next_check = now + self.interval
+        mtime = self.get_mtime()
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        self.callback()
+        return True
+
+
+class RenderProfiler(object):
+    """
+        Timers for rendering templates.  When settings.templating.profiler.enabled
+        is set, the application keeps one of these in ag.template_profiler.
+
+        Times are kept for each page, i.e. the endpoint of the view that
+        handled the request, under keys like:
+
+            template:<name>: rendering a template, including {% include %}
+            block:<name>:<block>: rendering a block of a template
+            content:<endpoint>: include_content()/include_html() sub-renders
+            placeholders:<name>: filling in a page's CSS/JS placeholders
+
+        A time includes the time of what was rendered within it, e.g. the
+        time of a template includes the time of its blocks.
+    """
+    fields = ('calls', 'seconds', 'max_seconds')
+
+    def __init__(self):
+        self.pages = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self, page):
+        """ called when a request starts being handled by the view for `page` """
+        # not reset at the end of the request, so that the rendering of a
+        # streamed response, which happens later, still goes to the page
+        self._local.page = page
+        self._local.times = {}
+
+    def request_times(self):
+        """ {key: seconds} for what has been rendered in the current request """
+        return getattr(self._local, 'times', {})
+
+    def record(self, key, seconds):
+        page = getattr(self._local, 'page', None)
+        times = self.request_times()
+        times[key] = times.get(key, 0) + seconds
+        with self._lock:
+            entries = self.pages.setdefault(page, {})
+            if key not in entries:
+                entries[key] = dict.fromkeys(self.fields, 0)
+            entry = entries[key]
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+    @contextmanager
+    def measure(self, key):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record(key, time.time() - started)
+
+    def measure_iter(self, key, iterable):
+        """
+            iterates `iterable`, timing only the time spent producing its
+            items, for render functions that are generators
+        """
+        seconds = 0
+        iterator = iter(iterable)
+        while True:
+            started = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.time() - started
+            yield item
+        self.record(key, seconds)
+
+    def header(self, limit=10):
+        """ the times of the current request, slowest first, for a response header """
+        times = sorted(six.iteritems(self.request_times()), key=lambda kv: kv[1], reverse=True)
+        return ', '.join('%s=%.2fms' % (key, seconds * 1000) for key, seconds in times[:limit])
+
+    def clear(self):
+        with self._lock:
+            self.pages.clear()
+
+    def costs(self, page):
+        """
+            [(key, calls, total milliseconds, max milliseconds), ...] for
+            `page`, most expensive first
+        """
+        rows = [
+            (key, v['calls'], round(v['seconds'] * 1000, 3), round(v['max_seconds'] * 1000, 3))
+            for key, v in six.iteritems(self.pages.get(page, {}))
+        ]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def todict(self):
+        with self._lock:
+            return dict(
+                (page, dict((key, dict(v)) for key, v in six.iteritems(entries)))
+                for page, entries in six.iteritems(self.pages)
+            )
+
+
 def default_engine():
     tmod = __import__('blazeweb.templating.%s' % settings.templating.default_engine, fromlist=[''])
     tobj = getattr(tmod, 'Translator')
@@ -1,14 +1,24 @@
 from __future__ import with_statement
 from __future__ import absolute_import
+import glob
+import hashlib
 import logging
+import os
 from os import path
 
-from jinja2 import Environment, TemplateNotFound, BaseLoader, \
-    Template as j2Template, contextfilter
+import jinja2
+from jinja2 import Environment, TemplateNotFound, BaseLoader, ModuleLoader, \
+    Template as j2Template, contextfilter, nodes
+from jinja2.bccache import FileSystemBytecodeCache
+from jinja2.ext import Extension
 from jinja2.utils import Markup
 
-from blazeweb.globals import settings
-from blazeweb.hierarchy import FileNotFound, findfile, split_endpoint
+from blazeweb.fragments import cached_fragment, CachedFragment
+from blazeweb.globals import ag, settings
+from blazeweb.hierarchy import clear_caches, FileNotFound, findfile, hierarchy_file_map, \
+    split_endpoint
+from blazeweb.utils.datastructures import LRUCache
+from blazeweb.utils.filesystem import mkdirs
 import blazeweb.templating as templating
 import six
 
@@ -17,14 +27,22 @@ log = logging.getLogger(__name__)
 
 class _RootRenderWrapper(object):
 
-    def __init__(self, tpl_name, root_render_func):
+    def __init__(self, tpl_name, root_render_func, block_name=None):
         self.tpl_name = tpl_name
         self.root_render_func = root_render_func
+        if block_name is None:
+            self.profile_key = 'template:%s' % tpl_name
+        else:
+            self.profile_key = 'block:%s:%s' % (tpl_name, block_name)
 
     def __call__(self, context):
         endpoint_stack = context.get('__TemplateContent.endpoint_stack', [])
         endpoint_stack.append(self.tpl_name)
-        for event in self.root_render_func(context):
+        events = self.root_render_func(context)
+        profiler = ag.template_profiler
+        if profiler is not None:
+            events = profiler.measure_iter(self.profile_key, events)
+        for event in events:
             yield event
         endpoint_stack.pop()
 
@@ -52,7 +70,7 @@ class Template(j2Template):
         # the block of a parent template
         for block_name, block_root_render_func in six.iteritems(namespace['blocks']):
             namespace['blocks'][block_name] = _RootRenderWrapper(
-                namespace['name'], block_root_render_func
+                namespace['name'], block_root_render_func, block_name
             )
 
         return j2Template._from_namespace(environment, namespace, globals)
@@ -70,7 +88,18 @@ class Translator(templating.EngineBase):
         self.init_filters()
 
     def create_loader(self):
-        return HierarchyLoader()
+        shared_code = None
+        if settings.templating.shared_code.enabled:
+            shared_code = shared_code_store(settings.templating.shared_code.max_entries)
+        loader = HierarchyLoader(frozen=settings.templating.frozen, shared_code=shared_code)
+        compiled = settings.templating.compiled
+        if not compiled.enabled:
+            return loader
+        if read_compiled_fingerprint(compiled.dir) != compiled_fingerprint():
+            log.warning('compiled templates in %s are missing or out of date and will not be'
+                        ' used', compiled.dir)
+            return loader
+        return CompiledHierarchyLoader(compiled.dir, loader)
 
     def get_settings(self):
         def guess_autoescape(template_name):
@@ -81,7 +110,14 @@ class Translator(templating.EngineBase):
         jsettings = settings.jinja
         if isinstance(jsettings.autoescape, (list, tuple)):
             jsettings.autoescape = guess_autoescape
-        return jsettings.todict()
+        env_settings = dict(jsettings.todict())
+        bcc = env_settings.pop('bytecode_cache')
+        if bcc.enabled:
+            env_settings['bytecode_cache'] = HierarchyBytecodeCache(bcc.dir)
+        if settings.templating.frozen:
+            env_settings['auto_reload'] = False
+            env_settings['cache_size'] = settings.templating.frozen_cache_size
+        return env_settings
 
     def init_globals(self):
         self.env.globals.update(self.get_globals())
@@ -95,6 +131,13 @@ class Translator(templating.EngineBase):
         self.update_context(context)
         return self.env.get_template(endpoint).render(context)
 
+    def stream_template(self, endpoint, context, buffer_size=None):
+        self.update_context(context)
+        stream = self.env.get_template(endpoint).stream(context)
+        if buffer_size:
+            stream.enable_buffering(buffer_size)
+        return stream
+
     def render_string(self, string, context):
         return self.env.from_string(string).render(context)
 
@@ -102,15 +145,105 @@ class Translator(templating.EngineBase):
         """ when a template has auto-escaping enabled, mark a value as safe """
         return Markup(value)
 
+    def reload(self):
+        log.info('reloading templates')
+        # templates may have been added or moved in the hierarchy too
+        clear_caches()
+        if self.env.cache is not None:
+            self.env.cache.clear()
+
+
+class HierarchyBytecodeCache(FileSystemBytecodeCache):
+    """
+        Stores compiled templates on disk, keyed on the path and mtime of the
+        template file the hierarchy resolved the template's endpoint to.
+        Worker processes can share the directory: the files are written to a
+        temporary file and renamed so a partially written file is never read.
+    """
+
+    def __init__(self, directory):
+        mkdirs(directory)
+        FileSystemBytecodeCache.__init__(self, directory, 'blazeweb_%s.cache')
+
+    def get_cache_key(self, name, filename=None):
+        if filename is not None:
+            try:
+                filename = '%s|%r' % (filename, os.stat(filename).st_mtime)
+            except OSError:
+                pass
+        return FileSystemBytecodeCache.get_cache_key(self, name, filename)
+
+    def dump_bytecode(self, bucket):
+        fpath = self._get_cache_filename(bucket)
+        tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+        with open(tmppath, 'wb') as fh:
+            bucket.write_bytecode(fh)
+        os.rename(tmppath, fpath)
+
+
+_shared_code = None
+
+
+def shared_code_store(maxsize):
+    """
+        The process-wide store of compiled template code, shared by the
+        Environments of all the applications in the process.  It is created
+        with `maxsize` entries by the first application that uses it.
+    """
+    global _shared_code
+    if _shared_code is None:
+        _shared_code = LRUCache(maxsize)
+    return _shared_code
+
+
+def environment_fingerprint(environment):
+    """
+        A hash of the parts of an Environment's configuration that affect the
+        code templates are compiled to.  Environments only share compiled
+        code when it would compile the same for them.
+    """
+    env = environment
+    filters = sorted(
+        (name, getattr(func, 'contextfilter', False), getattr(func, 'evalcontextfilter', False),
+         getattr(func, 'environmentfilter', False))
+        for name, func in six.iteritems(env.filters)
+    )
+    parts = [
+        env.block_start_string, env.block_end_string,
+        env.variable_start_string, env.variable_end_string,
+        env.comment_start_string, env.comment_end_string,
+        env.line_statement_prefix, env.line_comment_prefix,
+        env.trim_blocks, env.lstrip_blocks, env.newline_sequence, env.keep_trailing_newline,
+        env.optimized, env.finalize is not None, getattr(env, 'is_async', False),
+        env.code_generator_class.__name__, sorted(env.extensions), filters, sorted(env.tests),
+    ]
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def shared_code_key(environment, name, fpath, mtime):
+    autoescape = environment.autoescape
+    if callable(autoescape):
+        autoescape = autoescape(name)
+    return (name, fpath, mtime, bool(autoescape), environment_fingerprint(environment))
+
 
 class HierarchyLoader(BaseLoader):
     """
         A modification of Jinja's FileSystemLoader to take into account
         the hierarchy.
+
+        With `shared_code` (see shared_code_store()), compiled templates are
+        shared with the other applications in the process, keyed on the file
+        the endpoint resolves to, its mtime and the Environment's
+        configuration.  A template another application compiled is not read
+        from disk again.
     """
 
-    def __init__(self, encoding=settings.default.charset):
-        self.encoding = encoding
+    def __init__(self, encoding=None, frozen=False, shared_code=None):
+        self.encoding = encoding or settings.default.charset
+        # frozen templates are never checked for changes, see Translator.reload()
+        self.frozen = frozen
+        self.shared_code = shared_code
 
     def find_template_path(self, endpoint):
         # try module level first
@@ -130,15 +263,181 @@ class HierarchyLoader(BaseLoader):
         # except FileNotFound:
         #    pass
 
+    def list_templates(self):
+        """ the endpoints of every template in the hierarchy """
+        endpoints = []
+        for key, fpath in six.iteritems(hierarchy_file_map(subdirs=('templates', ))):
+            if not path.isfile(fpath):
+                continue
+            component, pathpart = split_endpoint(key)
+            # strip the "templates/" directory
+            template = pathpart.split(os.sep, 1)[1].replace(os.sep, '/')
+            endpoints.append('%s:%s' % (component, template) if component else template)
+        return sorted(endpoints)
+
     def get_source(self, environment, endpoint):
         log.debug('get_source() processing: %s' % endpoint)
         fpath = self.find_template_path(endpoint)
         if not fpath:
             raise TemplateNotFound(endpoint)
+        contents = self.read_source(fpath)
+        return contents, fpath, self.uptodate(fpath, path.getmtime(fpath))
+
+    def read_source(self, fpath):
         with open(fpath, 'rb') as f:
-            contents = f.read().decode(self.encoding)
-        old = path.getmtime(fpath)
-        return contents, fpath, lambda: path.getmtime(fpath) == old
+            return f.read().decode(self.encoding)
+
+    def uptodate(self, fpath, mtime):
+        if self.frozen:
+            return None
+        return lambda: path.getmtime(fpath) == mtime
+
+    def load(self, environment, name, globals=None):
+        if self.shared_code is None:
+            return BaseLoader.load(self, environment, name, globals)
+        fpath = self.find_template_path(name)
+        if not fpath:
+            raise TemplateNotFound(name)
+        mtime = path.getmtime(fpath)
+        key = shared_code_key(environment, name, fpath, mtime)
+        code = self.shared_code.get(key)
+        if code is None:
+            code = self.compile(environment, name, fpath, self.read_source(fpath))
+            self.shared_code.set(key, code)
+        return environment.template_class.from_code(
+            environment, code, globals or {}, self.uptodate(fpath, mtime)
+        )
+
+    def compile(self, environment, name, fpath, source):
+        """ like BaseLoader.load(), goes through the bytecode cache if there is one """
+        bcc = environment.bytecode_cache
+        if bcc is None:
+            return environment.compile(source, name, fpath)
+        bucket = bcc.get_bucket(environment, name, fpath, source)
+        if bucket.code is None:
+            bucket.code = environment.compile(source, name, fpath)
+            bcc.set_bucket(bucket)
+        return bucket.code
+
+
+class CompiledHierarchyLoader(BaseLoader):
+    """
+        Loads the templates compiled by compile_templates() and uses
+        `fallback` (a HierarchyLoader) for templates that weren't compiled.
+
+        The templates were compiled by endpoint, with the hierarchy resolving
+        each endpoint to its file, so the same overrides apply as with the
+        HierarchyLoader.  Compiled templates are never reloaded.
+    """
+
+    def __init__(self, directory, fallback):
+        self.modules = ModuleLoader(directory)
+        self.fallback = fallback
+
+    def get_source(self, environment, endpoint):
+        return self.fallback.get_source(environment, endpoint)
+
+    def list_templates(self):
+        return self.fallback.list_templates()
+
+    def load(self, environment, name, globals=None):
+        try:
+            return self.modules.load(environment, name, globals)
+        except TemplateNotFound:
+            log.debug('template %s is not compiled', name)
+            return self.fallback.load(environment, name, globals)
+
+
+COMPILED_FINGERPRINT_FNAME = 'fingerprint.txt'
+
+
+def compiled_fingerprint():
+    """
+        Compiled templates depend on the version of Jinja that compiled them,
+        the settings profile and the template files of the hierarchy: which
+        file each endpoint resolves to and its mtime.  Only the templates
+        directories are looked in.
+    """
+    sha = hashlib.sha1()
+    settings_class = settings._current_obj().__class__
+    sha.update(('%s.%s' % (settings_class.__module__, settings_class.__name__)).encode('utf-8'))
+    for endpoint, fpath in sorted(six.iteritems(hierarchy_file_map(subdirs=('templates', )))):
+        if not path.isfile(fpath):
+            continue
+        sha.update(('%s\0%s\0%r\0' % (endpoint, fpath, path.getmtime(fpath))).encode('utf-8'))
+    return '%s-%s' % (jinja2.__version__, sha.hexdigest())
+
+
+def read_compiled_fingerprint(directory):
+    try:
+        with open(path.join(directory, COMPILED_FINGERPRINT_FNAME)) as fh:
+            return fh.read().strip()
+    except IOError:
+        return None
+
+
+def compile_templates(target, log_function=None):
+    """
+        Compiles every template in the current application's hierarchy to a
+        Python module in `target` for CompiledHierarchyLoader.  Templates
+        that can't be compiled are skipped (they are loaded from source).
+        Returns the number of templates compiled.
+    """
+    env = ag.tplengine.env
+    mkdirs(target)
+    # modules of templates that don't exist anymore
+    for fpath in glob.glob(path.join(target, 'tmpl_*.py')):
+        os.remove(fpath)
+    env.compile_templates(target, zip=None, log_function=log_function, ignore_errors=True)
+    with open(path.join(target, COMPILED_FINGERPRINT_FNAME), 'w') as fh:
+        fh.write(compiled_fingerprint())
+    return len(glob.glob(path.join(target, 'tmpl_*.py')))
+
+
+class FragmentCacheExtension(Extension):
+    """
+        The "cache" tag caches the output of its body, see blazeweb.fragments:
+
+            {% cache 'sidebar' %}...{% endcache %}
+            {% cache 'nav-' ~ user.id, 600 %}...{% endcache %}
+
+        The CSS/JS the body added to the page is cached with it.
+    """
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        args.append(nodes.ContextReference())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', args), [], [], body) \
+            .set_lineno(lineno)
+
+    def _cache(self, key, ttl, context, caller):
+        cobj = context.get('__TemplateContent.obj')
+        rendered = []
+
+        def render():
+            rendered.append(True)
+            before = {}
+            if cobj is not None:
+                before = dict((type, len(clist)) for type, clist in six.iteritems(cobj.data))
+            body = six.text_type(caller())
+            added = {}
+            if cobj is not None:
+                for type, clist in six.iteritems(cobj.data):
+                    if len(clist) > before.get(type, 0):
+                        added[type] = clist[before.get(type, 0):]
+            return CachedFragment(body, added)
+        fragment = cached_fragment(key, ttl, render)
+        if not rendered and cobj is not None:
+            for type, clist in six.iteritems(fragment.data_copy()):
+                cobj.extend_content(type, clist)
+        return Markup(fragment.primary)
 
 
 @contextfilter
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+import threading
+
+__all__ = [
+    'ContentBuffer',
+    'LRUCache',
+]
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+        A dict-like cache that holds at most `maxsize` items.  When the cache
+        is full, the least recently used item is discarded to make room for
+        the new one.
+
+        Hits and misses from get() are counted so that the effectiveness of
+        the cache can be reported on.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            # re-insert so the item becomes the most recently used
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __repr__(self):
+        return '<LRUCache %s/%s>' % (len(self._data), self.maxsize)
+
+
+class ContentBuffer(object):
+    """
+        The text collected for one type of content, e.g. the CSS of a page.
+
+        A buffer added with extend(), e.g. the CSS of a nested include, is
+        kept by reference instead of being copied in, and the text is only
+        flattened and joined when it's needed.  The joined text is remembered
+        until this buffer, or one it refers to, changes.
+
+        It can be used like a list of text: indexing, slicing, len() and
+        iteration see the flattened items.  Changing the items other than by
+        adding to the end copies the referenced buffers' items in first.
+    """
+
+    def __init__(self, items=()):
+        self._parts = list(items)
+        # the buffers in _parts
+        self._buffers = []
+        self._version = 0
+        self._flat = None
+        self._joined = None
+
+    def _stamp(self):
+        # the versions only go up, so this changes whenever any buffer does
+        return self._version + sum(buffer._stamp() for buffer in self._buffers)
+
+    def _changed(self):
+        self._version = self._stamp() + 1
+
+    def _refers_to(self, other):
+        return any(buffer is other or buffer._refers_to(other) for buffer in self._buffers)
+
+    def _mutable_parts(self):
+        if self._buffers:
+            # stays above every stamp this buffer had with the references
+            version = self._stamp()
+            self._parts = list(self.flattened())
+            self._buffers = []
+            self._version = version
+        return self._parts
+
+    def flattened(self):
+        """ the list of text, which is cached and mustn't be changed """
+        stamp = self._stamp()
+        flat = self._flat
+        if flat is None or flat[0] != stamp:
+            items = []
+            for part in self._parts:
+                if isinstance(part, ContentBuffer):
+                    items.extend(part.flattened())
+                else:
+                    items.append(part)
+            flat = self._flat = (stamp, items)
+        return flat[1]
+
+    def join(self, join_with=u''):
+        stamp = self._stamp()
+        joined = self._joined
+        if joined is None or joined[0] != join_with or joined[1] != stamp:
+            pieces = []
+            for part in self._parts:
+                if not isinstance(part, ContentBuffer):
+                    pieces.append(part)
+                elif len(part):
+                    pieces.append(part.join(join_with))
+            joined = self._joined = (join_with, stamp, join_with.join(pieces))
+        return joined[2]
+
+    def append(self, item):
+        self._parts.append(item)
+        self._changed()
+
+    def extend(self, items):
+        if isinstance(items, ContentBuffer) and items is not self \
+                and not items._refers_to(self):
+            self._parts.append(items)
+            self._buffers.append(items)
+        else:
+            self._parts.extend(list(items))
+        self._changed()
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        self._mutable_parts().insert(index, item)
+        self._changed()
+
+    def pop(self, *args):
+        item = self._mutable_parts().pop(*args)
+        self._changed()
+        return item
+
+    def remove(self, item):
+        self._mutable_parts().remove(item)
+        self._changed()
+
+    def clear(self):
+        del self[:]
+
+    def sort(self, *args, **kwargs):
+        self._mutable_parts().sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        self._mutable_parts().reverse()
+        self._changed()
+
+    def __imul__(self, count):
+        parts = self._mutable_parts()
+        parts *= count
+        self._changed()
+        return self
+
+    def __setitem__(self, index, value):
+        self._mutable_parts()[index] = value
+        self._changed()
+
+    def __delitem__(self, index):
+        del self._mutable_parts()[index]
+        self._changed()
+
+    def __getitem__(self, index):
+        return self.flattened()[index]
+
+    def __len__(self):
+        return sum(len(part) if isinstance(part, ContentBuffer) else 1 for part in self._parts)
+
+    def __iter__(self):
+        return iter(self.flattened())
+
+    def __eq__(self, other):
+        if isinstance(other, (ContentBuffer, list)):
+            return self.flattened() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        # the caches aren't pickled
+        return {'_parts': self._parts, '_buffers': self._buffers, '_version': self._version}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._flat = None
+        self._joined = None
+
+    def __repr__(self):
+        return 'ContentBuffer(%r)' % self.flattened()
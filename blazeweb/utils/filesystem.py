@@ -6,18 +6,24 @@ library.
 
 """
 
+import gzip
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
 import os
 from os import path
-from shutil import copy2, copystat, rmtree
+from shutil import copy2, copystat
 
 from blazeutils import NotGiven
 
 from blazeweb.globals import settings
-from blazeweb.hierarchy import list_component_mappings, hm
+from blazeweb.hierarchy import hierarchy_file_map
 
 __all__ = [
     'mkdirs',
     'copy_static_files',
+    'static_sources',
+    'gzip_sidecar',
 ]
 
 
@@ -50,40 +56,192 @@ def mkdirs(newdir, mode=NotGiven):
         os.makedirs(newdir, mode)
 
 
-def copy_static_files(delete_existing=False):
+def static_sources():
+    """
+        {relative path: source file path} for every static file in the
+        hierarchy, where the relative path is where the file belongs in the
+        static directory (e.g. "app/css/site.css" or
+        "component/news/css/news.css").  Apps and components higher in
+        priority win over those lower in priority.
+    """
+    sources = {}
+    for endpoint, fpath in hierarchy_file_map(subdirs=('static', )).items():
+        if not path.isfile(fpath):
+            continue
+        if ':' in endpoint:
+            component, pathpart = endpoint.split(':', 1)
+            prefix = 'component/%s/' % component
+        else:
+            pathpart = endpoint
+            prefix = 'app/'
+        # strip the "static/" directory
+        pathpart = pathpart.split(os.sep, 1)[1].replace(os.sep, '/')
+        sources[prefix + pathpart] = fpath
+    return sources
+
+
+def file_hash(fpath):
+    sha = hashlib.sha1()
+    with open(fpath, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _load_json(fpath):
+    if not path.exists(fpath):
+        return {}
+    try:
+        with open(fpath) as fh:
+            return json.load(fh)
+    except ValueError:
+        return {}
+
+
+def _save_json(data, fpath):
+    mkdirs(path.dirname(fpath))
+    tmppath = '%s.%s.tmp' % (fpath, os.getpid())
+    with open(tmppath, 'w') as fh:
+        json.dump(data, fh, indent=1, sort_keys=True)
+    os.rename(tmppath, fpath)
+
+
+def gzip_sidecar(fpath):
+    """
+        Writes a gzip compressed copy of `fpath` to `fpath` + ".gz" for
+        servers that send precompressed files.  The compressed file gets the
+        mtime of the original in its header so that the output is the same
+        every time the same file is compressed.
+    """
+    gzpath = fpath + '.gz'
+    tmppath = '%s.%s.tmp' % (gzpath, os.getpid())
+    with open(fpath, 'rb') as src, open(tmppath, 'wb') as fh:
+        gzfh = gzip.GzipFile(path.basename(fpath), 'wb', 9, fh, os.stat(fpath).st_mtime)
+        try:
+            for chunk in iter(lambda: src.read(64 * 1024), b''):
+                gzfh.write(chunk)
+        finally:
+            gzfh.close()
+    os.rename(tmppath, gzpath)
+    return gzpath
+
+
+def _remove(fpath):
+    if path.exists(fpath):
+        os.remove(fpath)
+
+
+def _prune_empty_dirs(dirpath, statroot):
+    while dirpath != statroot and dirpath.startswith(statroot):
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            # not empty
+            return
+        dirpath = path.dirname(dirpath)
+
+
+def copy_static_files(delete_existing=False, workers=4):
     """
         copy's files from the apps and components to the static directory
         defined in the settings.  Files are copied in a hierarchical way
         such that apps and components lower in priority have their files
         overwritten by apps/components with higher priority.
+
+        The copy is incremental: a manifest of what was copied (source path,
+        size, mtime and hash) is kept in the data directory and only files that
+        changed are copied, on `workers` threads.  Files that were copied
+        before but are no longer in the hierarchy are deleted.  If
+        `delete_existing` is True, any other files in the "app" and
+        "component" directories are deleted too.
+
+        When settings.static_files.gzip.enabled is True, a ".gz" sidecar is
+        written next to each copied file that is compressible (see
+        gzip_sidecar()) for the production static file server.
+
+        Returns a dict with the lists of files (relative to the static
+        directory) that were "copied", "unchanged" and "deleted".
     """
     statroot = settings.dirs.static
+    gzsettings = settings.static_files.gzip
+    gzip_exts = tuple(gzsettings.extensions) if gzsettings.enabled else ()
+    manifest_fpath = path.join(settings.dirs.data, 'static_copy_manifest.json')
+    previous = _load_json(manifest_fpath)
+    sources = static_sources()
 
-    if delete_existing:
-        app_stat_path = path.join(statroot, 'app')
-        if path.exists(app_stat_path):
-            rmtree(app_stat_path)
-        component_stat_path = path.join(statroot, 'component')
-        if path.exists(component_stat_path):
-            rmtree(component_stat_path)
-
-    for app, pname, package in list_component_mappings(reverse=True, inc_apps=True):
-
-        package_mod = hm.builtin_import(package or app, fromlist=[''])
-        pkgdir = path.dirname(package_mod.__file__)
-        if package or not pname:
-            srcpath = pkgdir
-        else:
-            srcpath = path.join(pkgdir, 'components', pname)
-        srcpath = path.join(srcpath, 'static')
-        if path.isdir(srcpath):
-            if not pname:
-                targetpath = 'app'
+    manifest = {}
+    to_copy = []
+    unchanged = []
+    for relpath, srcpath in sorted(sources.items()):
+        stat = os.stat(srcpath)
+        entry = {'src': srcpath, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        dstpath = path.join(statroot, *relpath.split('/'))
+        compress = relpath.endswith(gzip_exts) and stat.st_size >= gzsettings.min_size
+        prev = previous.get(relpath)
+        if prev is not None and prev['src'] == srcpath and path.exists(dstpath) \
+                and os.stat(dstpath).st_size == stat.st_size \
+                and compress == path.exists(dstpath + '.gz'):
+            if prev['size'] == stat.st_size and prev['mtime'] == stat.st_mtime:
+                entry['hash'] = prev['hash']
             else:
-                targetpath = path.join('component', pname)
-            targetpath = path.join(statroot, targetpath)
+                # the file was touched, but might not have changed
+                entry['hash'] = file_hash(srcpath)
+            if entry['hash'] == prev['hash']:
+                manifest[relpath] = entry
+                unchanged.append(relpath)
+                continue
+        to_copy.append((relpath, srcpath, dstpath, entry, compress))
+
+    def copy(item):
+        relpath, srcpath, dstpath, entry, compress = item
+        if 'hash' not in entry:
+            entry['hash'] = file_hash(srcpath)
+        copy2(srcpath, dstpath)
+        if compress:
+            gzip_sidecar(dstpath)
+        else:
+            # a sidecar from an earlier copy would be out of date
+            _remove(dstpath + '.gz')
+        return relpath, entry
+
+    if to_copy:
+        # the directories are made here because the settings object isn't
+        # available on the worker threads
+        for dirpath in sorted(set(path.dirname(item[2]) for item in to_copy)):
+            mkdirs(dirpath)
+        pool = ThreadPool(max(1, min(workers, len(to_copy))))
+        try:
+            for relpath, entry in pool.imap_unordered(copy, to_copy):
+                manifest[relpath] = entry
+        finally:
+            pool.close()
+            pool.join()
+
+    # delete what was copied before but isn't in the hierarchy anymore
+    to_delete = set(previous) - set(sources)
+    if delete_existing:
+        for typedir in ('app', 'component'):
+            for dirpath, _, filenames in os.walk(path.join(statroot, typedir)):
+                for fname in filenames:
+                    relpath = path.relpath(path.join(dirpath, fname), statroot)
+                    relpath = relpath.replace(os.sep, '/')
+                    if relpath.endswith('.gz') and relpath[:-3] in sources:
+                        continue
+                    if relpath not in sources:
+                        to_delete.add(relpath)
+    for relpath in to_delete:
+        dstpath = path.join(statroot, *relpath.split('/'))
+        _remove(dstpath + '.gz')
+        if path.exists(dstpath):
+            os.remove(dstpath)
+            _prune_empty_dirs(path.dirname(dstpath), statroot)
 
-            copytree(srcpath, targetpath)
+    _save_json(manifest, manifest_fpath)
+    return {
+        'copied': sorted(item[0] for item in to_copy),
+        'unchanged': unchanged,
+        'deleted': sorted(to_delete),
+    }
 
 
 def copytree(src, dst, symlinks=False, ignore=None):
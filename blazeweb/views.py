@@ -2,6 +2,7 @@ import logging
 
 from decorator import decorator
 import formencode
+from blazeutils.datastructures import OrderedDict
 from blazeutils.sentinels import NotGiven
 from blazeutils.helpers import tolist
 from blazeutils.strings import case_cw2us
@@ -13,9 +14,9 @@ from werkzeug.utils import ArgumentValidationError, validate_arguments
 
 from blazeweb.globals import ag, rg, user, settings
 from blazeutils.jsonh import jsonmod, assert_have_json
-from blazeweb.content import getcontent, Content
+from blazeweb.content import getcontent, getcontent_streamed, Content
 from blazeweb.hierarchy import listapps, split_endpoint
-from blazeweb.utils import werkzeug_multi_dict_conv
+from blazeweb.utils import registry_has_object, werkzeug_multi_dict_conv
 from blazeweb.wrappers import Response
 
 log = logging.getLogger(__name__)
@@ -457,6 +458,8 @@ class View(object):
         # is the return value a Content instance?
         if isinstance(self.retval, Content):
             c = self.retval
+            if c.stream is not None:
+                return self.create_response(c.stream, mimetype=c.primary_type)
             return self.create_response(c.primary, mimetype=c.primary_type)
         # if the retval is a string, add it as the response data
         if isinstance(self.retval, six.string_types):
@@ -468,7 +471,8 @@ class View(object):
         # convert it to a string and send as the response
         return self.create_response(str(self.retval))
 
-    def render_template(self, filename=None, default_ext='html', send_response=True):
+    def render_template(self, filename=None, default_ext='html', send_response=True,
+                        stream=None):
         """
             Render a template:
 
@@ -491,6 +495,10 @@ class View(object):
             (default), then the response will be sent immediately.  If False,
             render_template() will return the Content object.  In either case,
             self.retval will be set to the Content object.
+
+            If stream is True (default settings.templating.streaming.enabled),
+            the template is rendered as the response is sent, see
+            TemplateContent.process_streamed().
         """
         if not filename:
             # the filename must have an extension, that is how
@@ -500,9 +508,9 @@ class View(object):
         endpoint = filename
         if self._component_name:
             endpoint = '%s:%s' % (self._component_name, endpoint)
-        return self.render_endpoint(endpoint, send_response)
+        return self.render_endpoint(endpoint, send_response, stream)
 
-    def render_endpoint(self, endpoint, send_response=True):
+    def render_endpoint(self, endpoint, send_response=True, stream=None):
         """
             Render a template or Content object by endpoint:
 
@@ -517,7 +525,13 @@ class View(object):
             # a Content object can also be rendered by omitting an extension:
             self.render_endpoint('mycomponent:SomeContent')
         """
-        c = getcontent(endpoint, **self.template_vars)
+        if stream is None:
+            stream = settings.templating.streaming.enabled
+        # only templates can be streamed, not Content classes
+        if stream and '.' in endpoint:
+            c = getcontent_streamed(endpoint, **self.template_vars)
+        else:
+            c = getcontent(endpoint, **self.template_vars)
         self.retval = c
         if send_response:
             self.send_response()
@@ -661,6 +675,29 @@ class SecureView(View):
 # recreating the class definition each time
 CLASS_CACHE = {}
 
+# the routes declared with @asview, by module name and function name.  When
+# views modules are shared among applications (settings.hierarchy.shared_modules)
+# they are imported once and each application adds the routes from here.
+ASVIEW_ROUTES = {}
+
+
+def _declares_routes():
+    # when views modules are shared or components are loaded lazily, the
+    # application adds the routes @asview records, see add_asview_routes()
+    return registry_has_object(settings) and (
+        settings.hierarchy.shared_modules or settings.hierarchy.lazy_components
+    )
+
+
+def add_asview_routes(module, **kwargs):
+    """
+        Adds the routes declared with @asview in `module` to the current
+        application.  Usable as the call_with_mod argument of visitmods().
+    """
+    for lrule, endpoint, options in ASVIEW_ROUTES.get(module.__name__, {}).values():
+        log.debug('adding @asview route "%s" to endpoint "%s"', lrule, endpoint)
+        ag.route_map.add(Rule(lrule, endpoint=endpoint), **options)
+
 
 def asview(rule=None, **options):
     """
@@ -680,8 +717,11 @@ def asview(rule=None, **options):
         # setup the routing
         if lrule is None:
             lrule = '/%s' % fname
-        log.debug('@asview adding route "%s" to endpoint "%s"', lrule, endpoint)
-        ag.route_map.add(Rule(lrule, endpoint=endpoint), **options)
+        ASVIEW_ROUTES.setdefault(f.__module__, OrderedDict())[fname] = \
+            (lrule, endpoint, options)
+        if not _declares_routes():
+            log.debug('@asview adding route "%s" to endpoint "%s"', lrule, endpoint)
+            ag.route_map.add(Rule(lrule, endpoint=endpoint), **options)
 
         # cache key for this object
         cachekey = '%s:%s' % (f.__module__, fname)
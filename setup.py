@@ -83,7 +83,12 @@ setup(
     shell = blazeweb.commands:ShellCommand
     routes = blazeweb.commands:RoutesCommand
     static-copy = blazeweb.commands:StaticCopyCommand
+    static-fingerprint = blazeweb.commands:StaticFingerprintCommand
     component-map = blazeweb.commands:ComponentMapCommand
+    hierarchy-manifest = blazeweb.commands:HierarchyManifestCommand
+    hierarchy-stats = blazeweb.commands:HierarchyStatsCommand
+    templates-compile = blazeweb.commands:TemplatesCompileCommand
+    templates-profile = blazeweb.commands:TemplatesProfileCommand
 
 
     [blazeweb.blazeweb_project_template]
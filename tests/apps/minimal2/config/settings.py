@@ -88,3 +88,17 @@ class NoAutoImportView(Default):
 
         # we just want to make sure turning the setting off works too
         self.auto_load_views = False
+
+
+class SharedModules(Default):
+    def init(self):
+        Default.init(self)
+        self.hierarchy.shared_modules = True
+
+
+class LazyComponents(Dispatching):
+    def init(self):
+        Dispatching.init(self)
+        self.hierarchy.lazy_components = True
+        self.hierarchy.manifest.enabled = True
+        self.hierarchy.manifest.fpath = path.join(self.dirs.data, 'lazy_manifest.json')
@@ -70,3 +70,84 @@ class AttributeErrorInSettings(Default):
     def init(self):
         Default.init(self)
         print(path.notthere)
+
+
+class WithManifest(Default):
+    def init(self):
+        Default.init(self)
+        self.hierarchy.manifest.enabled = True
+
+
+class WithHierarchyStats(Default):
+    def init(self):
+        Default.init(self)
+        self.hierarchy.stats.enabled = True
+
+
+class WithFileIndex(Default):
+    def init(self):
+        Default.init(self)
+        self.hierarchy.file_index.enabled = True
+
+
+class WithBytecodeCache(Default):
+    def init(self):
+        Default.init(self)
+        self.jinja.bytecode_cache.enabled = True
+
+
+class WithSharedCode(Default):
+    def init(self):
+        Default.init(self)
+        self.templating.shared_code.enabled = True
+
+
+class FingerprintedStatic(ForStaticFileTesting):
+    def init(self):
+        ForStaticFileTesting.init(self)
+        self.static_files.fingerprint.enabled = True
+
+
+class ProductionStatic(Default):
+    def init(self):
+        Default.init(self)
+        self.auto_copy_static.enabled = True
+        self.static_files.gzip.enabled = True
+        self.static_files.gzip.min_size = 0
+        self.static_files.production.enabled = True
+        # app/statictest.txt is kept in memory, the component files are sent
+        # with wsgi.file_wrapper
+        self.static_files.production.memory_max_size = 10
+
+
+class WithBundles(ForStaticFileTesting):
+    def init(self):
+        ForStaticFileTesting.init(self)
+        self.templating.bundles.enabled = True
+
+
+class FrozenTemplates(Default):
+    def init(self):
+        Default.init(self)
+        self.templating.frozen = True
+        self.templating.reload_file = path.join(self.dirs.tmp, 'reload-templates')
+
+
+class CompiledTemplates(Default):
+    def init(self):
+        Default.init(self)
+        self.templating.compiled.enabled = True
+
+
+class Streaming(Default):
+    def init(self):
+        Default.init(self)
+        self.templating.streaming.enabled = True
+        self.templating.streaming.buffer_size = 2
+
+
+class TemplateProfiler(Default):
+    def init(self):
+        Default.init(self)
+        self.templating.profiler.enabled = True
+        self.templating.profiler.header = True
@@ -0,0 +1,74 @@
+"""
+    Benchmarks the placeholder substitution of TemplateContent.create() on
+    large pages: one str.replace() per placeholder (how it used to be done)
+    against content.substitute_placeholders().
+
+    Run with: python tests/bench_placeholders.py
+"""
+from __future__ import print_function
+import timeit
+
+from blazeweb.content import _PlaceHolder, substitute_placeholders
+
+
+class FakeContent(object):
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, type, join_with=u''):
+        return join_with.join(self.data.get(type, []))
+
+
+def make_page(body_kb, supporting_files):
+    data = {
+        'text/css': [u'/* file %d */\n.rule-%d { color: red; }\n' % (i, i) * 20
+                     for i in range(supporting_files)],
+        'text/javascript': [u'// file %d\nvar x%d = %d;\n' % (i, i, i) * 20
+                            for i in range(supporting_files)],
+        'x-link-tags': [u'<link href="/static/app/%d.css" rel="stylesheet" />' % i
+                        for i in range(supporting_files)],
+        'x-script-tags': [u'<script src="/static/app/%d.js"></script>' % i
+                          for i in range(supporting_files)],
+    }
+    cobj = FakeContent(data)
+    placeholders = (
+        _PlaceHolder(cobj, 'css', 'text/css'),
+        _PlaceHolder(cobj, 'js', 'text/javascript'),
+        _PlaceHolder(cobj, 'link_tags', 'x-link-tags', u'\n'),
+        _PlaceHolder(cobj, 'script_tags', 'x-script-tags', u'\n'),
+    )
+    for ph in placeholders:
+        ph.count = 1
+        ph.reindent_level = 8
+    head = u'<html><head>%s\n<style>%s</style>\n%s\n<script>%s</script></head>' % (
+        placeholders[2].placeholder, placeholders[0].placeholder,
+        placeholders[3].placeholder, placeholders[1].placeholder,
+    )
+    row = u'<tr><td class="cell">some table data &amp; more</td></tr>\n'
+    body = u'<body><table>%s</table></body></html>' % (row * (body_kb * 1024 // len(row)))
+    return head + body, placeholders
+
+
+def replace_each(text, placeholders):
+    for ph in placeholders:
+        if ph.count:
+            text = text.replace(ph.placeholder, ph.content(), ph.count)
+    return text
+
+
+def main(number=200):
+    print('%-22s %12s %12s' % ('page', 'replace ms', 'single ms'))
+    for body_kb, supporting_files in ((50, 5), (500, 20), (2000, 50)):
+        text, placeholders = make_page(body_kb, supporting_files)
+        assert replace_each(text, placeholders) == substitute_placeholders(text, placeholders)
+        results = []
+        for func in (replace_each, substitute_placeholders):
+            seconds = min(timeit.repeat(lambda: func(text, placeholders), number=number,
+                                        repeat=3))
+            results.append(seconds / number * 1000)
+        label = '%dKB, %d files' % (body_kb, supporting_files)
+        print('%-22s %12.3f %12.3f' % (label, results[0], results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,11 @@ def test_app_usage():
     assert 'shell' in result.stdout
     assert 'static-copy' in result.stdout
     assert 'component-map' in result.stdout, result.stdout
+    assert 'hierarchy-manifest' in result.stdout, result.stdout
+    assert 'hierarchy-stats' in result.stdout, result.stdout
+    assert 'static-fingerprint' in result.stdout, result.stdout
+    assert 'templates-compile' in result.stdout, result.stdout
+    assert 'templates-profile' in result.stdout, result.stdout
 
 
 def test_bad_profile():
@@ -96,6 +101,47 @@ def test_app_routes():
     assert "'/'" in res.stdout, res.stdout
 
 
+def test_app_component_map_cost():
+    res = run_application('minimal2', 'component-map', '--cost')
+    assert "('minimal2', None, None)" in res.stdout, res.stdout
+    assert '(endpoint, total ms, import ms)' in res.stdout, res.stdout
+    assert "('page1', " in res.stdout, res.stdout
+
+
+def test_app_hierarchy_stats():
+    res = run_application('minimal2', 'hierarchy-stats')
+    assert 'hierarchy stats are not enabled' in res.stdout, res.stdout
+    res = run_application('minimal2', 'hierarchy-stats', '-r', '-e')
+    assert "'findview': {" in res.stdout, res.stdout
+    assert "'findview(page1)'" in res.stdout, res.stdout
+
+
+def test_app_static_fingerprint():
+    fpath = os.path.join(script_test_path, 'static_manifest.json')
+    res = run_application('minimal2', 'static-fingerprint', '-o', fpath)
+    assert 'static files fingerprinted, manifest written to' in res.stdout, res.stdout
+    assert 'static_manifest.json' in res.files_created, res.files_created
+
+
+def test_app_hierarchy_manifest():
+    fpath = os.path.join(script_test_path, 'manifest.json')
+    res = run_application('minimal2', 'hierarchy-manifest', '-o', fpath)
+    assert 'manifest written to' in res.stdout, res.stdout
+    assert 'manifest.json' in res.files_created, res.files_created
+
+
+def test_app_templates_compile():
+    dpath = os.path.join(script_test_path, 'compiled')
+    res = run_application('minimal2', 'templates-compile', '-o', dpath)
+    assert 'templates compiled to' in res.stdout, res.stdout
+    assert os.path.join('compiled', 'fingerprint.txt') in res.files_created, res.files_created
+
+
+def test_app_templates_profile():
+    res = run_application('minimal2', 'templates-profile', '-n', '2', '/')
+    assert 'no templates were rendered' in res.stdout, res.stdout
+
+
 if six.PY2:
     class TestProjectCommands(object):
         def check_command(self, projname, template, file_count, look_for, expect_stderr=False):
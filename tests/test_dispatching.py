@@ -1,7 +1,12 @@
+import os
 import sys
 
+from nose.tools import eq_
 from webtest import TestApp
 
+from blazeweb.globals import ag
+from blazeweb.manifest import StartupManifest
+
 from minimal2.application import make_wsgi
 
 
@@ -64,3 +69,41 @@ class TestAltStackWithSession(object):
         # get a new ta so that the cookie is different
         nta = TestApp(self.wsgiapp)
         nta.get('/session3')
+
+
+class TestLazyComponents(object):
+
+    @classmethod
+    def setup_class(cls):
+        make_wsgi('LazyComponents', use_session=False)
+        cls.fpath = ag.app.settings.hierarchy.manifest.fpath
+        if os.path.exists(cls.fpath):
+            os.remove(cls.fpath)
+
+    def test_without_manifest(self):
+        ta = TestApp(make_wsgi('LazyComponents', use_session=False))
+        # without a manifest to get the components' routes from, the
+        # components are loaded at startup
+        eq_(ag.app.ag.loaded_components, None)
+        ta.get('/workingview').mustcontain('hello foo!')
+        ta.get('/news').mustcontain('min2 news index')
+        ta.get('/news/display').mustcontain('np4 display')
+
+    def test_with_manifest(self):
+        make_wsgi('LazyComponents', use_session=False)
+        StartupManifest.build(ag.app).save(self.fpath)
+        try:
+            wsgiapp = make_wsgi('LazyComponents', use_session=False)
+            app = ag.app
+            assert app.ag.hierarchy_manifest is not None
+            eq_(app.ag.loaded_components, set())
+
+            ta = TestApp(wsgiapp)
+            ta.get('/workingview').mustcontain('hello foo!')
+            eq_(app.ag.loaded_components, set())
+
+            ta.get('/news').mustcontain('min2 news index')
+            ta.get('/news/display').mustcontain('np4 display')
+            eq_(app.ag.loaded_components, set(['news']))
+        finally:
+            os.remove(self.fpath)
@@ -1,13 +1,17 @@
+import os
 from os import path
 import sys
+import time
 
 from blazeutils.testing import logging_handler
 from nose.tools import eq_
+import six
 
 from blazeweb.globals import ag
 from blazeweb.hierarchy import findview, HierarchyImportError, findfile, \
     FileNotFound, findobj, listcomponents, list_component_mappings, visitmods, \
-    gatherobjs, findcontent
+    gatherobjs, findcontent, clear_caches, hm, get_topology, FileIndex, \
+    HierarchyAttributeError, HierarchyStats
 
 from newlayout.application import make_wsgi
 from blazewebtestapp.applications import make_wsgi as pta_make_wsgi
@@ -48,15 +52,23 @@ class TestMostStuff(object):
         from compstack.news import somefunc
         assert nlsnews.somefunc is somefunc
 
-    def test_component_import_failures(self):
-        # test non-attribute import
-        try:
-            import compstack.news.views  # noqa
-            assert False
-        except HierarchyImportError as e:
-            if 'non-attribute importing is not supported' not in str(e):
-                raise
+    def test_compstack_module_imports(self):
+        import newlayout.components.news.views as nlviews
+        import newscomp1.views as np1views
+
+        # the virtual modules resolve their attributes in the hierarchy
+        import compstack.news.views
+        assert compstack.news.views.FakeView is nlviews.FakeView
+        assert compstack.news.views.InNewsComp1 is np1views.InNewsComp1
+
+        from compstack import news
+        assert news.views.FakeView is nlviews.FakeView
 
+    def test_builtin_import_untouched(self):
+        assert six.moves.builtins.__import__ is hm._builtin_import
+        assert hm.importer in sys.meta_path
+
+    def test_component_import_failures(self):
         # test no module found
         try:
             from compstack.something.notthere import foobar  # noqa
@@ -71,14 +83,6 @@ class TestMostStuff(object):
         except HierarchyImportError as e:
             assert str(e) == 'attribute "nothere" not found; searched compstack.news.views'
 
-        # test importing from compstack directly
-        try:
-            from compstack import news  # noqa
-            assert False
-        except ImportError as e:
-            if 'No module named compstack' not in str(e).replace("'", ''):
-                raise
-
     def test_appstack_import_overrides(self):
         import newlayout.views as nlviews
         import nlsupporting.views as nlsviews
@@ -87,15 +91,16 @@ class TestMostStuff(object):
         assert nlviews.AppLevelView is AppLevelView
         assert nlsviews.AppLevelView2 is AppLevelView2
 
-    def test_appstack_import_failures(self):
-        # test non-attribute import
-        try:
-            import appstack.views  # noqa
-            assert False
-        except HierarchyImportError as e:
-            if 'non-attribute importing is not supported' not in str(e):
-                raise
+    def test_appstack_module_imports(self):
+        import newlayout.views as nlviews
+
+        import appstack.views
+        assert appstack.views.AppLevelView is nlviews.AppLevelView
+
+        from appstack import views
+        assert views.AppLevelView is nlviews.AppLevelView
 
+    def test_appstack_import_failures(self):
         # test no module found
         try:
             from appstack.notthere import foobar  # noqa
@@ -111,13 +116,33 @@ class TestMostStuff(object):
         except HierarchyImportError as e:
             assert str(e) == 'attribute "notthere" not found; searched appstack.views'
 
-        # test importing from appstack directly
+    def test_missing_module_attributes(self):
+        import appstack.views
+        import compstack.news.views
+        for module in (appstack.views, compstack.news.views):
+            assert not hasattr(module, 'notthere')
+            assert getattr(module, 'notthere', None) is None
+            try:
+                module.notthere
+                assert False
+            except AttributeError as e:
+                assert isinstance(e, HierarchyAttributeError)
+                assert 'attribute "notthere" not found' in str(e), e
+        assert hasattr(appstack.views, 'AppLevelView')
+        # a module missing from the hierarchy is an import error
+        import appstack.notthere
         try:
-            from appstack import views  # noqa
+            appstack.notthere.foo
             assert False
-        except ImportError as e:
-            if 'No module named appstack' not in str(e).replace("'", ''):
-                raise
+        except HierarchyImportError as e:
+            assert str(e) == 'module "notthere" not found; searched appstack', e
+        # a failed "from" import doesn't leave a module for the name behind
+        try:
+            from appstack.views import notthere  # noqa
+            assert False
+        except HierarchyImportError:
+            pass
+        assert 'appstack.views.notthere' not in sys.modules
 
     def test_package_component(self):
         view = findview('news:InNewsComp1')
@@ -156,6 +181,19 @@ class TestMostStuff(object):
 
         assert view1 is view2, (view1, view2)
 
+    def test_endpoint_index(self):
+        view1 = findview('news:InNewsComp2')
+        eq_(ag.hierarchy_endpoint_index[('views', 'news:InNewsComp2')], view1)
+
+        # the index is keyed on where the endpoint was looked up too
+        assert ('content', 'news:InNewsComp2') not in ag.hierarchy_endpoint_index
+
+        eh = logging_handler('blazeweb.hierarchy')
+        view2 = findview('news:InNewsComp2')
+        dmesgs = ''.join(eh.messages['debug'])
+        assert 'endpoint index' in dmesgs, dmesgs
+        assert view1 is view2, (view1, view2)
+
     def test_cache_namespaces(self):
         # this is contrived example, I know
         from appstack.news.views import FakeView
@@ -250,6 +288,40 @@ class TestMostStuff(object):
         assert 'in cache' in dmesgs, dmesgs
         eh.reset()
 
+    def test_findfile_negative_cache(self):
+        eh = logging_handler('blazeweb.hierarchy')
+        for _ in range(2):
+            try:
+                findfile('news:templates/negcache.txt')
+                assert False
+            except FileNotFound:
+                pass
+        dmesgs = ''.join(eh.messages['debug'])
+        eq_(dmesgs.count('not in hierarchy'), 1)
+        assert 'news:templates/negcache.txt' in ag.hierarchy_file_misses
+
+    def test_import_negative_cache(self):
+        eh = logging_handler('blazeweb.hierarchy')
+        for _ in range(2):
+            try:
+                findcontent('news:NegCache')
+                assert False
+            except HierarchyImportError:
+                pass
+        dmesgs = ''.join(eh.messages['debug'])
+        assert 'not in hierarchy' in dmesgs, dmesgs
+        assert 'compstack.news.content:NegCache' in ag.hierarchy_import_misses
+
+    def test_clear_caches(self):
+        findview('news:InNewsComp1')
+        findfile('templates/blank.txt')
+        clear_caches()
+        eq_(ag.hierarchy_endpoint_index, {})
+        eq_(ag.hierarchy_import_cache, {})
+        eq_(ag.hierarchy_file_cache, {})
+        eq_(len(ag.hierarchy_import_misses), 0)
+        eq_(len(ag.hierarchy_file_misses), 0)
+
     def test_findobj(self):
         view = findobj('news:views.FakeView')
         assert 'newlayout.components.news.views.FakeView' in str(view), view
@@ -286,6 +358,23 @@ class TestMostStuff(object):
                  ('nlsupporting', 'news', 'newscomp3')]
         eq_(plist, list_component_mappings('news'))
 
+    def test_topology(self):
+        topology = get_topology()
+        assert topology is ag.hierarchy_topology
+        eq_(topology.apps, ('newlayout', 'nlsupporting'))
+        eq_(topology.apps_reversed, ('nlsupporting', 'newlayout'))
+        eq_(topology.components, ('news', 'pnoroutes', 'badimport'))
+        eq_(topology.component_packages, ('newscomp1', 'newscomp2', 'newscomp3'))
+        eq_(topology.component_mappings['pnoroutes'], (('newlayout', 'pnoroutes', None),))
+        eq_(
+            topology.list_mappings('news', inc_apps=True, reverse=True),
+            (('nlsupporting', 'news', 'newscomp3'), ('nlsupporting', 'news', None),
+             ('nlsupporting', None, None), ('newlayout', 'news', 'newscomp2'),
+             ('newlayout', 'news', 'newscomp1'), ('newlayout', 'news', None),
+             ('newlayout', None, None))
+        )
+        eq_(topology.package_dir('newscomp1'), path.dirname(sys.modules['newscomp1'].__file__))
+
     def test_visitmods(self):
         bset = set(sys.modules.keys())
         visitmods('tovisit')
@@ -437,3 +526,118 @@ def test_visitmods_reloading():
     # we want to make sure that @asview is not creating a new class object
     # each time, but using the cache object that already exists if possible
     eq_(firstid, secondid)
+
+
+def test_visitmods_shared_modules():
+    m2_make_wsgi('SharedModules')
+    rules = sorted(r.rule for r in ag.route_map.iter_rules())
+    assert '/page1' in rules, rules
+    from minimal2.views import page1
+    default = page1.default
+
+    # the other application gets the routes without the module being reloaded
+    m2_make_wsgi('SharedModules')
+    eq_(sorted(r.rule for r in ag.route_map.iter_rules()), rules)
+    assert sys.modules['minimal2.views'].page1.default is default
+
+    # but an application that doesn't share modules still reloads it
+    m2_make_wsgi()
+    eq_(sorted(r.rule for r in ag.route_map.iter_rules()), rules)
+    assert sys.modules['minimal2.views'].page1.default is not default
+
+
+def test_visitmods_reloading_clears_endpoint_index():
+    m2_make_wsgi()
+    view = findview('page2')
+    eq_(ag.hierarchy_endpoint_index[('views', 'page2')], view)
+
+    # pretend another application imported the module last so it gets reloaded
+    sys.modules['minimal2.views']._blazeweb_hierarchy_last_imported_by = None
+    visitmods('views')
+    eq_(ag.hierarchy_endpoint_index, {})
+
+    # the view is resolved again from the reloaded module
+    assert findview('page2') is sys.modules['minimal2.views'].page2
+
+
+class TestFileIndex(object):
+
+    @classmethod
+    def setup_class(cls):
+        make_wsgi('WithFileIndex')
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def test_lookup(self):
+        index = ag.hierarchy_file_index
+        fpath = findfile('news:templates/srcnews.txt')
+        eq_(fpath, index.lookup('news:templates/srcnews.txt'))
+        assert index.covers(path.join('templates', 'index.html'))
+        assert not index.covers(path.join('config', 'settings.py'))
+
+        # directories are indexed too
+        assert findfile('templates').endswith(path.join('newlayout', 'templates'))
+
+        # paths outside the indexed directories are still found
+        assert findfile('config/settings.py').endswith(path.join('config', 'settings.py'))
+
+    def test_miss(self):
+        try:
+            findfile('templates/notindexed.txt')
+            assert False
+        except FileNotFound:
+            pass
+
+    def test_polling(self):
+        tpldir = path.join(get_topology().package_dir('newlayout'), 'templates')
+        fpath = path.join(tpldir, 'fileindex_poll.txt')
+        frozen = FileIndex(get_topology())
+        index = FileIndex(get_topology(), poll_interval=0.01)
+        assert not index.refresh()
+        try:
+            open(fpath, 'w').close()
+            time.sleep(0.02)
+            assert index.refresh()
+            eq_(index.lookup(path.join('templates', 'fileindex_poll.txt')), fpath)
+            assert not frozen.refresh()
+            eq_(frozen.lookup(path.join('templates', 'fileindex_poll.txt')), None)
+        finally:
+            os.remove(fpath)
+
+
+def test_hierarchy_stats():
+    make_wsgi('WithHierarchyStats')
+    stats = ag.hierarchy_stats
+    assert isinstance(stats, HierarchyStats)
+    # lookups done while starting up are counted
+    eq_(stats.functions['visitmods']['calls'], 1)
+    eq_(stats.functions['findobj']['calls'], len(listcomponents()))
+
+    stats.clear()
+    for _ in range(2):
+        findview('news:FakeView')
+        findfile('templates/index.html')
+        try:
+            findcontent('news:StatsNotThere')
+            assert False
+        except HierarchyImportError:
+            pass
+
+    fv = stats.functions['findview']
+    eq_((fv['calls'], fv['hits'], fv['misses']), (2, 1, 1))
+    assert fv['seconds'] >= fv['import_seconds'] > 0
+    ff = stats.functions['findfile']
+    eq_((ff['calls'], ff['hits'], ff['misses']), (2, 1, 1))
+    fc = stats.functions['findcontent']
+    eq_(fc['calls'], 2)
+    assert fc['negative_hits'] >= 1, fc
+
+    eq_(stats.endpoints[('findview', 'news:FakeView')]['calls'], 2)
+    eq_([row[0] for row in stats.costs('findview')], ['news:FakeView'])
+
+
+def test_hierarchy_stats_disabled():
+    make_wsgi()
+    assert ag.hierarchy_stats is None
@@ -0,0 +1,86 @@
+import json
+import os
+
+from nose.tools import eq_
+
+from blazeweb.globals import ag
+from blazeweb.hierarchy import findfile, findview, visitmods
+from blazeweb.manifest import StartupManifest, fingerprint, load_manifest
+
+from newlayout.application import make_wsgi
+
+
+class TestManifest(object):
+
+    @classmethod
+    def setup_class(cls):
+        make_wsgi('WithManifest')
+        cls.fpath = ag.app.settings.hierarchy.manifest.fpath
+        if os.path.exists(cls.fpath):
+            os.remove(cls.fpath)
+        StartupManifest.build(ag.app).save(cls.fpath)
+
+    def test_build(self):
+        with open(self.fpath) as fh:
+            data = json.load(fh)
+        eq_(data['version'], 2)
+        assert 'newlayout.components.pnoroutes.events' in data['missing_modules']
+        assert 'newlayout.events' not in data['missing_modules']
+        # views exist but have a bad import, they shouldn't be considered missing
+        assert 'newlayout.components.badimport.views' not in data['missing_modules']
+        assert 'templates/index.html' in data['files'], data['files'].keys()
+        assert data['files']['news:templates/srcnews.txt'].endswith(
+            os.path.join('news', 'templates', 'srcnews.txt')
+        )
+
+    def test_startup_uses_manifest(self):
+        make_wsgi('WithManifest')
+        manifest = ag.hierarchy_manifest
+        assert manifest is not None
+        assert 'news:templates/srcnews.txt' in ag.hierarchy_file_cache
+        eq_(findfile('news:templates/srcnews.txt'), manifest.files['news:templates/srcnews.txt'])
+        assert 'Index' in str(findview('Index'))
+
+        # modules the manifest says are missing aren't imported
+        def visit(module, **kwargs):
+            visited.append(module.__name__)
+        visited = []
+        visitmods('events', call_with_mod=visit)
+        assert 'newlayout.events' in visited, visited
+        manifest.missing_modules = frozenset(['newlayout.events'])
+        visited = []
+        visitmods('events', call_with_mod=visit)
+        assert 'newlayout.events' not in visited, visited
+        assert ag.app.settings.components.news.bar == 3
+
+    def test_stale_manifest(self):
+        make_wsgi('WithManifest')
+        manifest = StartupManifest.load(self.fpath)
+        eq_(manifest.fingerprint, fingerprint(ag.app.settings))
+        manifest.fingerprint = 'notreal'
+        fpath = self.fpath + '.stale'
+        manifest.save(fpath)
+        ag.app.settings.unlock()
+        ag.app.settings.hierarchy.manifest.fpath = fpath
+        assert load_manifest(ag.app.settings) is None
+
+    def test_fingerprint_files(self):
+        import newlayout
+        pkgdir = os.path.dirname(newlayout.__file__)
+        before = fingerprint(ag.app.settings)
+        for relpath, changes in (
+            (os.path.join('templates', 'index.html'), False),
+            (os.path.join('static', 'statictest.txt'), False),
+            ('views.py', True),
+        ):
+            fpath = os.path.join(pkgdir, relpath)
+            stat = os.stat(fpath)
+            os.utime(fpath, (stat.st_atime, stat.st_mtime + 10))
+            try:
+                eq_(fingerprint(ag.app.settings) != before, changes, relpath)
+            finally:
+                os.utime(fpath, (stat.st_atime, stat.st_mtime))
+
+    def test_disabled(self):
+        make_wsgi()
+        assert ag.hierarchy_manifest is None
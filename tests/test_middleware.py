@@ -1,6 +1,19 @@
+import gzip
+import io
+import os
+import re
+
+from nose.tools import eq_
 from webtest import TestApp
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+from werkzeug.wsgi import FileWrapper
+
+from blazeweb.globals import ag
+from blazeweb.routing import static_url
 
 from newlayout.application import make_wsgi
+from newlayout.config import settings as settingsmod
 
 
 class TestStaticFileServer(object):
@@ -36,3 +49,116 @@ class TestStaticFileServer(object):
     def test_from_external_component(self):
         r = self.ta.get('/static/component/news/statictest5.txt')
         assert 'newscomp3' in r, r
+
+
+class TestFingerprintedStatic(object):
+
+    @classmethod
+    def setup_class(cls):
+        fpath = settingsmod.FingerprintedStatic().static_files.fingerprint.fpath
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        cls.ta = TestApp(make_wsgi('FingerprintedStatic'))
+        cls.manifest = ag.static_manifest
+
+    def test_manifest(self):
+        fppath = self.manifest.paths['app/statictest.txt']
+        assert re.match(r'app/statictest\.[0-9a-f]{12}\.txt$', fppath), fppath
+        assert self.manifest.paths['component/news/statictest5.txt'].startswith(
+            'component/news/statictest5.'
+        )
+        eq_(static_url('app/statictest.txt'), 'static/' + fppath)
+        eq_(static_url('app/notthere.txt'), 'static/app/notthere.txt')
+
+    def test_fingerprinted_file(self):
+        r = self.ta.get('/' + static_url('app/statictest.txt'))
+        assert 'newlayout' in r, r
+        eq_(r.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        r = self.ta.get('/' + static_url('component/news/statictest5.txt'))
+        assert 'newscomp3' in r, r
+
+    def test_original_file(self):
+        r = self.ta.get('/static/app/statictest.txt')
+        assert 'newlayout' in r, r
+        assert 'immutable' not in r.headers['Cache-Control']
+
+    def test_unknown_hash(self):
+        self.ta.get('/static/app/statictest.000000000000.txt', status=404)
+
+
+class TestProductionStaticServer(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.ta = TestApp(make_wsgi('ProductionStatic'))
+        cls.wrapped = []
+
+        def file_wrapper(fh, blksize):
+            cls.wrapped.append(fh.name)
+            return FileWrapper(fh, blksize)
+        cls.environ = {'wsgi.file_wrapper': file_wrapper}
+
+    def test_small_file(self):
+        r = self.ta.get('/static/app/statictest.txt', extra_environ=self.environ)
+        eq_(r.body, b'newlayout\n')
+        eq_(r.headers['Content-Type'], 'text/plain; charset=utf-8')
+        eq_(r.headers['Content-Length'], '10')
+        eq_(r.headers['Cache-Control'], 'public, max-age=43200')
+        assert 'Content-Encoding' not in r.headers
+        assert r.headers['ETag'].startswith('"'), r.headers['ETag']
+        eq_(r.headers['Vary'], 'Accept-Encoding')
+        assert not [f for f in self.wrapped if f.endswith('app/statictest.txt')], self.wrapped
+
+    def test_large_file(self):
+        r = self.ta.get('/static/component/news/statictest.txt', extra_environ=self.environ)
+        assert 'newlayout:news' in r, r
+        assert self.wrapped[-1].endswith('statictest.txt'), self.wrapped
+
+    def test_gzip(self):
+        # webtest would decode the response
+        client = Client(self.ta.app, BaseResponse)
+        r = client.get('/static/app/statictest.txt', headers={'Accept-Encoding': 'gzip'})
+        eq_(r.headers['Content-Encoding'], 'gzip')
+        eq_(gzip.GzipFile(fileobj=io.BytesIO(r.data)).read(), b'newlayout\n')
+        plain = client.get('/static/app/statictest.txt')
+        eq_(plain.data, b'newlayout\n')
+        assert r.headers['ETag'] != plain.headers['ETag']
+
+        r = client.get('/static/app/statictest.txt', headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in r.headers
+
+    def test_not_modified(self):
+        r = self.ta.get('/static/app/statictest.txt')
+        etag = r.headers['ETag']
+        r = self.ta.get('/static/app/statictest.txt', headers={'If-None-Match': etag},
+                        status=304)
+        eq_(r.body, b'')
+        eq_(r.headers['ETag'], etag)
+        self.ta.get('/static/app/statictest.txt', headers={'If-None-Match': '"other"'},
+                    status=200)
+
+        last_modified = r.headers['Last-Modified']
+        self.ta.get('/static/app/statictest.txt', headers={'If-Modified-Since': last_modified},
+                    status=304)
+        self.ta.get('/static/app/statictest.txt',
+                    headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}, status=200)
+
+    def test_head(self):
+        r = self.ta.head('/static/app/statictest.txt')
+        eq_(r.headers['Content-Length'], '10')
+        eq_(r.body, b'')
+
+    def test_not_found(self):
+        self.ta.get('/static/app/notthere.txt', status=404)
+        self.ta.get('/static/app/../app/statictest.txt', status=404)
+        self.ta.get('/static/foo/statictest.txt', status=404)
+
+    def test_traversal(self):
+        client = Client(self.ta.app, BaseResponse)
+        for url in ('/static/app/../config/settings.py',
+                    '/static/component/news/../../config/settings.py',
+                    '/static/app/./statictest.txt',
+                    '/static/app//statictest.txt'):
+            r = client.get(url)
+            eq_(r.status_code, 404, url)
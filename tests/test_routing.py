@@ -1,14 +1,20 @@
 from tests import config
+import itertools
 import unittest
 
 from nose.tools import eq_
+from webtest import TestApp
 from werkzeug import Client
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map
 from werkzeug.test import create_environ
 from werkzeug.wrappers.base_response import BaseResponse
 
-from blazeweb.globals import settings
+from blazeweb.globals import ag, settings
 from blazeweb.routing import (
+    IndexedMapAdapter,
     Rule,
+    StaticRouteIndex,
     current_url,
     prefix_relative_url,
     static_url,
@@ -17,6 +23,7 @@ from blazeweb.routing import (
 from blazeweb.testing import inrequest
 
 from blazewebtestapp.applications import make_wsgi
+from minimal2.application import make_wsgi as m2_make_wsgi
 
 
 class RoutingSettings(config.Testruns):
@@ -50,6 +57,34 @@ class TestRouting(unittest.TestCase):
         self.assertEqual('https://localhost/url1', url_for('mod:Url1', _https=True))
         self.assertEqual('http://localhost/url1', url_for('mod:Url1', _https=False))
 
+    @inrequest()
+    def test_url_cache(self):
+        before = ag.url_cache.stats()
+        for _ in range(2):
+            eq_(url_for('mod:Url1', foo='cached'), '/url1?foo=cached')
+        eq_(url_for('mod:Url1', _https=True, foo='cached'), 'https://localhost/url1?foo=cached')
+        # unhashable values aren't cached
+        eq_(url_for('mod:Url1', foo=['a', 'b']), '/url1?foo=a&foo=b')
+        after = ag.url_cache.stats()
+        eq_(after['hits'] - before['hits'], 1)
+        eq_(after['misses'] - before['misses'], 2)
+
+        # a new rule for the endpoint is used
+        ag.route_map.add(Rule('/url1-alt', endpoint='mod:Url1', defaults={'alt': 1}))
+        eq_(url_for('mod:Url1', alt=1), '/url1-alt')
+
+        eq_(static_url('app/c/x.css'), 'static/app/c/x.css')
+        eq_(static_url('app/c/x.css'), 'static/app/c/x.css')
+        eq_(ag.url_cache.stats()['hits'] - after['hits'], 1)
+
+    @inrequest()
+    def test_url_cache_value_types(self):
+        # 1, 1.0 & True are equal dict keys, but not the same URL
+        for _ in range(2):
+            eq_(url_for('mod:Index', foo=1), '/?foo=1')
+            eq_(url_for('mod:Index', foo=True), '/?foo=True')
+            eq_(url_for('mod:Index', foo=1.0), '/?foo=1.0')
+
 
 class TestRoutingSSL(unittest.TestCase):
 
@@ -204,3 +239,105 @@ class TestProperUrl(object):
     def test_relative_in_request_with_scriptname(self):
         eq_(prefix_relative_url('the-page'), '/script/the-page')
         eq_(prefix_relative_url(''), '/script/')
+
+
+class TestStaticRouteIndex(object):
+
+    def make_map(self, **kwargs):
+        return Map([
+            Rule('/', endpoint='index'),
+            Rule('/about', endpoint='about'),
+            Rule('/post-only', endpoint='post_only', methods=['POST']),
+            Rule('/either', endpoint='either_get', methods=['GET']),
+            Rule('/either', endpoint='either_post', methods=['POST']),
+            Rule('/branch/', endpoint='branch'),
+            Rule('/foo', endpoint='foo'),
+            Rule('/foo/', endpoint='foo_branch'),
+            Rule('/page', endpoint='page', defaults={'num': 1}),
+            Rule('/page/<int:num>', endpoint='page'),
+            Rule('/user/<name>', endpoint='user'),
+            Rule('/user/me', endpoint='me'),
+            Rule('/sub', endpoint='sub', subdomain='api'),
+        ], **kwargs)
+
+    def match_both(self, route_map, path, method='GET', subdomain=''):
+        index = StaticRouteIndex(route_map)
+        server_name = 'example.com' if not subdomain else '%s.example.com' % subdomain
+        adapter = route_map.bind(server_name, path_info=path, default_method=method,
+                                 subdomain=subdomain)
+        results = []
+        for urladapter in (adapter, IndexedMapAdapter(adapter, index)):
+            try:
+                results.append(urladapter.match())
+            except HTTPException as e:
+                results.append((type(e), getattr(e, 'new_url', None)))
+        eq_(results[0], results[1])
+        return results[1], index.match(adapter) is not None
+
+    def test_match_arguments(self):
+        route_map = self.make_map()
+        adapter = route_map.bind('example.com', path_info='/about')
+        calls = []
+        adapter.match = lambda *args, **kwargs: calls.append((args, kwargs)) or 'werkzeug'
+        urladapter = IndexedMapAdapter(adapter, StaticRouteIndex(route_map))
+        eq_(urladapter.match(), ('about', {}))
+        eq_(calls, [])
+        # websocket requests and unindexed paths go to werkzeug with every argument
+        eq_(urladapter.match('/about', 'GET', True, {'a': 1}, websocket=True), 'werkzeug')
+        eq_(urladapter.match('/user/bob', query_args='a=1'), 'werkzeug')
+        eq_(calls, [
+            (('/about', 'GET', True, {'a': 1}), {'websocket': True}),
+            (('/user/bob', None, False, 'a=1'), {}),
+        ])
+
+    def test_same_as_werkzeug(self):
+        for kwargs in ({}, {'strict_slashes': False}, {'redirect_defaults': False}):
+            route_map = self.make_map(**kwargs)
+            eq_(self.match_both(route_map, '/'), (('index', {}), True))
+            eq_(self.match_both(route_map, '/about'), (('about', {}), True))
+            eq_(self.match_both(route_map, '/user/me'), (('me', {}), True))
+            eq_(self.match_both(route_map, '/either', 'POST'), (('either_post', {}), True))
+            eq_(self.match_both(route_map, '/branch/'), (('branch', {}), True))
+            eq_(self.match_both(route_map, '/sub', subdomain='api'), (('sub', {}), True))
+            # without strict slashes, werkzeug matches these without a redirect
+            strict = kwargs.get('strict_slashes', True)
+            eq_(self.match_both(route_map, '/branch')[1], not strict)
+            eq_(self.match_both(route_map, '/foo'), (('foo', {}), True))
+            eq_(self.match_both(route_map, '/foo/')[1], True)
+            eq_(self.match_both(route_map, '/about/')[1], not strict)
+            # these are left to werkzeug
+            eq_(self.match_both(route_map, '/user/bob'), (('user', {'name': 'bob'}), False))
+            assert not self.match_both(route_map, '/post-only')[1]
+            assert not self.match_both(route_map, '/page/1')[1]
+            assert not self.match_both(route_map, '/page')[1]
+            assert not self.match_both(route_map, '/notthere')[1]
+            assert not self.match_both(route_map, '/sub')[1]
+
+    def test_trailing_slashes(self):
+        options = (None, True, False)
+        for map_strict, leaf_strict, branch_strict, branch_methods, leaf_first in \
+                itertools.product((True, False), options, options, (None, ['POST']),
+                                  (True, False)):
+            rules = [
+                Rule('/f', endpoint='leaf', strict_slashes=leaf_strict),
+                Rule('/f/', endpoint='branch', strict_slashes=branch_strict,
+                     methods=branch_methods),
+            ]
+            if not leaf_first:
+                rules.reverse()
+            route_map = Map(rules + [Rule('/', endpoint='index')], strict_slashes=map_strict)
+            for path, method in itertools.product(('/f', '/f/', '/', ''), ('GET', 'POST')):
+                self.match_both(route_map, path, method)
+
+    def test_rules_added_later(self):
+        route_map = self.make_map()
+        index = StaticRouteIndex(route_map)
+        route_map.add(Rule('/later', endpoint='later'))
+        adapter = route_map.bind('example.com', path_info='/later')
+        eq_(index.match(adapter)[0].endpoint, 'later')
+
+    def test_in_application(self):
+        ta = TestApp(m2_make_wsgi())
+        assert isinstance(ag.route_index, StaticRouteIndex)
+        assert ('', None, '/workingview') in ag.route_index.rules
+        ta.get('/workingview').mustcontain('hello foo!')
@@ -1,9 +1,22 @@
+import os
+from os import path
+import re
+import shutil
+
 from blazeutils.testing import raises
 from jinja2 import TemplateNotFound
 from nose.tools import eq_
+from webtest import TestApp
+from werkzeug.test import Client
 
-from blazeweb.content import getcontent
+from blazeweb.content import Content, getcontent, getcontent_cached, getcontent_streamed, \
+    substitute_placeholders, TemplateContent
+from blazeweb.events import signal
+from blazeweb.fragments import CachedFragment, FileFragmentStore
 from blazeweb.globals import user, ag, rg
+from blazeweb.markup import MarkupCache
+from blazeweb.templating.jinja import CompiledHierarchyLoader, compile_templates, \
+    compiled_fingerprint, environment_fingerprint, HierarchyLoader
 from blazeweb.testing import inrequest
 
 
@@ -139,6 +152,31 @@ class TestContent(object):
         assert css == c.css_ph.content()
         assert js == c.js_ph.content(), repr(c.js_ph.content())
 
+    def test_nested_content_buffers(self):
+        child = Content()
+        child.add_content('text/css', u'a {}')
+        parent = Content()
+        parent.primary_type = 'text/html'
+        parent.add_content('text/css', u'b {}')
+        parent.update_nonprimary_from_content(child)
+        # the child's buffer is shared, not copied
+        assert parent.data['text/css']._parts[-1] is child.data['text/css']
+        eq_(parent.get('text/css', u' '), u'b {} a {}')
+
+    def test_substitute_placeholders(self):
+        c = TemplateContent('index.html')
+        c.data['text/css'] = [u'a {}']
+        css_ph, js_ph = c.css_ph, c.js_ph
+        css_ph.count = 2
+        text = u'{0} {1} {0} {0} {1}'.format(css_ph.placeholder, js_ph.placeholder)
+        # only `count` occurrences are replaced and placeholders that weren't
+        # used in the template are left alone
+        eq_(substitute_placeholders(text, c.placeholders()),
+            u'a {{}} {1} a {{}} {0} {1}'.format(css_ph.placeholder, js_ph.placeholder))
+        js_ph.count = 1
+        eq_(substitute_placeholders(js_ph.placeholder, c.placeholders()), u'')
+        eq_(substitute_placeholders(u'no placeholders', c.placeholders()), u'no placeholders')
+
     def test_included_content_default_safe(self):
         c = getcontent('nesting_content.html', endpoint='foo')
         assert 'nc2 autoescape: &amp; False' in c.primary, c.primary
@@ -211,3 +249,403 @@ class TestContent(object):
         input = 'var foo = {{ obj | json }};'
         res = ag.tplengine.render_string(input, {'obj': {'some_key': 'This is json formatted'}})
         eq_(res, 'var foo = {"some_key": "This is json formatted"};')
+
+
+class TestBytecodeCache(object):
+
+    @classmethod
+    def setup_class(cls):
+        make_wsgi('WithBytecodeCache')
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def test_bytecode_cache(self):
+        bcc = ag.tplengine.env.bytecode_cache
+        eq_(bcc.directory, ag.app.settings.jinja.bytecode_cache.dir)
+        ag.tplengine.env.cache.clear()
+        bcc.clear()
+        getcontent('index.html', a='foo')
+        fpath = ag.tplengine.env.loader.find_template_path('index.html')
+        key = bcc.get_cache_key('index.html', fpath)
+        assert path.exists(path.join(bcc.directory, 'blazeweb_%s.cache' % key))
+
+        # a compiled template from the cache renders the same
+        ag.tplengine.env.cache.clear()
+        c = getcontent('index.html', a='foo')
+        assert c.primary == 'app index: foo', c.primary
+
+        # the key changes with the template's mtime
+        mtime = os.stat(fpath).st_mtime
+        try:
+            os.utime(fpath, (mtime + 10, mtime + 10))
+            assert bcc.get_cache_key('index.html', fpath) != key
+        finally:
+            os.utime(fpath, (mtime, mtime))
+
+
+def test_opt_in_caches_disabled():
+    make_wsgi()
+    assert ag.tplengine.env.bytecode_cache is None
+    assert ag.tplengine.env.loader.shared_code is None
+    assert ag.hierarchy_file_index is None
+
+
+class TestFragmentCache(object):
+
+    def setUp(self):
+        ag.fragment_store.clear()
+        self.count = 0
+
+    def counter(self):
+        self.count += 1
+        return self.count
+
+    def test_cache_tag(self):
+        for i in range(2):
+            c = getcontent('fragment_cache.html', counter=self.counter, ttl=None)
+            eq_(c.primary.strip(), 'count: 1')
+            # the CSS included in the fragment is added to the page each time
+            eq_(c.get('text/css').strip(), '/* nesting_content2.css */')
+
+    def test_expired(self):
+        eq_(getcontent('fragment_cache.html', counter=self.counter, ttl=-1).primary.strip(),
+            'count: 1')
+        eq_(getcontent('fragment_cache.html', counter=self.counter, ttl=-1).primary.strip(),
+            'count: 2')
+
+    def test_getcontent_cached(self):
+        c = getcontent_cached('index', None, 'index.html', a='foo')
+        eq_(c.primary, 'app index: foo')
+        c = getcontent_cached('index', None, 'index.html', a='bar')
+        eq_(c.primary, 'app index: foo')
+
+    def test_include_cached(self):
+        for arg1 in ('foo', 'bar'):
+            c = getcontent('fragment_include.html', arg1=arg1)
+            assert 'nc2 arg1: foo' in c.primary, c.primary
+            css = c.get('text/css')
+            assert '/* nesting_content2.css */' in css, css
+            assert '/* nesting_content3.css */' in css, css
+
+    def test_file_store(self):
+        store = FileFragmentStore(path.join(ag.app.settings.dirs.tmp, 'test_fragments'))
+        store.clear()
+        eq_(store.get('foo'), None)
+        store.set('foo', CachedFragment(u'foo', {'text/css': [u'a {}']}), 60)
+        fragment = store.get('foo')
+        eq_(fragment.primary, u'foo')
+        eq_(fragment.data, {'text/css': [u'a {}']})
+        store.set('foo', CachedFragment(u'foo', {}), -1)
+        eq_(store.get('foo'), None)
+
+
+class TestMarkupCache(object):
+
+    def setUp(self):
+        self.calls = []
+
+    def convert(self, text, suffix=''):
+        self.calls.append(text)
+        return u'<p>%s%s</p>' % (text, suffix)
+
+    def test_memory(self):
+        cache = MarkupCache(10)
+        for i in range(2):
+            eq_(cache.convert('test', self.convert, u'foo'), u'<p>foo</p>')
+        eq_(cache.convert('test', self.convert, u'foo', suffix='!'), u'<p>foo!</p>')
+        eq_(self.calls, [u'foo', u'foo'])
+
+    def test_directory(self):
+        dirpath = path.join(ag.app.settings.dirs.tmp, 'test_markup')
+        shutil.rmtree(dirpath, ignore_errors=True)
+        MarkupCache(10, dirpath).convert('test', self.convert, u'bar \u2019')
+        # a new cache, e.g. in another process, uses the file
+        eq_(MarkupCache(10, dirpath).convert('test', self.convert, u'bar \u2019'),
+            u'<p>bar \u2019</p>')
+        eq_(len(self.calls), 1)
+
+    def test_include_rst(self):
+        ag.markup_cache.memory.clear()
+        getcontent('include_rst.html')
+        stats = ag.markup_cache.memory.stats()
+        getcontent('include_rst.html')
+        eq_(ag.markup_cache.memory.stats()['hits'], stats['hits'] + 2)
+
+
+class TestSharedCode(object):
+
+    @classmethod
+    def setup_class(cls):
+        make_wsgi('WithSharedCode')
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def root_code(self, template):
+        # the _RootRenderWrapper around the template's root render function
+        return template.root_render_func.root_render_func.__code__
+
+    def test_shared(self):
+        env1 = ag.tplengine.env
+        make_wsgi('WithSharedCode')
+        env2 = ag.tplengine.env
+        assert env1 is not env2
+        eq_(environment_fingerprint(env1), environment_fingerprint(env2))
+        t1 = env1.get_template('nesting_content.html')
+        t2 = env2.get_template('nesting_content.html')
+        assert t1 is not t2
+        # compiled once, by whichever application loaded it first
+        assert self.root_code(t1) is self.root_code(t2)
+        eq_(t2.environment, env2)
+
+    def test_different_config(self):
+        env = ag.tplengine.env
+        other = env.overlay(trim_blocks=not env.trim_blocks)
+        assert environment_fingerprint(env) != environment_fingerprint(other)
+        assert self.root_code(env.get_template('nesting_content.html')) \
+            is not self.root_code(other.get_template('nesting_content.html'))
+
+
+class TestFrozenTemplates(object):
+
+    @classmethod
+    def setup_class(cls):
+        import newlayout
+        cls.tpl_fpath = path.join(path.dirname(newlayout.__file__), 'templates',
+                                  'frozen_test.html')
+        cls.write_template('first')
+        make_wsgi('FrozenTemplates')
+
+    @classmethod
+    def teardown_class(cls):
+        os.remove(cls.tpl_fpath)
+        make_wsgi()
+
+    @classmethod
+    def write_template(cls, text):
+        with open(cls.tpl_fpath, 'w') as fh:
+            fh.write(text)
+        # make sure the mtime changes
+        mtime = os.stat(cls.tpl_fpath).st_mtime + 10
+        os.utime(cls.tpl_fpath, (mtime, mtime))
+
+    def test_frozen(self):
+        env = ag.tplengine.env
+        assert not env.auto_reload
+        # a cache_size of -1 is a dict that keeps every template
+        assert isinstance(env.cache, dict), env.cache
+        eq_(getcontent('frozen_test.html').primary, 'first')
+        eq_(env.get_template('frozen_test.html')._uptodate, None)
+
+        self.write_template('second')
+        eq_(getcontent('frozen_test.html').primary, 'first')
+
+        signal('blazeweb.templating.reload').send()
+        eq_(getcontent('frozen_test.html').primary, 'second')
+
+    def test_reload_file(self):
+        self.write_template('third')
+        watcher = ag.template_reload_watcher
+        # not checked again right away
+        assert not watcher.check()
+
+        with open(ag.app.settings.templating.reload_file, 'w'):
+            pass
+        mtime = (watcher.mtime or 0) + 100
+        os.utime(ag.app.settings.templating.reload_file, (mtime, mtime))
+        watcher.next_check = 0
+        assert watcher.check()
+        eq_(getcontent('frozen_test.html').primary, 'third')
+
+    def test_reload_two_apps(self):
+        first = ag.app
+        make_wsgi('FrozenTemplates')
+        second = ag.app
+        envs = [first.ag.tplengine.env, second.ag.tplengine.env]
+        self.write_template('fourth')
+        signal('blazeweb.templating.reload').send()
+        first.ag.events_namespace.signal('blazeweb.templating.reload').send()
+        eq_([env.get_template('frozen_test.html').render() for env in envs],
+            ['fourth', 'fourth'])
+
+        # the first app's signal, sent while the second app's globals are
+        # current, only reloads the first app's templates
+        self.write_template('fifth')
+        for app in (first, second):
+            app.ag.hierarchy_file_cache['reload-test'] = app
+        first.ag.events_namespace.signal('blazeweb.templating.reload').send()
+        eq_([env.get_template('frozen_test.html').render() for env in envs],
+            ['fifth', 'fourth'])
+        assert 'reload-test' not in first.ag.hierarchy_file_cache
+        assert second.ag.hierarchy_file_cache.pop('reload-test') is second
+        assert ag.app is second
+
+
+class TestCompiledTemplates(object):
+
+    @classmethod
+    def setup_class(cls):
+        # the templates have to be compiled for the same settings profile
+        make_wsgi('CompiledTemplates')
+        cls.compiled_dir = ag.app.settings.templating.compiled.dir
+        cls.count = compile_templates(cls.compiled_dir)
+        make_wsgi('CompiledTemplates')
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def test_compiled(self):
+        loader = ag.tplengine.env.loader
+        assert isinstance(loader, CompiledHierarchyLoader), loader
+        eq_(self.count, len(loader.list_templates()))
+        assert 'news:template.html' in loader.list_templates()
+        # loads without going through the source
+        loader.modules.load(ag.tplengine.env, 'index.html')
+
+    def test_render(self):
+        c = getcontent('index.html', a='foo')
+        eq_(c.primary, 'app index: foo')
+        c = getcontent('test_super.html')
+        eq_(c.primary.strip(), 'The Title |')
+        body = getcontent('nesting_content.html', endpoint='foo').primary
+        assert '/* nesting_content3.css */' in body, body
+
+    def test_fingerprint(self):
+        import newlayout
+        pkgdir = path.dirname(newlayout.__file__)
+        before = compiled_fingerprint()
+        for relpath, changes in (
+            (path.join('static', 'statictest.txt'), False),
+            ('views.py', False),
+            (path.join('templates', 'index.html'), True),
+        ):
+            fpath = path.join(pkgdir, relpath)
+            stat = os.stat(fpath)
+            os.utime(fpath, (stat.st_atime, stat.st_mtime + 10))
+            try:
+                eq_(compiled_fingerprint() != before, changes, relpath)
+            finally:
+                os.utime(fpath, (stat.st_atime, stat.st_mtime))
+
+    def test_stale(self):
+        fpath = path.join(self.compiled_dir, 'fingerprint.txt')
+        with open(fpath, 'w') as fh:
+            fh.write('stale')
+        try:
+            make_wsgi('CompiledTemplates')
+            assert isinstance(ag.tplengine.env.loader, HierarchyLoader), ag.tplengine.env.loader
+            eq_(getcontent('index.html', a='foo').primary, 'app index: foo')
+        finally:
+            compile_templates(self.compiled_dir)
+            make_wsgi('CompiledTemplates')
+
+
+class TestBundles(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.ta = TestApp(make_wsgi('WithBundles'))
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def bundle_urls(self, body):
+        css = re.findall(r'<link href="/static/(bundles/[0-9a-f]{12}\.css)"', body)
+        js = re.findall(r'<script src="/static/(bundles/[0-9a-f]{12}\.js)"', body)
+        return css, js
+
+    def test_bundles(self):
+        c = getcontent('nesting_content.html', endpoint='foo')
+        body = c.primary
+        # the collected CSS & JS isn't in the page
+        assert '/* nesting_content.css */' not in body, body
+        assert '// nesting_content.js' not in body, body
+        # the linked files still are
+        assert 'href="/static/linked_nesting_content.css"' in body, body
+
+        (css_path, ), (js_path, ) = self.bundle_urls(body)
+        # the bundle comes after the linked files, where the inline CSS was
+        assert body.index(css_path) > body.index('linked_nesting_content3.css'), body
+        with open(path.join(ag.app.settings.dirs.static, css_path)) as fh:
+            css = fh.read()
+        assert css.index('/* nesting_content.css */') < css.index('/* nesting_content3.css */')
+        assert '// nesting_content2.js' in self.ta.get('/static/' + js_path)
+
+        # the same content gives the same bundle
+        eq_(self.bundle_urls(getcontent('nesting_content.html', endpoint='foo').primary),
+            ([css_path], [js_path]))
+
+    def test_no_tag_placeholder(self):
+        # without head_link_tags() there is nowhere to link to a bundle from
+        body = getcontent('direct_include.html').primary
+        assert '/* nesting_content2.css */' in body, body
+        eq_(self.bundle_urls(body), ([], []))
+
+
+class TestStreaming(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.ta = TestApp(make_wsgi('Streaming'))
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def test_streamed(self):
+        c = getcontent_streamed('nesting_content.html', endpoint='foo')
+        chunks = list(c.stream)
+        assert len(chunks) > 1, chunks
+        body = u''.join(chunks)
+        head, rest = body.split('</head>')
+        # included before the head was sent, so in its placeholders
+        assert '/* nesting_content.css */' in head, head
+        assert 'href="/static/linked_nesting_content.css"' in head, head
+        # included from the body, after the head was sent
+        assert '/* nesting_content2.css */' not in head, head
+        late = rest[rest.index('<style type="text/css">'):rest.index('</body>')]
+        assert '/* nesting_content2.css */' in late, late
+        assert '/* nesting_content3.css */' in late, late
+        assert '// nesting_content2.js' in rest[:rest.index('</body>')], rest
+        assert 'placeholder' not in body, body
+
+    def test_view(self):
+        # webtest would add a Content-Length
+        app_iter, status, headers = Client(self.ta.app).get('/index/nesting_content.html')
+        eq_(headers.get('Content-Length'), None)
+        chunks = list(app_iter)
+        assert len(chunks) > 1, chunks
+        body = b''.join(chunks).decode('utf-8')
+        assert '/* nesting_content.css */' in body.split('</head>')[0], body
+        assert '/* nesting_content2.css */' in body, body
+
+
+class TestRenderProfiler(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.ta = TestApp(make_wsgi('TemplateProfiler'))
+
+    @classmethod
+    def teardown_class(cls):
+        make_wsgi()
+
+    def test_profile(self):
+        ag.template_profiler.clear()
+        r = self.ta.get('/index/nesting_content.html')
+        header = r.headers['X-Template-Profile']
+        assert 'template:nesting_content.html=' in header, header
+        assert 'block:nesting_content.html:body=' in header, header
+        assert 'content:nesting_content2.html=' in header, header
+        assert 'placeholders:nesting_content.html=' in header, header
+
+        self.ta.get('/index/nesting_content.html')
+        costs = dict((row[0], row[1:]) for row in ag.template_profiler.costs('Index'))
+        eq_(costs['template:nesting_content.html'][0], 2)
+        # the layout it extends
+        eq_(costs['template:default.html'][0], 2)
@@ -1,12 +1,16 @@
 from __future__ import with_statement
+import json
+import os
 from os import path
 
 from nose.tools import eq_
+from six.moves import cPickle as pickle
 from webtest import TestApp
 
 from blazeweb.globals import rg
 from blazeweb.testing import inrequest
 from blazeweb.utils import exception_with_context, exception_context_filter
+from blazeweb.utils.datastructures import ContentBuffer, LRUCache
 from blazeweb.utils.filesystem import copy_static_files, mkdirs
 
 from scripting_helpers import script_test_path, env
@@ -75,6 +79,38 @@ class TestFirstApp(object):
         # other items in the static directory are still there
         assert path.exists(root_fpath)
 
+    def test_incremental_copy(self):
+        result = copy_static_files()
+        assert 'app/statictest.txt' in result['copied'], result
+        eq_(result['unchanged'], [])
+
+        # nothing changed, so nothing is copied
+        result = copy_static_files()
+        eq_(result['copied'], [])
+        assert 'component/news/statictest5.txt' in result['unchanged'], result
+
+        # a deleted copy is copied again
+        app_fpath = path.join(script_test_path, 'newlayout', 'static', 'app', 'statictest.txt')
+        os.remove(app_fpath)
+        eq_(copy_static_files()['copied'], ['app/statictest.txt'])
+        assert_contents('newlayout', app_fpath)
+
+        # a copied file that is no longer in the hierarchy is deleted
+        manifest_fpath = path.join(script_test_path, 'newlayout', 'writeable', 'data',
+                                   'static_copy_manifest.json')
+        with open(manifest_fpath) as fh:
+            manifest = json.load(fh)
+        manifest['app/old/removed.txt'] = manifest['app/statictest.txt']
+        with open(manifest_fpath, 'w') as fh:
+            json.dump(manifest, fh)
+        removed_fpath = path.join(script_test_path, 'newlayout', 'static', 'app', 'old',
+                                  'removed.txt')
+        mkdirs(path.dirname(removed_fpath))
+        open(removed_fpath, 'w').close()
+        result = copy_static_files()
+        eq_(result['deleted'], ['app/old/removed.txt'])
+        assert not path.exists(path.dirname(removed_fpath))
+
     def test_static_server(self):
         copy_static_files(delete_existing=True)
         r = self.ta.get('/static/app/statictest.txt')
@@ -159,3 +195,124 @@ class TestExceptionContext(object):
         data = {'foo': 'bar', 'password': '123', 'secret_key': '456'}
         filtered_data = exception_context_filter(data)
         eq_(filtered_data, {'foo': 'bar', 'password': '<removed>', 'secret_key': '<removed>'})
+
+
+class TestContentBuffer(object):
+
+    def test_join(self):
+        b = ContentBuffer([u'a', u'b'])
+        eq_(b.join(), u'ab')
+        assert b.join() is b.join()
+        eq_(b.join(u'\n'), u'a\nb')
+        b.append(u'c')
+        eq_(b.join(u'\n'), u'a\nb\nc')
+        b[0] = u'z'
+        eq_(b.join(u'\n'), u'z\nb\nc')
+        del b[0]
+        eq_(b.join(u'\n'), u'b\nc')
+        b += [u'd']
+        eq_(b.join(), u'bcd')
+        b.insert(0, u'a')
+        eq_(b.join(), u'abcd')
+        b.pop()
+        eq_(b.join(), u'abc')
+        b.remove(u'b')
+        eq_(b.join(), u'ac')
+        b.reverse()
+        eq_(b.join(), u'ca')
+        b.sort()
+        eq_(b.join(), u'ac')
+        b *= 2
+        eq_(b.join(), u'acac')
+        b[1:3] = [u'x']
+        eq_(b.join(), u'axc')
+        del b[:1]
+        eq_(b.join(), u'xc')
+        b.clear()
+        eq_(b.join(), u'')
+
+    def test_extend(self):
+        child = ContentBuffer([u'a', u'b'])
+        joined = child.join()
+        parent = ContentBuffer()
+        parent.extend(child)
+        # the empty buffer takes over what the child joined
+        assert parent.join() is joined
+        parent.extend(child)
+        eq_(parent.join(), u'abab')
+        eq_(child.join(), u'ab')
+
+    def test_shared(self):
+        grandchild = ContentBuffer([u'a'])
+        child = ContentBuffer([u'b'])
+        child.extend(grandchild)
+        parent = ContentBuffer([u'c'])
+        parent.extend(child)
+        # kept by reference, not copied
+        assert parent._parts[-1] is child
+        eq_(parent.join(u','), u'c,b,a')
+        eq_(len(parent), 3)
+        eq_(list(parent), [u'c', u'b', u'a'])
+        eq_(parent[1:], [u'b', u'a'])
+        eq_(parent, [u'c', u'b', u'a'])
+        # later changes to an included buffer are seen
+        grandchild.append(u'x')
+        eq_(parent.join(u','), u'c,b,a,x')
+        # an empty buffer doesn't add a separator
+        parent.extend(ContentBuffer())
+        eq_(parent.join(u','), u'c,b,a,x')
+        # changing the parent's items leaves the included buffers alone
+        parent.reverse()
+        eq_(parent.join(u','), u'x,a,b,c')
+        eq_(list(parent), [u'x', u'a', u'b', u'c'])
+        eq_(child.join(u','), u'b,a,x')
+
+    def test_extend_cycle(self):
+        b = ContentBuffer([u'a'])
+        b.extend(b)
+        eq_(b, [u'a', u'a'])
+        parent = ContentBuffer([u'p'])
+        child = ContentBuffer([u'c'])
+        parent.extend(child)
+        # referring back to the parent would be a cycle, so it is copied
+        child.extend(parent)
+        eq_(child.join(), u'cpc')
+        eq_(parent.join(), u'pcpc')
+
+    def test_pickle(self):
+        child = ContentBuffer([u'a'])
+        parent = ContentBuffer([u'b'])
+        parent.extend(child)
+        parent.join()
+        copy = pickle.loads(pickle.dumps(parent, pickle.HIGHEST_PROTOCOL))
+        eq_(copy.join(), u'ba')
+        copy.append(u'c')
+        eq_(copy.join(), u'bac')
+
+
+class TestLRUCache(object):
+
+    def test_eviction(self):
+        c = LRUCache(2)
+        c['a'] = 1
+        c['b'] = 2
+        # makes "a" the most recently used item
+        eq_(c.get('a'), 1)
+        c['c'] = 3
+        assert 'a' in c
+        assert 'b' not in c
+        assert 'c' in c
+        eq_(len(c), 2)
+
+    def test_stats(self):
+        c = LRUCache(10)
+        c['a'] = 1
+        c.get('a')
+        c.get('b')
+        eq_(c.get('b', 'default'), 'default')
+        eq_(c.stats(), {'size': 1, 'maxsize': 10, 'hits': 1, 'misses': 2})
+
+    def test_zero_size(self):
+        c = LRUCache(0)
+        c['a'] = 1
+        eq_(len(c), 0)